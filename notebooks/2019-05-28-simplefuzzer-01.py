@@ -270,23 +270,17 @@ if __name__ == '__main__':
 # ourselves as we show next.
 
 # First, we define an iterative version of the tree_to_string function called `iter_tree_to_str()` as below.
-def modifiable(tree):
-    name, children, *rest = tree
-    if not is_nonterminal(name): return [name, []]
-    else:
-      return [name, [modifiable(c) for c in children]]
-
-def iter_tree_to_str(tree_):
-    tree = modifiable(tree_)
+# We keep the nodes yet to be expanded in a stack, with the leftmost node on
+# top. So, the children are pushed in the reverse order.
+def iter_tree_to_str(tree):
     expanded = []
     to_expand = [tree]
     while to_expand:
-        (key, children, *rest), *to_expand = to_expand
+        key, children, *rest = to_expand.pop()
         if is_nonterminal(key):
             #assert children # not necessary
-            to_expand = children + to_expand
+            to_expand.extend(reversed(children))
         else:
-            assert not children
             expanded.append(key)
     return ''.join(expanded)
 
@@ -294,7 +288,11 @@ def iter_tree_to_str(tree_):
 if __name__ == '__main__':
     print(iter_tree_to_str(('<start>', [('<json>', [('<element>', [('<ws>', [('<sp1>', [(' ', [])]), ('<ws>', [])]), ('<value>', [('null', [])]), ('<ws>', [])])])])))
 
-# Next, we add the `iter_gen_key()` to `LimitFuzzer`
+# Next, we add the `iter_gen_key()` to `LimitFuzzer`. The items to be expanded
+# are kept in a queue (a `deque` so that we can take items from the front in
+# constant time).
+
+import collections
 
 class LimitFuzzer(LimitFuzzer):
     def iter_gen_key(self, key, max_depth):
@@ -305,10 +303,10 @@ class LimitFuzzer(LimitFuzzer):
                 return [t, []]
 
         root = [key, None]
-        queue = [(0, root)]
+        queue = collections.deque([(0, root)])
         while queue:
             # get one item to expand from the queue
-            (depth, item), *queue = queue
+            depth, item = queue.popleft()
             key = item[0]
             if item[1] is not None: continue
             grammar = self.grammar if depth < max_depth else self.cheap_grammar
@@ -333,4 +331,329 @@ if __name__ == '__main__':
        print(gf.iter_fuzz(key='<start>', max_depth=100))
 
 
+# ## A Faster Fuzzer
+#
+# When generating a large number of inputs, the overhead of the fuzzer itself
+# starts to matter. The fuzzers above check whether each token is a
+# nonterminal every time it is expanded, and build a tree of nested lists
+# even when all we want is the string. So, we first compile the grammar
+# once. Each symbol gets an integer id, with the nonterminals first, so that
+# a symbol is a nonterminal if its id is less than the number of
+# nonterminals. Each rule becomes a tuple of ids. The rules are kept in the
+# same order as in the grammar, so that the random choices are the same as
+# before. We also keep the encoded terminals for generating bytes.
+
+class LimitFuzzer(LimitFuzzer):
+    def compiled(self):
+        if getattr(self, '_compiled', None) is not None: return self._compiled
+        names = list(self.grammar)
+        ids = {k:i for i,k in enumerate(names)}
+        for k in self.grammar:
+            for rule in self.grammar[k]:
+                for t in rule:
+                    if t not in ids:
+                        ids[t] = len(names)
+                        names.append(t)
+        n_nt = len(self.grammar)
+        rules = [[tuple(ids[t] for t in r) for r in self.grammar[k]]
+                 for k in names[:n_nt]]
+        cheap = [[tuple(ids[t] for t in r) for r in self.cheap_grammar[k]]
+                 for k in names[:n_nt]]
+        encoded = [t.encode() for t in names]
+        self._compiled = (names, ids, n_nt, rules, cheap, encoded)
+        return self._compiled
+
+# ### Generating strings directly
+#
+# If we only need the string, we do not need the tree at all. We keep a stack
+# of the symbols yet to be expanded, along with their depths, with the
+# leftmost symbol on top. Each terminal that reaches the top is written out
+# immediately. As in `iter_gen_key()`, a symbol at a depth less than
+# `max_depth` is expanded using any rule, and beyond that using only the
+# cheapest rules. Note that since the symbols are expanded in a different
+# order (depth first rather than breadth first), the random choices are made
+# in a different order. Hence, for the same random seed, the generated string
+# will be different from `iter_fuzz()`, but it comes from the same
+# distribution.
+#
+# The output is written to `out`, which can be any text stream such as
+# `io.StringIO`, or any binary stream such as `io.BytesIO` or a file opened
+# in binary mode. Any other object with a `write()` method is given strings.
+
+import io
+
+def is_binary_stream(out):
+    if isinstance(out, io.TextIOBase): return False
+    if isinstance(out, (io.BufferedIOBase, io.RawIOBase)): return True
+    return 'b' in getattr(out, 'mode', '')
+
+class LimitFuzzer(LimitFuzzer):
+    def fuzz_to(self, out, key='<start>', max_depth=10):
+        names, ids, n_nt, rules, cheap, encoded = self.compiled()
+        if is_binary_stream(out): names = encoded
+        write, choice = out.write, random.choice
+        stack = [(ids[key], 0)]
+        while stack:
+            sym, depth = stack.pop()
+            if sym >= n_nt:
+                write(names[sym])
+                continue
+            rule = choice(rules[sym] if depth < max_depth else cheap[sym])
+            for t in reversed(rule):
+                stack.append((t, depth + 1))
+
+    def fast_fuzz(self, key='<start>', max_depth=10):
+        out = io.StringIO()
+        self.fuzz_to(out, key, max_depth)
+        return out.getvalue()
+
+# Using it.
+
+if __name__ == '__main__':
+    gf = LimitFuzzer(grammar)
+    for i in range(10):
+       print(gf.fast_fuzz(key='<start>', max_depth=10))
+    out = io.BytesIO()
+    gf.fuzz_to(out, key='<start>', max_depth=10)
+    print(out.getvalue())
+    chunks = []
+    class Collector:
+        def write(self, s): chunks.append(s)
+    gf.fuzz_to(Collector(), key='<start>', max_depth=10)
+    assert all(isinstance(c, str) for c in chunks)
+
+# ### Flat derivation trees
+#
+# When we need the derivation trees, we can still avoid the nested lists. In
+# the breadth first expansion of `iter_gen_key()`, the children of each node
+# are created together, and they are expanded in the order in which they were
+# created. So, we can keep the nodes in flat parallel arrays, where the
+# children of each node are consecutive, and each node only needs to remember
+# where its children start, and how many there are. The arrays themselves
+# serve as the queue. We expand the nodes in order, appending the children of
+# each node to the end, until there is nothing left to expand.
+
+import array
+
+class FlatTree:
+    def __init__(self, names):
+        self.names = names
+        self.symbol = array.array('i')
+        self.depth = array.array('i')
+        self.first = array.array('i')
+        self.count = array.array('i')
+
+    def add(self, sym, depth):
+        self.symbol.append(sym)
+        self.depth.append(depth)
+        self.first.append(0)
+        self.count.append(0)
+
+    def __len__(self):
+        return len(self.symbol)
+
+class LimitFuzzer(LimitFuzzer):
+    def gen_flat_tree(self, key='<start>', max_depth=10):
+        names, ids, n_nt, rules, cheap, encoded = self.compiled()
+        tree = FlatTree(names)
+        tree.add(ids[key], 0)
+        symbol, depth_, first, count = tree.symbol, tree.depth, tree.first, tree.count
+        choice = random.choice
+        i = 0
+        while i < len(symbol):
+            sym, depth = symbol[i], depth_[i]
+            if sym < n_nt:
+                rule = choice(rules[sym] if depth < max_depth else cheap[sym])
+                first[i], count[i] = len(symbol), len(rule)
+                for t in rule: tree.add(t, depth + 1)
+            i += 1
+        return tree
+
+# Since the nodes are expanded in the same order as in `iter_gen_key()`, the
+# random choices are also made in the same order. Hence, for the same random
+# seed, we get the same tree. We can convert the flat tree to the nested
+# representation when necessary. Since the children of a node always come
+# after the node, we can build the nested nodes from the last to the first
+# without recursion. Similarly, `to_str()` uses a stack, and does not need
+# the nested representation.
+
+class FlatTree(FlatTree):
+    def to_tree(self):
+        nodes = [None] * len(self)
+        for i in range(len(self) - 1, -1, -1):
+            f = self.first[i]
+            name = self.names[self.symbol[i]]
+            if is_nonterminal(name):
+                nodes[i] = [name, nodes[f:f + self.count[i]]]
+            else:
+                nodes[i] = [name, []]
+        return nodes[0]
+
+    def to_str(self):
+        names, symbol, first, count = self.names, self.symbol, self.first, self.count
+        expanded = []
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if count[i]:
+                stack.extend(range(first[i] + count[i] - 1, first[i] - 1, -1))
+            elif not is_nonterminal(names[symbol[i]]):
+                expanded.append(names[symbol[i]])
+        return ''.join(expanded)
+
+# We verify that the flat tree is the same as the tree from `iter_gen_key()`.
+
+if __name__ == '__main__':
+    gf = LimitFuzzer(grammar)
+    for i in range(100):
+        random.seed(i)
+        t1 = gf.iter_gen_key(key='<start>', max_depth=10)
+        random.seed(i)
+        t2 = gf.gen_flat_tree(key='<start>', max_depth=10)
+        assert t2.to_tree() == t1
+        assert t2.to_str() == iter_tree_to_str(t1) == tree_to_string(t1)
+        random.seed(i)
+        s = gf.fast_fuzz(key='<start>', max_depth=10)
+        random.seed(i)
+        out = io.BytesIO()
+        gf.fuzz_to(out, key='<start>', max_depth=10)
+        assert out.getvalue() == s.encode()
+
+# ### Benchmark
+#
+# We compare the throughput of the fuzzers, in inputs per second and bytes
+# per second. The first set of inputs are of the usual size, while the second
+# set uses a grammar that produces much larger inputs.
+
+expr_grammar = {
+    '<start>': [['<expr>']],
+    '<expr>': [['<expr>', '+', '<expr>'], ['<expr>', '*', '<expr>'],
+               ['(', '<expr>', ')'], ['1']]
+}
+
+if __name__ == '__main__':
+    import time
+    for g, n, max_depth in [(grammar, 2000, 10), (expr_grammar, 10, 30)]:
+        gf = LimitFuzzer(g)
+        for name, fn in [
+                ('fuzz', lambda: gf.fuzz(key='<start>', max_depth=max_depth)),
+                ('iter_fuzz', lambda: gf.iter_fuzz(key='<start>', max_depth=max_depth)),
+                ('gen_flat_tree', lambda: gf.gen_flat_tree(key='<start>', max_depth=max_depth).to_str()),
+                ('fast_fuzz', lambda: gf.fast_fuzz(key='<start>', max_depth=max_depth))]:
+            random.seed(0)
+            t0 = time.perf_counter()
+            size = sum(len(fn()) for i in range(n))
+            t1 = time.perf_counter()
+            print('%s max_depth=%d: %d inputs/s %d bytes/s' % (
+                name, max_depth, n / (t1 - t0), size / (t1 - t0)))
+
+# ## Computing the cost in linear time
+#
+# The `compute_cost()` above is simple, but it can be very slow for large
+# grammars. Each call to `symbol_cost()` creates a new `seen` set, and the
+# cost of a nonterminal is computed again for each path by which it is
+# reached, except when it happens to be in the cache. Further, the cache is
+# keyed by the string form of the rule.
+#
+# The cost of a nonterminal is the height of the smallest derivation tree
+# from that nonterminal, and we can compute it bottom up, the same way one
+# computes the shortest paths in a graph. The nonterminals are finalized in
+# the order of their cost. A nonterminal without any rules costs `0`, and a
+# rule without any nonterminals costs `1`. For each rule, we keep the number
+# of distinct nonterminals in the rule that are not yet finalized. When a
+# nonterminal is finalized with cost `c`, this number goes down for every
+# rule that uses it. When it reaches zero, the nonterminal we just finalized
+# has the largest cost among the nonterminals in the rule, and hence the rule
+# costs `c + 1`. The head of the rule is then a candidate for being finalized
+# with cost `c + 1`. Since the candidates for cost `c + 1` are produced only
+# while finalizing the nonterminals with cost `c`, a simple list for each
+# level is enough. The rules that never reach zero (and the nonterminals with
+# only such rules) can not produce a finite tree, and cost `inf`.
+#
+# Each rule is visited once for every distinct nonterminal it contains, so the
+# whole computation is linear in the size of the grammar. The costs are
+# returned as a list for each nonterminal, indexed by the rule number.
+
+import math
+
+def compute_rule_cost(grammar):
+    rule_cost = {k: [math.inf] * len(grammar[k]) for k in grammar}
+    pending = {k: [0] * len(grammar[k]) for k in grammar}
+    uses = {k: [] for k in grammar}
+    level = [k for k in grammar if not grammar[k]]
+    next_level = []
+    for k in grammar:
+        for i, rule in enumerate(grammar[k]):
+            nts = {t for t in rule if t in grammar}
+            pending[k][i] = len(nts)
+            for t in nts: uses[t].append((k, i))
+            if not nts:
+                rule_cost[k][i] = 1
+                next_level.append(k)
+    cost, finalized = 0, set()
+    while level or next_level:
+        for k in level:
+            if k in finalized: continue
+            finalized.add(k)
+            for k_, i in uses[k]:
+                pending[k_][i] -= 1
+                if pending[k_][i] == 0:
+                    rule_cost[k_][i] = cost + 1
+                    next_level.append(k_)
+        level, next_level, cost = next_level, [], cost + 1
+    return rule_cost
+
+# The `compute_cost()` returns the costs in the same form as before, keyed
+# by the string form of the rule, so that it can be used as a drop in
+# replacement. We keep the recursive version as `compute_cost_recursive()`.
+
+compute_cost_recursive = compute_cost
+
+def compute_cost(grammar):
+    rule_cost = compute_rule_cost(grammar)
+    return {k: {str(rule): c for rule, c in zip(grammar[k], rule_cost[k])}
+            for k in grammar}
+
+# We verify that both produce the same costs.
+
+if __name__ == '__main__':
+    nonterminating = {
+        '<start>': [['<a>'], ['<b>', '<c>']],
+        '<a>': [['<a>', 'x'], ['<b>']],
+        '<b>': [['<b>', '<a>']],
+        '<c>': [['y'], ['<d>']],
+        '<d>': []
+    }
+    for g in [grammar, expr_grammar, nonterminating]:
+        assert compute_cost(g) == compute_cost_recursive(g)
+    print(compute_cost(nonterminating))
+
+# Here is a grammar with a long chain of nonterminals. The time taken by the
+# recursive version grows exponentially with the length of the chain.
+
+def chain_grammar(n):
+    g = {'<start>': [['<n0>']]}
+    for i in range(n):
+        g['<n%d>' % i] = [['<n%d>' % (i + 1), '<n%d>' % (i + 2)],
+                          ['<n%d>' % (i + 1)], ['<n0>', 'x']]
+    g['<n%d>' % n] = [['x']]
+    g['<n%d>' % (n + 1)] = [['y']]
+    return g
+
+if __name__ == '__main__':
+    for n in [6, 8, 10]:
+        g = chain_grammar(n)
+        t0 = time.perf_counter()
+        c = compute_cost(g)
+        t1 = time.perf_counter()
+        assert c == compute_cost_recursive(g)
+        t2 = time.perf_counter()
+        print('%d nonterminals: %.4fs recursive: %.4fs' % (len(g), t1 - t0, t2 - t1))
+    for n in [100, 2000]:
+        g = chain_grammar(n)
+        t0 = time.perf_counter()
+        c = compute_cost(g)
+        t1 = time.perf_counter()
+        print('%d nonterminals: %.4fs' % (len(g), t1 - t0))
+
 # The runnable Python source for this notebook is available [here](https://github.com/rahulgopinath/rahulgopinath.github.io/blob/master/notebooks/2019-05-28-simplefuzzer-01.py)
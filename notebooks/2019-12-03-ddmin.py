@@ -306,6 +306,73 @@ if __name__ == '__main__':
 
 
  
+# ## Using an Oracle
+#
+# When the predicate is expensive, we can check all complements of a single
+# round in parallel, and remember the results for inputs we have already
+# seen. The `Oracle` from the [HDD post](/post/2019/12/04/hdd/) does both.
+
+#@
+# https://rahul.gopinath.org/py/simplefuzzer-0.0.1-py2.py3-none-any.whl
+# https://rahul.gopinath.org/py/hdd-0.0.1-py2.py3-none-any.whl
+
+import hdd
+
+# We redefine `remove_check_each_fragment()` so that it produces all the
+# complements first, and then finds the first that reproduces the failure.
+# With a simple predicate, the complements are checked one at a time, and we
+# stop at the first success as before. With an oracle, `first()` checks a
+# batch at a time in parallel. In either case, the result is the same.
+
+def complements(cur_str, part_count):
+    subset_len = len(cur_str) // part_count
+    return [cur_str[:start] + cur_str[start + subset_len:]
+            for start in range(0, len(cur_str), subset_len)]
+
+def first_success(inputs, causal_fn):
+    if hasattr(causal_fn, 'first'): return causal_fn.first(inputs)
+    for i, s in enumerate(inputs):
+        if causal_fn(s): return i
+    return None
+
+def remove_check_each_fragment(cur_str, part_count, causal_fn):
+    cs = complements(cur_str, part_count)
+    i = first_success(cs, causal_fn)
+    return cur_str if i is None else cs[i]
+
+def ddmin(cur_str, causal_fn):
+    n = 2
+    while len(cur_str) >= 2:
+        cur_str_ = remove_check_each_fragment(cur_str, n, causal_fn)
+        if len(cur_str_) != len(cur_str):
+            cur_str = cur_str_
+            n = max(n - 1, 2)
+        else:
+            if n >= len(cur_str): break
+            n = min(n * 2, len(cur_str))
+    return cur_str
+
+# We simulate an expensive predicate.
+
+import time
+
+def slow_test(s):
+    time.sleep(0.01)
+    return set('()') <= set(s)
+
+# Using it.
+
+if __name__ == '__main__':
+    t0 = time.perf_counter()
+    solution1 = ddmin(inputstring, slow_test)
+    t1 = time.perf_counter()
+    with hdd.Oracle(slow_test, processes=8) as oracle:
+        solution2 = ddmin(inputstring, oracle)
+    t2 = time.perf_counter()
+    assert solution1 == solution2
+    print(solution2, 'executions:', oracle.executions)
+    print('predicate: %.3fs oracle: %.3fs' % (t1 - t0, t2 - t1))
+
 # Note: This Zeller provides a similar algorithm in Zeller[^zeller1999] (1) described below,
 # translated to Python,
 
@@ -298,12 +298,23 @@ def is_token(val):
 # 3. Each compatible node and the corresponding tree is put back into the priority queue.
 # 4. If no child nodes were found that could replace the current node, then we add each children with the current tree into the priority queue. (If we had to recurse into the child nodes, then the next tree that will get picked will be a different tree.)
 
+# The candidates for a node are checked as a batch by `predicate_map()`. For a
+# simple predicate, this simply checks each in turn. (We will see later how to
+# check them in parallel.)
+
+def predicate_map(predicate, inputs):
+    if hasattr(predicate, 'map'): return predicate.map(inputs)
+    return [predicate(i) for i in inputs]
+
+def tree_to_str(tree):
+    return fuzzer.iter_tree_to_str(tree)
+
 def perses_reduction(tree, grammar, predicate):
     first_tuple = (tree, [])
     p_q = []
     add_to_pq(first_tuple, p_q)
 
-    ostr = fuzzer.iter_tree_to_str(tree)
+    ostr = tree_to_str(tree)
     assert predicate(ostr) == PRes.success
     failed_set = {ostr: True}
 
@@ -315,13 +326,18 @@ def perses_reduction(tree, grammar, predicate):
         skey, schildren = stree
         found = False
         # we now want to replace stree with alternate nodes.
+        candidates = []
         for i, node in compatible_nodes(stree, grammar):
             # replace with current (copy).
             ctree = replace_path(dtree, F_path, node)
             if ctree is None: continue # same node
-            v = fuzzer.iter_tree_to_str(ctree)
+            v = tree_to_str(ctree)
             if v in failed_set: continue
-            failed_set[v] = predicate(v) # we ignore PRes.invalid results
+            failed_set[v] = None
+            candidates.append((ctree, v))
+        results = predicate_map(predicate, [v for ctree, v in candidates])
+        for (ctree, v), res in zip(candidates, results):
+            failed_set[v] = res # we ignore PRes.invalid results
             if failed_set[v] == PRes.success:
                 found = True
                 ctree_size = count_leaves(ctree)
@@ -350,6 +366,322 @@ if __name__ == '__main__':
     er = perses_reduction(parsed_expr, EXPR_GRAMMAR, expr_double_paren)
     display_tree(er)
 
+# ## Persistent Trees
+#
+# Each step of `perses_reduction()` is more expensive than it needs to be.
+# The `replace_path()` makes a deep copy of the replacement node, the
+# `add_to_pq()` counts the leaves of the entire tree for each candidate, and
+# each candidate is converted to a string from scratch. However, a
+# replacement only changes the nodes on the path from the root to the
+# replaced node. All the other nodes can be shared between the old tree and
+# the new tree, as long as no one modifies them. So, we use an immutable
+# tree, where each node also caches the number of leaves, the number of
+# internal nodes, and the length of the string it represents. Replacing a
+# node then only needs new nodes along the path, each of which can compute
+# its metrics from its children. The string is computed on demand, and
+# cached. So, only the nodes along the path need to be converted again.
+#
+# The `PTree` is a `tuple` of the name and a tuple of children. Hence, it
+# can be used with `get_child()`, `nt_group()`, and others that simply read
+# the tree.
+
+class PTree(tuple):
+    def __new__(cls, name, children=()):
+        self = super().__new__(cls, (name, tuple(children)))
+        if self[1]:
+            self.leaves = sum(c.leaves for c in self[1])
+            self.nodes = sum(c.nodes for c in self[1]) + 1
+            self.length = sum(c.length for c in self[1])
+            self._str = None
+        else:
+            self.leaves, self.nodes = 1, 0
+            self._str = '' if fuzzer.is_nonterminal(name) else name
+            self.length = len(self._str)
+        return self
+
+# The conversions to and from the usual trees are done without recursion,
+# as the trees can be deep.
+
+def to_ptree(tree):
+    if isinstance(tree, PTree): return tree
+    built, stack = [], [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        name, children, *_ = node
+        if expanded:
+            n = len(children)
+            kids = built[len(built) - n:]
+            del built[len(built) - n:]
+            built.append(PTree(name, kids))
+        else:
+            stack.append((node, True))
+            stack.extend((c, False) for c in reversed(children))
+    return built[0]
+
+def from_ptree(tree):
+    if not isinstance(tree, PTree): return tree
+    root = []
+    stack = [(tree, root)]
+    while stack:
+        (name, children), lst = stack.pop()
+        node = (name, [])
+        lst.append(node)
+        stack.extend((c, node[1]) for c in reversed(children))
+    return root[0]
+
+# The string is computed bottom up, only for the nodes whose string has not
+# been computed yet.
+
+class PTree(PTree):
+    def to_str(self):
+        if self._str is not None: return self._str
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node._str is not None: continue
+            if expanded:
+                node._str = ''.join(c._str for c in node[1])
+            else:
+                stack.append((node, True))
+                stack.extend((c, False) for c in node[1] if c._str is None)
+        return self._str
+
+# Replacing the node at a path creates new nodes only along the path. As
+# with `replace_path()`, an empty replacement removes the node.
+
+class PTree(PTree):
+    def replace(self, path, new_node):
+        new_node = to_ptree(new_node) if new_node else None
+        nodes = [self]
+        for i in path[:-1] if path else []:
+            nodes.append(nodes[-1][1][i])
+        if not path: return new_node if new_node is not None else []
+        for node, i in zip(reversed(nodes), reversed(path)):
+            name, children = node
+            if new_node is None:
+                new_node = PTree(name, children[:i] + children[i+1:])
+            else:
+                new_node = PTree(name, children[:i] + (new_node,) + children[i+1:])
+        return new_node
+
+# We now redefine the helpers so that they use the cached values when given
+# a `PTree`, and fall back to the originals otherwise.
+
+_count_leaves, _count_nodes, _replace_path = count_leaves, count_nodes, replace_path
+
+def count_leaves(node):
+    if isinstance(node, PTree): return node.leaves
+    return _count_leaves(node)
+
+def count_nodes(node):
+    if isinstance(node, PTree): return node.nodes
+    return _count_nodes(node)
+
+def replace_path(tree, path, new_node=None):
+    if isinstance(tree, PTree): return tree.replace(path, new_node)
+    return _replace_path(tree, path, new_node)
+
+def tree_to_str(tree):
+    if isinstance(tree, PTree): return tree.to_str()
+    return fuzzer.iter_tree_to_str(tree)
+
+# Using it.
+
+if __name__ == '__main__':
+    pt = to_ptree(parsed_expr)
+    pt2 = replace_path(pt, [0, 2, 0], [])
+    assert from_ptree(pt2) == replace_path(parsed_expr, [0, 2, 0], [])
+    assert pt2[1][0][1][0] is pt[1][0][1][0] # shared
+    print(tree_to_str(pt2), count_leaves(pt2), count_nodes(pt2), pt2.length)
+
+# The reduction on a `PTree` is the same as before.
+
+if __name__ == '__main__':
+    er_p = perses_reduction(to_ptree(parsed_expr), EXPR_GRAMMAR, expr_double_paren)
+    assert from_ptree(er_p) == er
+    display_tree(er_p)
+
+# ### Benchmark
+#
+# We reduce a larger expression, where the failure requires two parts of the
+# input.
+
+def expr_two_parens(inp):
+    if re.match(r'.*[(][(].*[)][)].*[(][(].*[)][)].*', inp):
+        return PRes.success
+    return PRes.failed
+
+if __name__ == '__main__':
+    import time
+    text = '+'.join(['1*(2+3)/4-5'] * 5 + ['((6))'] + ['7*8'] * 5 + ['((9))'])
+    big_tree = parser.peg_parse(EXPR_GRAMMAR).unify_key(EXPR_START, text, 0)[1]
+    t0 = time.perf_counter()
+    r1 = perses_reduction(big_tree, EXPR_GRAMMAR, expr_two_parens)
+    t1 = time.perf_counter()
+    r2 = perses_reduction(to_ptree(big_tree), EXPR_GRAMMAR, expr_two_parens)
+    t2 = time.perf_counter()
+    assert from_ptree(r2) == r1
+    print(tree_to_str(r1))
+    print('tuples: %.3fs persistent: %.3fs' % (t1 - t0, t2 - t1))
+
+# ## A Reduction Oracle
+#
+# In practice, the predicate is often expensive. For example, checking
+# whether a C program still crashes the compiler requires us to launch the
+# compiler, which can take a significant fraction of a second. Further, the
+# reducers often produce the same string more than once, both within a single
+# reduction, and across reductions of the same input (say when we rerun a
+# reduction after a change to the reducer, or when we generalize the reduced
+# input with DDSet). Hence, we wrap the predicate in an *oracle* that
+# remembers the result for each input, keyed by the hash of the input. If a
+# `cache_file` is given, the results are also appended to it as JSON lines,
+# and loaded back the next time the oracle is created. Since the results are
+# only valid for the same predicate, the hash also includes a `key` for the
+# predicate, which defaults to its qualified name. If the predicate changes
+# its behavior (say the compiler under test is updated), a new `key` (e.g.
+# with a version) should be given.
+#
+# Secondly, the candidates produced in a single step of a reduction are
+# independent of each other. That is, all the replacements for a node in
+# `perses_reduction()`, or all the complements in one round of `ddmin()` can
+# be checked at the same time. The oracle uses a pool of processes to check
+# a batch of inputs in parallel. With `processes=0`, the inputs are checked
+# in the current process. As before, the predicate has to be picklable (e.g.
+# a top level function) unless the processes are forked.
+
+import hashlib
+import json
+import multiprocessing
+import os
+
+def input_hash(s, key=''):
+    return hashlib.sha256(json.dumps([key, s]).encode()).hexdigest()
+
+def predicate_key(predicate):
+    return '%s.%s' % (getattr(predicate, '__module__', None),
+                      getattr(predicate, '__qualname__', type(predicate).__name__))
+
+class Oracle:
+    def __init__(self, predicate, processes=None, cache_file=None, key=None):
+        self.predicate, self.cache_file = predicate, cache_file
+        self.key = predicate_key(predicate) if key is None else key
+        self.processes = os.cpu_count() if processes is None else processes
+        self.batch_size = max(self.processes, 1)
+        self.cache, self.executions, self._pool = {}, 0, None
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load()
+
+    def load(self):
+        with open(self.cache_file) as f:
+            for line in f:
+                try:
+                    h, res = json.loads(line)
+                except ValueError:
+                    continue # a partially written line.
+                self.cache[h] = PRes(res) if isinstance(res, str) else res
+
+    def save(self, results):
+        if self.cache_file is None: return
+        with open(self.cache_file, 'a') as f:
+            for h, res in results:
+                f.write(json.dumps([h, res]) + '\n')
+
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self): return self
+
+    def __exit__(self, *args): self.close()
+
+# The predicates for `ddmin()` return any truthy value on success. Since the
+# result has to be saved, we keep only `True` or `False` for these. The
+# `PRes` values are kept as is.
+
+def normalize_result(res):
+    return res if isinstance(res, (PRes, bool)) else bool(res)
+
+def is_success(res):
+    return res == PRes.success if isinstance(res, PRes) else bool(res)
+
+# The `map()` checks the inputs that are not in the cache (each distinct
+# input only once), and returns the results in the same order as the inputs.
+# Calling the oracle checks a single input. The `first()` returns the index
+# of the first input (in the given order) that succeeds, checking a batch of
+# inputs at a time, and stopping at the first batch with a success. Hence,
+# the result is the same as checking the inputs one at a time.
+
+class Oracle(Oracle):
+    def map(self, inputs):
+        hashes = [input_hash(s, self.key) for s in inputs]
+        todo = {}
+        for h, s in zip(hashes, inputs):
+            if h not in self.cache: todo.setdefault(h, s)
+        if todo:
+            if self.processes and len(todo) > 1:
+                results = self.pool().map(self.predicate, list(todo.values()))
+            else:
+                results = [self.predicate(s) for s in todo.values()]
+            results = [(h, normalize_result(r)) for h, r in zip(todo, results)]
+            self.executions += len(results)
+            self.cache.update(results)
+            self.save(results)
+        return [self.cache[h] for h in hashes]
+
+    def __call__(self, s):
+        return self.map([s])[0]
+
+    def first(self, inputs):
+        for i in range(0, len(inputs), self.batch_size):
+            results = self.map(inputs[i:i + self.batch_size])
+            for j, res in enumerate(results):
+                if is_success(res): return i + j
+        return None
+
+# Using it. We simulate an expensive predicate by sleeping for a short time.
+
+import time
+
+def slow_expr_double_paren(inp):
+    time.sleep(0.01)
+    return expr_double_paren(inp)
+
+# The reduction with the oracle is the same as the reduction without. When
+# the oracle is created again with the same `cache_file`, no executions are
+# necessary. An oracle for a different predicate does not reuse the results
+# of another predicate from the same `cache_file`.
+
+if __name__ == '__main__':
+    import tempfile
+    t0 = time.perf_counter()
+    er1 = perses_reduction(parsed_expr, EXPR_GRAMMAR, slow_expr_double_paren)
+    t1 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_file = os.path.join(cache_dir, 'oracle.jsonl')
+        with Oracle(slow_expr_double_paren, processes=4,
+                    cache_file=cache_file) as oracle:
+            er2 = perses_reduction(parsed_expr, EXPR_GRAMMAR, oracle)
+        t2 = time.perf_counter()
+        assert er1 == er2
+        with Oracle(slow_expr_double_paren, cache_file=cache_file) as oracle:
+            er3 = perses_reduction(parsed_expr, EXPR_GRAMMAR, oracle)
+        t3 = time.perf_counter()
+        assert er1 == er3 and oracle.executions == 0
+        with Oracle(expr_double_paren, processes=0,
+                    cache_file=cache_file) as oracle:
+            oracle(tree_to_str(parsed_expr))
+        assert oracle.executions == 1
+    display_tree(er2)
+    print('predicate: %.3fs oracle: %.3fs cached: %.3fs' % (
+        t1 - t0, t2 - t1, t3 - t2))
+
 # ### Is this Enough? (Semantics)
 # 
 # Note that at this point, we can generate syntactically valid inputs to check reduction, but there is no guarantee that they
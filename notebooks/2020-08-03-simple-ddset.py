@@ -63,16 +63,20 @@ if __name__ == '__main__':
 
 def ddset_simple(reduced_tree, grammar, predicate):
   vals = generalize(reduced_tree, [], [], grammar, predicate)
-  ta = get_abstract_tree(reduced_tree, vals)
+  ta = get_abstract_tree(hdd.from_ptree(reduced_tree), vals)
   return abstract_tree_to_str(ta)
 
 # If we do only want the abstract tree, we have another function `ddset_abstract()`
 
 def ddset_abstract(reduced_tree, grammar, predicate):
   vals = generalize(reduced_tree, [], [], grammar, predicate)
-  ta = get_abstract_tree(reduced_tree, vals)
+  ta = get_abstract_tree(hdd.from_ptree(reduced_tree), vals)
   return ta
 
+# The reduced tree can also be an `hdd.PTree`, in which case, each generated
+# value is placed in the tree by copying only the path to it, and only the
+# nodes along the path need to be converted to a string again.
+
 # The `generalize()` procedure tries to generalize a given tree recursively. For that, it starts at the root node, and replaces the node with
 # a randomly generated tree rooted at the same node. It tries that a configurable number of times, and if the tree can be replaced each time
 # without failure, then we mark the path as abstract. If not, we descent into its children and try the same. While generating a new tree, any
@@ -92,16 +96,32 @@ def generalize(tree, path, known_paths, grammar, predicate):
 
 MAX_TRIES_FOR_ABSTRACTION = 100
 
+# When the predicate is an `hdd.Oracle`, we can check a batch of generated
+# values in parallel. The values are generated in the same order as before,
+# and checked in that order. However, we may have generated more values than
+# necessary when some value fails. To make sure that the rest of the
+# generalization is not affected, we remember the state of the random
+# generator after generating each value, and restore it to the state after
+# the value that failed.
+
+import random
+
 def can_abstract(tree, path, known_paths, grammar, predicate):
     i = 0
+    batch_size = getattr(predicate, 'batch_size', 1)
     while (i < MAX_TRIES_FOR_ABSTRACTION):
-        t = replace_all_paths_with_generated_values(tree, known_paths + [path], grammar)
-        s = fuzzer.iter_tree_to_str(t)
-        if predicate(s) == hdd.PRes.failed:
-            return False
-        elif predicate(s) == hdd.PRes.invalid:
-            continue
-        i += 1
+        inputs, states = [], []
+        for _ in range(min(batch_size, MAX_TRIES_FOR_ABSTRACTION - i)):
+            t = replace_all_paths_with_generated_values(tree, known_paths + [path], grammar)
+            inputs.append(hdd.tree_to_str(t))
+            states.append(random.getstate())
+        for s, res, state in zip(inputs, hdd.predicate_map(predicate, inputs), states):
+            if res == hdd.PRes.failed:
+                random.setstate(state)
+                return False
+            elif res == hdd.PRes.invalid:
+                continue
+            i += 1
     return True
 
 # The `can_abstract()` procedure tries to generate a valid value `MAX_TRIES_FOR_ABSTRACTION` times. For this, it relies on
@@ -118,6 +138,7 @@ def replace_all_paths_with_generated_values(tree, paths, grammar):
 
 import copy
 def replace_path(tree, path, new_node=None):
+    if isinstance(tree, hdd.PTree): return tree.replace(path, new_node)
     if new_node is None: new_node = []
     if not path: return copy.deepcopy(new_node)
     cur, *path = path
@@ -197,6 +218,26 @@ if __name__ == '__main__':
     pattern = ddset_simple(reduced_expr_tree, hdd.EXPR_GRAMMAR, hdd.expr_double_paren)
     print(pattern)
  
+# With an oracle, we get the same pattern, with the predicate checked in
+# parallel, and each distinct input checked only once.
+
+if __name__ == '__main__':
+    random.seed(0)
+    pattern1 = ddset_simple(reduced_expr_tree, hdd.EXPR_GRAMMAR, hdd.expr_double_paren)
+    random.seed(0)
+    with hdd.Oracle(hdd.slow_expr_double_paren, processes=4) as oracle:
+        pattern2 = ddset_simple(reduced_expr_tree, hdd.EXPR_GRAMMAR, oracle)
+    assert pattern1 == pattern2
+    print(pattern2, oracle.executions)
+
+# The same with a persistent tree.
+
+if __name__ == '__main__':
+    random.seed(0)
+    pattern3 = ddset_simple(hdd.to_ptree(reduced_expr_tree), hdd.EXPR_GRAMMAR,
+                            hdd.expr_double_paren)
+    assert pattern1 == pattern3
+
 # So, given that this algorithm is much simpler than the original, why should we use the
 # original algorithm? The problem is that when the input is a file in a programming language,
 # one also needs to take into account the semantics. That is, the generated input needs to be
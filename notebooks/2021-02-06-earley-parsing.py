@@ -1762,6 +1762,1324 @@ if __name__ == '__main__':
 # experiments, [translating the earley parser to Java line by line](https://github.com/vrthra/EarleyJava)
 # resulted in an improvement over 300 times.
 
+# ## A Compact Chart
+#
+# The chart we built above is rather wasteful. Each state is a Python object
+# that holds on to the nonterminal name, the expansion rule, and references to
+# the start and end columns, and each column deduplicates its states using a
+# dictionary keyed by these objects. For inputs that are a few kilobytes long,
+# the chart can grow to millions of states, and most of the parse time is
+# spent allocating and hashing these objects.
+#
+# However, there is nothing in a state that can not be represented by integers.
+# A state is simply a *dotted rule* (the expansion rule along with the dot
+# position) and a start column. If we number the symbols, the rules, and
+# the dotted rules of a grammar beforehand, then each state can be stored as a
+# pair of integers in the column, and the deduplication can be done on a
+# single integer key.
+#
+# ### Compiling the Grammar
+#
+# We first compile the grammar. The nonterminals get the first few symbol
+# numbers so that checking whether a symbol is a nonterminal is a simple
+# comparison. Each rule gets a number, and each dotted rule gets a number
+# such that advancing the dot is simply adding one to the dotted rule. We
+# also record the symbol after the dot (or `-1` if the dotted rule is
+# finished), and the rule to which each dotted rule belongs. Finally, the
+# `d_key` of a dotted rule is the symbol after the dot if there is one, and
+# `-1 - lhs` otherwise. We will use it to index the states in a column.
+
+import array
+
+class CompiledGrammar:
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.symbols, self.sym_id = [], {}
+        for k in grammar: self.intern(k)
+        self.n_nt = len(self.symbols)
+
+        self.rules, self.rule_id, self.nt_rules = [], {}, {}
+        self.rule_lhs, self.rule_first = [], []
+        self.postdot, self.d_rule = array.array('i'), array.array('i')
+        for k in grammar:
+            self.nt_rules[self.sym_id[k]] = []
+            for alt in grammar[k]:
+                self.add_rule(k, tuple(alt))
+        self.nullable = {self.sym_id[k] for k in nullable(grammar)}
+        self.d_key = array.array('i', (
+            sym if sym >= 0 else -1 - self.rule_lhs[self.d_rule[d]]
+            for d, sym in enumerate(self.postdot)))
+
+    def intern(self, sym):
+        if sym not in self.sym_id:
+            self.sym_id[sym] = len(self.symbols)
+            self.symbols.append(sym)
+        return self.sym_id[sym]
+
+    def add_rule(self, name, expr):
+        r = len(self.rules)
+        self.rules.append((name, expr))
+        self.rule_id[(name, expr)] = r
+        self.rule_lhs.append(self.sym_id[name])
+        self.rule_first.append(len(self.postdot))
+        self.nt_rules[self.sym_id[name]].append(r)
+        for t in expr:
+            self.postdot.append(self.intern(t))
+            self.d_rule.append(r)
+        self.postdot.append(-1)
+        self.d_rule.append(r)
+
+    def dotted(self, name, expr, dot):
+        return self.rule_first[self.rule_id[(name, expr)]] + dot
+
+    def show(self, d):
+        r = self.d_rule[d]
+        name, expr = self.rules[r]
+        return show_dot(name, expr, d - self.rule_first[r])
+
+# Here are the dotted rules for our sample grammar.
+
+if __name__ == '__main__':
+    cg = CompiledGrammar(sample_grammar)
+    for d in range(len(cg.postdot)):
+        print(d, cg.show(d), cg.postdot[d])
+
+# ### The Compact Column
+#
+# The `CompactColumn` holds the states in two parallel integer arrays, one for
+# the dotted rules and the other for the start columns. Deduplication uses a
+# set of integers that packs both into a single number. Note that states are
+# only ever added to the column being processed and the one after it. Hence,
+# once a column is processed, we can throw away its deduplication set, and
+# *freeze* the column. Freezing sorts the states by the nonterminal they are
+# waiting for (or, for finished states, the nonterminal they complete), so
+# that both `complete()` and the forest extraction can find the states they
+# need by bisection, rather than by scanning the entire column.
+
+import bisect
+
+class CompactColumn:
+    def __init__(self, index, letter, cg):
+        self.index, self.letter, self.cg = index, letter, cg
+        self.tok = cg.sym_id.get(letter, -1)
+        self.dotted, self.starts = array.array('i'), array.array('i')
+        self._unique, self.keys, self.order = set(), None, None
+
+    def __len__(self):
+        return len(self.dotted)
+
+    def __str__(self):
+        return "%s chart[%d]\n%s" % (self.letter, self.index, "\n".join(
+            self.cg.show(d) for d in self.dotted if self.cg.postdot[d] < 0))
+
+    def to_repr(self):
+        return "%s chart[%d]\n%s" % (self.letter, self.index, "\n".join(
+            self.cg.show(d) for d in self.dotted))
+
+    def add(self, d, s):
+        key = s * len(self.cg.d_key) + d
+        if key in self._unique: return False
+        self._unique.add(key)
+        self.dotted.append(d)
+        self.starts.append(s)
+        return True
+
+    def freeze(self):
+        keys = [self.cg.d_key[d] for d in self.dotted]
+        self.order = array.array('i', sorted(range(len(keys)),
+                                             key=keys.__getitem__))
+        self.keys = array.array('i', sorted(keys))
+        self._unique = None
+
+    def lookup(self, key):
+        if self.keys is None:
+            return [j for j, d in enumerate(self.dotted)
+                    if self.cg.d_key[d] == key]
+        lo = bisect.bisect_left(self.keys, key)
+        return self.order[lo:bisect.bisect_right(self.keys, key, lo)]
+
+    def waiting(self, sym): return self.lookup(sym)
+
+    def completed(self, sym): return self.lookup(-1 - sym)
+
+# ### The Compact Parser
+#
+# The `CompactEarleyParser` fills the chart exactly as `EarleyParser` does,
+# and in exactly the same order. The only difference is that it works on
+# the integer representation of the states.
+
+class CompactEarleyParser(EarleyParser):
+    def __init__(self, grammar, **kwargs):
+        super().__init__(grammar, **kwargs)
+        self.cg = self.compiled_grammar(grammar)
+
+    def compiled_grammar(self, grammar): return CompiledGrammar(grammar)
+
+    def create_column(self, i, tok): return CompactColumn(i, tok, self.cg)
+
+    def chart_parse(self, tokens, start, alts):
+        chart = [self.create_column(i, tok)
+                    for i, tok in enumerate([None, *tokens])]
+        for alt in alts:
+            chart[0].add(self.cg.dotted(start, tuple(alt), 0), 0)
+        return self.fill_chart(chart)
+
+    def predict(self, col, sym, d, s):
+        for r in self.cg.nt_rules[sym]:
+            col.add(self.cg.rule_first[r], col.index)
+        if sym in self.cg.nullable:
+            col.add(d + 1, s)
+
+    def scan(self, col, sym, d, s):
+        if sym == col.tok:
+            col.add(d + 1, s)
+
+    def complete(self, col, d, s, chart):
+        s_col = chart[s]
+        for j in s_col.waiting(self.cg.rule_lhs[self.cg.d_rule[d]]):
+            col.add(s_col.dotted[j] + 1, s_col.starts[j])
+
+    def fill_chart(self, chart):
+        postdot, n_nt = self.cg.postdot, self.cg.n_nt
+        for i, col in enumerate(chart):
+            j = 0
+            while j < len(col.dotted):
+                d, s = col.dotted[j], col.starts[j]
+                sym = postdot[d]
+                if sym < 0:
+                    self.complete(col, d, s, chart)
+                elif sym < n_nt:
+                    self.predict(col, sym, d, s)
+                elif i + 1 < len(chart):
+                    self.scan(chart[i + 1], sym, d, s)
+                j += 1
+            col.freeze()
+            if self.log: print(col.to_repr(), '\n')
+        return chart
+
+# The parse forest extraction expects `State` objects. We create them only
+# for the states that are actually needed, that is, the finished states
+# that the forest refers to. Hence, `parse_prefix()` and `parse_paths()` are
+# the only other methods that need to know about the integer representation.
+
+class CompactEarleyParser(CompactEarleyParser):
+    def create_state_at(self, col, j, chart):
+        d = col.dotted[j]
+        r = self.cg.d_rule[d]
+        name, expr = self.cg.rules[r]
+        return State(name, expr, d - self.cg.rule_first[r],
+                     chart[col.starts[j]], col)
+
+    def parse_prefix(self, text, start_symbol):
+        alts = [tuple(alt) for alt in self._grammar[start_symbol]]
+        rules = {self.cg.rule_id[(start_symbol, alt)] for alt in alts}
+        self.table = self.chart_parse(text, start_symbol, alts)
+        for col in reversed(self.table):
+            states = [self.create_state_at(col, j, self.table)
+                      for j in range(len(col))
+                      if col.starts[j] == 0
+                         and self.cg.d_rule[col.dotted[j]] in rules]
+            if states:
+                return col.index, states
+        return -1, []
+
+    def finished_states(self, col, var, chart):
+        return [self.create_state_at(col, j, chart)
+                for j in col.completed(self.cg.sym_id[var])]
+
+    def parse_paths(self, named_expr, chart, frm, til):
+        def paths(state, start, k, e):
+            if not e:
+                return [[(state, k)]] if start == frm else []
+            else:
+                return [[(state, k)] + r
+                        for r in self.parse_paths(e, chart, frm, start)]
+
+        *expr, var = named_expr
+        starts = None
+        if var not in self._grammar:
+            starts = ([(var, til - len(var),
+                        't')] if til > 0 and chart[til].letter == var else [])
+        else:
+            starts = [(s, s.s_col.index, 'n')
+                      for s in self.finished_states(chart[til], var, chart)]
+
+        return [p for s, start, k in starts for p in paths(s, start, k, expr)]
+
+# We can now parse with the compact chart.
+
+if __name__ == '__main__':
+    cp = CompactEarleyParser(sample_grammar, log=True)
+    columns = cp.chart_parse('adcd', START, sample_grammar[START])
+    for c in columns: print(c)
+
+# The parse trees are the same as before.
+
+if __name__ == '__main__':
+    for tree in CompactEarleyParser(a_grammar).parse_on('1+2+4', START):
+        print(format_parsetree(tree))
+    assert list(CompactEarleyParser(a_grammar).parse_on('1+2+4', START)) == \
+           list(EarleyParser(a_grammar).parse_on('1+2+4', START))
+
+# The extractors work unchanged.
+
+if __name__ == '__main__':
+    ee = EnhancedExtractor(CompactEarleyParser(indirectly_self_referring),
+                           'a', START)
+    while True:
+        t = ee.extract_a_tree()
+        if t is None: break
+        assert tree_to_str(t) == 'a'
+
+# ### The Compact Leo Parser
+#
+# The Leo optimization can be carried over too. The transitive items are
+# stored in each column as integer pairs keyed by the nonterminal id, and
+# the deterministic reduction path links are recorded using the integer keys
+# of the states. When the transitive item is added to the column, we mark it
+# so that it can be turned back into a `TState` during forest extraction.
+# Since the deduplication set of a column is gone once the column is frozen,
+# the transitive items are kept in their own table.
+
+class CompactColumn(CompactColumn):
+    def __init__(self, index, letter, cg):
+        super().__init__(index, letter, cg)
+        self.transitives, self.expanded = {}, {}
+
+class CompactLeoParser(CompactEarleyParser):
+    def __init__(self, grammar, **kwargs):
+        super().__init__(grammar, **kwargs)
+        self._postdots, self._tstates = {}, set()
+
+    def complete(self, col, d, s, chart):
+        detred = self.get_top(d, s, chart)
+        if detred:
+            if col.add(*detred):
+                self._tstates.add((col.index, len(col) - 1))
+        else:
+            super().complete(col, d, s, chart)
+
+    def uniq_postdot(self, d_A, s_A, chart):
+        col_s1 = chart[s_A]
+        parents = col_s1.waiting(self.cg.rule_lhs[self.cg.d_rule[d_A]])
+        if len(parents) != 1: return None
+        j = parents[0]
+        d_B, s_B = col_s1.dotted[j], col_s1.starts[j]
+        if self.cg.postdot[d_B + 1] >= 0: return None
+        self._postdots[(d_B, s_B)] = (d_A, s_A)
+        return d_B, s_B
+
+    def get_top(self, d_A, s_A, chart):
+        st_B_inc = self.uniq_postdot(d_A, s_A, chart)
+        if not st_B_inc:
+            return None
+        d_B, s_B = st_B_inc
+        t_name = self.cg.rule_lhs[self.cg.d_rule[d_B]]
+        e_col = chart[s_A]
+        if t_name in e_col.transitives:
+            return e_col.transitives[t_name]
+        top = self.get_top(d_B + 1, s_B, chart) or (d_B + 1, s_B)
+        e_col.transitives[t_name] = top
+        return top
+
+# During forest extraction, the transitive states are expanded to the
+# intermediate states we skipped. Note that `LeoParser.expand_tstate()`
+# advances the completed states once more, which produces states that have
+# no dotted rule number. Since these are only needed for extracting trees,
+# we keep them as `State` objects in a separate table in the column.
+
+class CompactLeoParser(CompactLeoParser):
+    def create_state_at(self, col, j, chart):
+        state = super().create_state_at(col, j, chart)
+        if (col.index, j) not in self._tstates: return state
+        return TState(state.name, state.expr, state.dot, state.s_col, col)
+
+    def finished_states(self, col, var, chart):
+        return super().finished_states(col, var, chart) + [
+                s for s in col.expanded.values() if s.name == var]
+
+    def expand_tstate(self, state, e):
+        if state.dot < 0: return
+        key = (self.cg.dotted(state.name, state.expr, state.dot),
+               state.s_col.index)
+        if key not in self._postdots:
+            return
+        c_C = self.create_state_at_d(*self._postdots[key])
+        st = c_C.advance()
+        if st._t() not in e.expanded:
+            st.e_col = e
+            e.expanded[st._t()] = st
+        self.expand_tstate(c_C.back(), e)
+
+    def chart_parse(self, tokens, start, alts):
+        self._tstates = set()
+        return super().chart_parse(tokens, start, alts)
+
+    def create_state_at_d(self, d, s):
+        r = self.cg.d_rule[d]
+        name, expr = self.cg.rules[r]
+        return State(name, expr, d - self.cg.rule_first[r], self.table[s])
+
+    def parse_forest(self, chart, states):
+        for state in states:
+            if isinstance(state, TState):
+                self.expand_tstate(state.back(), state.e_col)
+        return super().parse_forest(chart, states)
+
+# Checking that both the Leo parsers produce the same trees.
+
+if __name__ == '__main__':
+    for g, s in [(RR_GRAMMAR, mystring), (RR_GRAMMAR2, mystring2),
+                 (RR_GRAMMAR3, mystring3), (RR_GRAMMAR4, mystring4),
+                 (RR_GRAMMAR5, mystring5), (RR_GRAMMAR6, mystring6),
+                 (RR_GRAMMAR7, mystring7), (RR_GRAMMAR8, mystring8),
+                 (RR_GRAMMAR9, mystring9), (LR_GRAMMAR, mystring)]:
+        trees = list(CompactLeoParser(g).parse_on(s, START))
+        assert trees == list(LeoParser(g).parse_on(s, START))
+        for tree in trees:
+            assert s == tree_to_str(tree)
+
+# ### Benchmark
+#
+# How much do we gain? We measure the number of states in the chart, the
+# memory taken by the chart, and the number of states added per second for
+# both the `EarleyParser` and the `CompactEarleyParser`.
+
+import time
+import tracemalloc
+
+def chart_size(chart):
+    return sum(len(col) if isinstance(col, CompactColumn) else len(col.states)
+               for col in chart)
+
+def chart_benchmark(parser, text, start_symbol):
+    alts = parser._grammar[start_symbol]
+    tracemalloc.start()
+    chart = parser.chart_parse(text, start_symbol, alts)
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    chart = parser.chart_parse(text, start_symbol, alts)
+    t1 = time.perf_counter()
+    items = chart_size(chart)
+    return items, size / items, items / (t1 - t0)
+
+# Using it.
+
+if __name__ == '__main__':
+    text = '+'.join('(1*23-4/5)' for i in range(20))
+    for P in [EarleyParser, CompactEarleyParser, LeoParser, CompactLeoParser]:
+        items, bpi, ips = chart_benchmark(P(a_grammar), text, START)
+        print('%s: %d items, %.1f bytes/item, %d items/s' % (
+            P.__name__, items, bpi, ips))
+
+# ## Precomputed Prediction
+#
+# Looking at `predict()` again, we see that it does the same work in every
+# column. When a nonterminal is predicted, its rules are added, the
+# nonterminals at the start of these rules are predicted in turn, and any
+# nullable nonterminals are skipped over. Each of these states is then
+# inspected by `fill_chart()` and predicted again (only to be discarded as
+# duplicates). For expression grammars with deep left recursion, where
+# predicting `<expr>` leads to predicting `<term>`, which leads to predicting
+# `<fact>` and so on, this is where most of the time goes. Yet, the states that
+# are added depend only on the nonterminal, and not on the column. Hence,
+# we can compute the *prediction closure* of each nonterminal once, and add
+# the entire closure to the column when the nonterminal is first predicted in
+# that column.
+#
+# The closure of a nonterminal is computed as a simple work list. We start
+# with the dotted rules at the start of each of its rules. For each dotted rule
+# in the list, if the symbol after the dot is a nonterminal, we add its rules,
+# and if that symbol is nullable, we also add the dotted rule with the dot
+# advanced over it. Along with the dotted rules, we also return the
+# nonterminals that were predicted while computing the closure. The closure
+# is computed the first time it is needed, and is kept with the compiled
+# grammar.
+
+class CompiledGrammar(CompiledGrammar):
+    def __init__(self, grammar):
+        super().__init__(grammar)
+        self.nullable_names = {self.symbols[s] for s in self.nullable}
+        self._closure = {}
+
+    def closure(self, sym):
+        if sym in self._closure: return self._closure[sym]
+        items = [self.rule_first[r] for r in self.nt_rules[sym]]
+        seen, syms = set(items), {sym}
+        for d in items:
+            nxt = self.postdot[d]
+            if nxt < 0 or nxt >= self.n_nt: continue
+            if nxt not in syms:
+                syms.add(nxt)
+                for r in self.nt_rules[nxt]:
+                    if self.rule_first[r] not in seen:
+                        seen.add(self.rule_first[r])
+                        items.append(self.rule_first[r])
+            if nxt in self.nullable and d + 1 not in seen:
+                seen.add(d + 1)
+                items.append(d + 1)
+        self._closure[sym] = (array.array('i', items), frozenset(syms))
+        return self._closure[sym]
+
+# Here is the closure of `<start>` in our `sample_grammar`
+
+if __name__ == '__main__':
+    cg = CompiledGrammar(sample_grammar)
+    items, syms = cg.closure(cg.sym_id['<start>'])
+    for d in items:
+        print(cg.show(d))
+    print([cg.symbols[s] for s in syms])
+
+# The same grammar is often used to construct many parsers. So we cache the
+# compiled grammar (along with the closures and the nullable nonterminals
+# computed so far) using a fingerprint of the grammar. Since the order of
+# rules matters for the order of the parse trees, the fingerprint is computed
+# from the grammar as is. The cache keeps only the most recently used
+# `MAX_COMPILED_GRAMMARS` grammars.
+
+import collections
+import hashlib
+import json
+
+MAX_COMPILED_GRAMMARS = 32
+COMPILED_GRAMMARS = collections.OrderedDict()
+
+def grammar_fingerprint(grammar):
+    return hashlib.sha256(json.dumps(grammar).encode()).hexdigest()
+
+def compile_grammar(grammar):
+    key = grammar_fingerprint(grammar)
+    if key in COMPILED_GRAMMARS:
+        COMPILED_GRAMMARS.move_to_end(key)
+    else:
+        COMPILED_GRAMMARS[key] = CompiledGrammar(grammar)
+        if len(COMPILED_GRAMMARS) > MAX_COMPILED_GRAMMARS:
+            COMPILED_GRAMMARS.popitem(last=False)
+    return COMPILED_GRAMMARS[key]
+
+# Each column remembers the nonterminals that were predicted in it (including
+# those predicted as part of a closure), so that the rules of a nonterminal
+# are added only once. This is only needed while the column is being filled.
+
+class CompactColumn(CompactColumn):
+    def __init__(self, index, letter, cg):
+        super().__init__(index, letter, cg)
+        self.predicted = set()
+
+    def freeze(self):
+        super().freeze()
+        self.predicted = None
+
+# The `ClosurePrediction` uses the cached compiled grammar, and predicts
+# a nonterminal by adding its closure. The state that caused the prediction
+# is still advanced if the nonterminal is nullable, as before. We mix it into
+# both the compact Earley parser and the compact Leo parser.
+
+class ClosurePrediction:
+    def compiled_grammar(self, grammar): return compile_grammar(grammar)
+
+    def predict(self, col, sym, d, s):
+        if sym not in col.predicted:
+            items, syms = self.cg.closure(sym)
+            col.predicted |= syms
+            for d_ in items:
+                col.add(d_, col.index)
+        if sym in self.cg.nullable:
+            col.add(d + 1, s)
+
+class ClosureEarleyParser(ClosurePrediction, CompactEarleyParser): pass
+
+class ClosureLeoParser(ClosurePrediction, CompactLeoParser): pass
+
+# Each column now contains exactly the same states as before, but possibly in
+# a different order. Hence, we get the same parse trees, but possibly in a
+# different order.
+
+if __name__ == '__main__':
+    eps_grammar = {
+        '<start>': [['<A>', '<B>']],
+        '<A>': [['a'], []],
+        '<B>': [['b'], ['<A>', 'b']]
+    }
+    for g, s in [(a_grammar, '1+2*3'), (eps_grammar, 'ab'),
+                 (RR_GRAMMAR, mystring), (RR_GRAMMAR2, mystring2),
+                 (RR_GRAMMAR5, mystring5), (RR_GRAMMAR9, mystring9),
+                 (LR_GRAMMAR, mystring)]:
+        for P, Q in [(EarleyParser, ClosureEarleyParser),
+                     (LeoParser, ClosureLeoParser)]:
+            assert sorted(map(str, P(g).parse_on(s, START))) == \
+                   sorted(map(str, Q(g).parse_on(s, START)))
+
+# ### Benchmark
+#
+# We compare the parsers on an expression grammar with several levels of
+# left recursion.
+
+def leveled_grammar(levels):
+    ops = '+-*/%^&|<>'
+    g = {'<start>': [['<e0>']]}
+    for i in range(levels):
+        g['<e%d>' % i] = [['<e%d>' % i, ops[i], '<e%d>' % (i + 1)],
+                          ['<e%d>' % (i + 1)]]
+    g['<e%d>' % levels] = [['(', '<e0>', ')'], ['1']]
+    return g
+
+if __name__ == '__main__':
+    lg = leveled_grammar(10)
+    text = '+'.join('(1*1-1)&1|1' for i in range(10))
+    for P in [EarleyParser, CompactEarleyParser, ClosureEarleyParser]:
+        items, bpi, ips = chart_benchmark(P(lg), text, START)
+        print('%s: %d items, %d items/s' % (P.__name__, items, ips))
+
+# ## Incremental Parsing
+#
+# When the parser is used in an editor, the same document is parsed again
+# after each keystroke. However, an edit at some offset in the text does not
+# change any of the columns up to that offset, because the column `i` depends
+# only on the first `i` tokens. Further, the effect of an edit is often local.
+# Once we have parsed a little beyond the edited region, the columns we
+# compute are the same as the corresponding columns from the previous parse,
+# only shifted by the difference in length. At that point, we can stop parsing
+# and simply reuse the remaining columns from the previous parse.
+#
+# However, we need to be careful about what *the same* means here. A column
+# depends not only on the previous column, but also on every column that its
+# states started in, because `complete()` looks up the parents of a finished
+# state in its start column. Hence, we consider a recomputed column *clean*
+# if it contains the same states in the same order as the corresponding old
+# column (with the start columns shifted), and each state either started
+# before the edit, or started in that column itself. (A state that started
+# in one of the recomputed columns before it would let later columns look up
+# that recomputed column, which may differ from the old one.) Once we find a
+# clean column, every column after it is guaranteed to be the same as the
+# corresponding old column shifted, and we can stop.
+#
+# We first split `fill_chart()` so that we can fill one column at a time.
+
+class IncrementalEarleyParser(ClosureEarleyParser):
+    def fill_column(self, chart, i):
+        postdot, n_nt, col = self.cg.postdot, self.cg.n_nt, chart[i]
+        j = 0
+        while j < len(col.dotted):
+            d, s = col.dotted[j], col.starts[j]
+            sym = postdot[d]
+            if sym < 0:
+                self.complete(col, d, s, chart)
+            elif sym < n_nt:
+                self.predict(col, sym, d, s)
+            elif i + 1 < len(chart):
+                self.scan(chart[i + 1], sym, d, s)
+            j += 1
+        col.freeze()
+        if self.log: print(col.to_repr(), '\n')
+
+    def fill_chart(self, chart):
+        for i in range(len(chart)):
+            self.fill_column(chart, i)
+        return chart
+
+# Next, we need to check whether a recomputed column is clean. Here, `offset`
+# is where the edit starts, `deleted` is the number of tokens deleted, and
+# `delta` is the change in length.
+
+class IncrementalEarleyParser(IncrementalEarleyParser):
+    def is_clean(self, col, old_col, offset, deleted, delta):
+        if col.dotted != old_col.dotted: return False
+        for s, s_old in zip(col.starts, old_col.starts):
+            if s_old <= offset:
+                if s != s_old: return False
+            elif s_old < offset + deleted or s != s_old + delta:
+                return False
+            elif s != col.index:
+                return False
+        return True
+
+    def shift_column(self, col, offset, delta):
+        col.index += delta
+        col.starts = array.array('i', (s + delta if s > offset else s
+                                       for s in col.starts))
+        return col
+
+# The `update_chart()` method reuses the columns up to the edit, and rescans
+# the column at the offset with the new token. It then fills the columns one
+# at a time until it finds a clean column, at which point, the remaining old
+# columns are shifted and reused.
+
+class IncrementalEarleyParser(IncrementalEarleyParser):
+    def update_chart(self, chart, tokens, offset, deleted, inserted):
+        delta = inserted - deleted
+        new_chart = chart[:offset + 1]
+        if offset < len(tokens):
+            new_chart.append(self.create_column(offset + 1, tokens[offset]))
+            col = chart[offset]
+            for d, s in zip(col.dotted, col.starts):
+                sym = self.cg.postdot[d]
+                if sym >= self.cg.n_nt:
+                    self.scan(new_chart[offset + 1], sym, d, s)
+        self.recomputed = 0
+        for i in range(offset + 1, len(tokens) + 1):
+            if i < len(tokens):
+                new_chart.append(self.create_column(i + 1, tokens[i]))
+            self.fill_column(new_chart, i)
+            self.recomputed += 1
+            j = i - delta
+            if i < offset + inserted or j >= len(chart): continue
+            if self.is_clean(new_chart[i], chart[j], offset, deleted, delta):
+                return new_chart[:i + 1] + [self.shift_column(c, offset, delta)
+                                            for c in chart[j + 1:]]
+        return new_chart
+
+# Finally, the parser remembers the tokens and the chart from the last parse.
+# The `edit()` method takes the offset, the number of tokens deleted, and
+# the inserted tokens, and updates the chart. When `chart_parse()` is called
+# with the edited text, the updated chart is returned as is. Since
+# `parse_prefix()`, `recognize_on()`, and `parse_on()` all go through
+# `chart_parse()`, they work unchanged.
+
+class IncrementalEarleyParser(IncrementalEarleyParser):
+    def __init__(self, grammar, **kwargs):
+        super().__init__(grammar, **kwargs)
+        self.chart, self.tokens, self.key = None, None, None
+
+    def chart_parse(self, tokens, start, alts):
+        key = (start, tuple(tuple(alt) for alt in alts))
+        if self.chart is None or key != self.key or \
+                list(tokens) != self.tokens:
+            self.key, self.tokens = key, list(tokens)
+            self.chart = super().chart_parse(tokens, start, alts)
+        return self.chart
+
+    def edit(self, offset, deleted, inserted):
+        assert self.chart is not None
+        assert 0 <= offset and offset + deleted <= len(self.tokens)
+        tokens = (self.tokens[:offset] + list(inserted) +
+                  self.tokens[offset + deleted:])
+        self.chart = self.update_chart(self.chart, tokens, offset, deleted,
+                                       len(inserted))
+        self.tokens = tokens
+        return tokens
+
+# Using it. We parse an expression, and then change a single digit.
+
+if __name__ == '__main__':
+    text = '(1+2)*3+4'
+    ip = IncrementalEarleyParser(a_grammar)
+    for tree in ip.parse_on(text, START):
+        print(tree_to_str(tree))
+    ip.edit(3, 1, '5')
+    text = text[:3] + '5' + text[4:]
+    for tree in ip.parse_on(text, START):
+        print(tree_to_str(tree))
+    print('recomputed', ip.recomputed, 'of', len(text), 'columns')
+
+# We verify that the result is the same as parsing from scratch. We compare
+# the charts directly, as well as the parse trees, for a number of edits
+# including insertions and deletions.
+
+def same_chart(chart_a, chart_b):
+    return [(c.index, c.letter, c.dotted, c.starts) for c in chart_a] == \
+           [(c.index, c.letter, c.dotted, c.starts) for c in chart_b]
+
+if __name__ == '__main__':
+    for g, text, edits in [
+            (a_grammar, '(1+2)*3+4-(5*6)', [(3, 1, '5'), (0, 0, '1+'),
+                (4, 0, '+7'), (1, 3, '9'), (5, 2, ''), (15, 0, '*8'),
+                (6, 1, '(1+2)'), (0, 15, '2')]),
+            (leveled_grammar(4), '(1+1)*1-(1*1)', [(3, 1, '1'), (0, 0, '1+'),
+                (4, 0, '+1'), (1, 3, '1'), (5, 2, ''), (13, 0, '*1'),
+                (2, 1, '-'), (6, 1, '(1+1)'), (0, 13, '1')])]:
+        for offset, deleted, inserted in edits:
+            ip = IncrementalEarleyParser(g)
+            trees = list(ip.parse_on(text, START))
+            ip.edit(offset, deleted, inserted)
+            new_text = text[:offset] + inserted + text[offset + deleted:]
+            assert same_chart(ip.chart_parse(new_text, START, g[START]),
+                ClosureEarleyParser(g).chart_parse(new_text, START, g[START]))
+            assert list(ip.parse_on(new_text, START)) == \
+                   list(ClosureEarleyParser(g).parse_on(new_text, START))
+
+# ### Benchmark
+#
+# We parse a long expression, and then change one operator at a time. For
+# each edit, we compare the time taken by the incremental update with the
+# time taken to parse the edited text from scratch.
+
+if __name__ == '__main__':
+    lg = leveled_grammar(4)
+    text = '+'.join('(1*1-1)' for i in range(100))
+    ip = IncrementalEarleyParser(lg)
+    ip.recognize_on(text, START)
+    t_inc, t_full, cols = 0, 0, 0
+    for offset in range(2, len(text), 40):
+        text = text[:offset] + '-' + text[offset + 1:]
+        t0 = time.perf_counter()
+        ip.edit(offset, 1, '-')
+        ip.recognize_on(text, START)
+        t1 = time.perf_counter()
+        ClosureEarleyParser(lg).recognize_on(text, START)
+        t2 = time.perf_counter()
+        t_inc, t_full, cols = t_inc + t1 - t0, t_full + t2 - t1, cols + ip.recomputed
+    print('incremental: %.3fs (%d columns) full: %.3fs' % (t_inc, cols, t_full))
+
+# ## Online Recognition
+#
+# All the parsers so far need the complete text before they can start,
+# because `chart_parse()` creates all the columns up front. However, the
+# Earley algorithm itself processes the input one token at a time, and
+# a column depends only on the columns before it. Hence, we can recognize
+# a stream of tokens *online*, creating each column only when its token
+# arrives. After each token, we can report whether the input seen so far
+# is still a viable prefix (that is, whether the last column contains any
+# states at all), and whether it is a complete sentence by itself (that is,
+# whether the last column contains a finished state for the start symbol
+# that started at the beginning). Note that the first is exact only if every
+# nonterminal in the grammar can derive some string.
+#
+# Since we no longer have a list of columns, we keep the columns in a
+# dictionary keyed by their index. This works with `complete()` as is. The
+# scanning is done when the next token arrives, by going over the states in
+# the previous column. Since we go over them in the order they were added,
+# the states in the new column are in the same order as before.
+
+class OnlineEarleyRecognizer(ClosureEarleyParser):
+    def __init__(self, grammar, start_symbol, gc_interval=1024, **kwargs):
+        super().__init__(grammar, **kwargs)
+        self.start_symbol, self.gc_interval = start_symbol, gc_interval
+        self.start_rules = [self.cg.rule_id[(start_symbol, tuple(alt))]
+                            for alt in grammar[start_symbol]]
+        self.reset()
+
+    def reset(self):
+        col = self.create_column(0, None)
+        for r in self.start_rules:
+            col.add(self.cg.rule_first[r], 0)
+        self.columns, self.current, self.collected = {0: col}, 0, 0
+        self.fill_column(col)
+        return self.status()
+
+    def fill_column(self, col):
+        postdot, n_nt = self.cg.postdot, self.cg.n_nt
+        j = 0
+        while j < len(col.dotted):
+            d, s = col.dotted[j], col.starts[j]
+            sym = postdot[d]
+            if sym < 0:
+                self.complete(col, d, s, self.columns)
+            elif sym < n_nt:
+                self.predict(col, sym, d, s)
+            j += 1
+        col.freeze()
+        if self.log: print(col.to_repr(), '\n')
+
+    def feed(self, tok):
+        col = self.columns[self.current]
+        nxt = self.create_column(self.current + 1, tok)
+        for d, s in zip(col.dotted, col.starts):
+            sym = self.cg.postdot[d]
+            if sym >= self.cg.n_nt:
+                self.scan(nxt, sym, d, s)
+        self.current += 1
+        self.columns[self.current] = nxt
+        self.fill_column(nxt)
+        if self.current - self.collected >= self.gc_interval:
+            self.collect()
+        return self.status()
+
+    def status(self):
+        col = self.columns[self.current]
+        complete = any(col.starts[j] == 0 and
+                       self.cg.d_rule[col.dotted[j]] in self.start_rules
+                       for j in col.completed(self.cg.sym_id[self.start_symbol]))
+        return (self.current == 0 or len(col) > 0), complete
+
+# Once a column is done, it is only ever used by `complete()`, which looks up
+# the start column of a finished state. Further, the finished states in a
+# column that is done have already been completed, and only the unfinished
+# states can be advanced into the later columns. So, a column is still
+# needed only if some unfinished state in the current column started there,
+# or if some unfinished state in a column that is still needed started there.
+# Every other column can be dropped. The `collect()` method marks the columns
+# that are still needed, starting from the current column, and drops the
+# rest. It is called every `gc_interval` tokens.
+
+class OnlineEarleyRecognizer(OnlineEarleyRecognizer):
+    def collect(self):
+        live, todo = set(), [self.current]
+        while todo:
+            i = todo.pop()
+            if i in live: continue
+            live.add(i)
+            col = self.columns[i]
+            todo.extend({col.starts[j] for j in
+                         col.order[bisect.bisect_left(col.keys, 0):]})
+        for i in list(self.columns):
+            if i not in live: del self.columns[i]
+        self.collected = self.current
+
+# Finally, `recognize_stream()` feeds the tokens from an iterator one at a
+# time, and yields the status after each. Once the prefix is no longer
+# viable, no further tokens can make it viable again. Hence, we stop there.
+# The `stream_tokens()` reads the characters from a file-like object in
+# chunks.
+
+class OnlineEarleyRecognizer(OnlineEarleyRecognizer):
+    def recognize_stream(self, tokens):
+        yield self.reset()
+        for tok in tokens:
+            viable, complete = self.feed(tok)
+            yield viable, complete
+            if not viable: return
+
+def stream_tokens(stream, size=4096):
+    while True:
+        chunk = stream.read(size)
+        if not chunk: return
+        yield from chunk
+
+# Using it.
+
+if __name__ == '__main__':
+    orec = OnlineEarleyRecognizer(a_grammar, START)
+    for tok, status in zip([None, *'1+(2*3'], orec.recognize_stream('1+(2*3')):
+        print(repr(tok), status)
+
+# The results agree with the batch parser for every prefix.
+
+if __name__ == '__main__':
+    text = '(1+2)*3+4-(5*6)'
+    orec = OnlineEarleyRecognizer(a_grammar, START, gc_interval=3)
+    chart = ClosureEarleyParser(a_grammar).chart_parse(text, START,
+                                                       a_grammar[START])
+    for col, (viable, complete) in zip(chart, orec.recognize_stream(text)):
+        cursor, states = ClosureEarleyParser(a_grammar).parse_prefix(
+                text[:col.index], START)
+        assert viable == (col.index == 0 or len(col) > 0)
+        assert complete == (cursor == col.index and
+                            any(s.finished() for s in states))
+
+# Here is a stream that is not a sentence. We read it from a file-like
+# object.
+
+import io
+
+if __name__ == '__main__':
+    orec = OnlineEarleyRecognizer(a_grammar, START)
+    stream = io.StringIO('1+2)*3')
+    print(list(orec.recognize_stream(stream_tokens(stream))))
+
+# ### Memory
+#
+# How much memory does the recognizer need? It depends on the grammar. For
+# validating a log, where each line is recognized separately, a
+# left-recursive definition of the log is preferable. With a left-recursive
+# definition, all the states that span multiple lines start at the beginning,
+# and only the columns of the current line are kept alive. With a
+# right-recursive definition, every line would keep a state that started at
+# the beginning of that line alive.
+
+LOG_GRAMMAR = {
+    '<start>': [['<log>']],
+    '<log>': [['<log>', '<line>'], []],
+    '<line>': [['<level>', ' ', '<msg>', '\n']],
+    '<level>': [['I', 'N', 'F', 'O'], ['W', 'A', 'R', 'N']],
+    '<msg>': [['<word>'], ['<word>', ' ', '<msg>']],
+    '<word>': [['<char>', '<word>'], ['<char>']],
+    '<char>': [[c] for c in 'abcdefghijklmnopqrstuvwxyz0123456789']
+}
+
+# We generate the log lazily, and feed it to the recognizer, tracking the
+# number of columns kept alive, and the memory allocated.
+
+def log_lines(n):
+    for i in range(n):
+        yield 'WARN disk %d full\n' % i if i % 7 == 0 else 'INFO ok %d\n' % i
+
+if __name__ == '__main__':
+    for n in [100, 400]:
+        orec = OnlineEarleyRecognizer(LOG_GRAMMAR, START, gc_interval=256)
+        tokens = (c for line in log_lines(n) for c in line)
+        tracemalloc.start()
+        max_cols, complete = 0, False
+        for viable, complete in orec.recognize_stream(tokens):
+            max_cols = max(max_cols, len(orec.columns))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%d lines: complete %s, max columns %d, peak %d KiB' % (
+            n, complete, max_cols, peak // 1024))
+
+# ## Counting Parse Trees
+#
+# The `EnhancedExtractor` produces each tree by starting again from the root,
+# and walking the choice nodes to find the next combination of choices. It
+# also recomputes the forest of a state each time it is visited. When the
+# number of trees is large, say for a long ambiguous expression, this means
+# that extracting $$n$$ trees takes time quadratic in $$n$$. Further, if we want, say, the thousandth tree,
+# or a random tree, we still have to go through all the trees before it.
+#
+# We can do better if we know the *number* of trees each node in the forest
+# can produce. The number of trees for a node is the sum of the number of
+# trees for each of its paths, and the number of trees for a path is the
+# product of the number of trees for each of its elements. Given these
+# counts, we can directly construct the $$k$$th tree, by picking the path in
+# which $$k$$ falls, and then splitting the remainder among the elements of that
+# path, much like the digits of a number. Picking $$k$$ at random then gives us
+# a tree chosen uniformly at random from all the trees.
+#
+# As before, we do not want trees where a node contains another node with the
+# same nonterminal and the same span (direct recursion). The count of trees
+# for a node then depends on which nodes are its ancestors. However, an
+# ancestor matters only if it can be reached again from the node, which means
+# that the node and the ancestor are part of the same cycle in the forest.
+# Hence, we find the strongly connected components of the forest first, and
+# use only the ancestors in the same component as part of the memo key. For
+# most forests, there are no cycles, and hence, each node is counted only once.
+#
+# The `ForestEnumerator` is written against a few methods that describe the
+# forest, so that it can be used with other kinds of forests, such as the
+# SPPF from [GLL parsers](/post/2022/07/02/generalized-ll-parser/).
+# * `node_key()` returns a key that identifies the node in the forest.
+# * `node_name()` returns the symbol for the node, or `None` if the children
+#   of the node are to be spliced into its parent.
+# * `node_ident()` returns the identity used for detecting direct recursion,
+#   or `None` if the node is not checked.
+# * `expand()` returns the list of paths for the node, each of which is a
+#   list of nodes.
+#
+# The paths of each node are computed only once.
+
+class ForestEnumerator:
+    def __init__(self, root):
+        self.root = root
+        self._paths, self._counts, self._last = {}, {}, {}
+        self.components = self.find_components()
+        self._next = 0
+
+    def paths(self, node):
+        key = self.node_key(node)
+        if key not in self._paths:
+            self._paths[key] = self.expand(node)
+        return self._paths[key]
+
+    def vertex(self, node):
+        ident = self.node_ident(node)
+        return ('k', self.node_key(node)) if ident is None else ('i', ident)
+
+# The forest is a graph where nodes with the same identity are merged. We
+# compute its strongly connected components using Tarjan's algorithm. Since
+# the forest can be deep, we use an explicit stack rather than recursion. For
+# each vertex that is part of a cycle, we record the identities in its
+# component.
+
+def strongly_connected(edges):
+    index, low, stack, on_stack, components = {}, {}, [], set(), []
+    for root in edges:
+        if root in index: continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges[root]))]
+        while work:
+            v, children = work[-1]
+            for w in children:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(edges[w])))
+                    break
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = set()
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.add(w)
+                        if w == v: break
+                    components.append(component)
+    return components
+
+class ForestEnumerator(ForestEnumerator):
+    def find_components(self):
+        edges, todo, seen = {}, [self.root], {self.node_key(self.root)}
+        while todo:
+            node = todo.pop()
+            v = self.vertex(node)
+            edges.setdefault(v, set())
+            for path in self.paths(node):
+                for child in path:
+                    edges[v].add(self.vertex(child))
+                    edges.setdefault(self.vertex(child), set())
+                    key = self.node_key(child)
+                    if key not in seen:
+                        seen.add(key)
+                        todo.append(child)
+        components = {}
+        for component in strongly_connected(edges):
+            v = next(iter(component))
+            if len(component) > 1 or v in edges[v]:
+                idents = frozenset(i for kind, i in component if kind == 'i')
+                for v in component: components[v] = idents
+        return components
+
+    def memo_key(self, node, seen):
+        relevant = self.components.get(self.vertex(node))
+        return (self.node_key(node), seen & relevant if relevant else None)
+
+# The `child_seen()` returns the ancestors seen by a child, or `None` if the
+# child would be a direct recursion. The `count()` returns the number of trees
+# for each path of the node, given the set of identities of its ancestors. A
+# node without paths is a leaf, and has a single tree. As with the components,
+# the forest can be deep. Hence, `count()` uses an explicit stack, and counts
+# a node only after all its children are counted.
+
+class ForestEnumerator(ForestEnumerator):
+    def child_seen(self, child, seen):
+        ident = self.node_ident(child)
+        if ident is None: return seen
+        if ident in seen: return None
+        return seen | {ident}
+
+    def pending_children(self, node, seen):
+        pending = []
+        for path in self.paths(node):
+            for child in path:
+                child_seen = self.child_seen(child, seen)
+                if child_seen is None: continue
+                key = self.memo_key(child, child_seen)
+                if key not in self._counts:
+                    pending.append((child, child_seen, key))
+        return pending
+
+    def path_count(self, path, seen):
+        n = 1
+        for child in path:
+            child_seen = self.child_seen(child, seen)
+            if child_seen is None: return 0
+            n *= sum(self._counts[self.memo_key(child, child_seen)])
+            if not n: return 0
+        return n
+
+    def count(self, node, seen):
+        root_key = self.memo_key(node, seen)
+        stack = [(node, seen, root_key)]
+        while stack:
+            node, seen, key = stack[-1]
+            if key in self._counts:
+                stack.pop()
+                continue
+            pending = self.pending_children(node, seen)
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            paths = self.paths(node)
+            self._counts[key] = [self.path_count(path, seen)
+                                 for path in paths] if paths else [1]
+        return self._counts[root_key]
+
+    def count_trees(self):
+        return sum(self.count(self.root, frozenset()))
+
+# Given the counts, `nth_node()` constructs the $$k$$th tree for a node. The
+# last element of a path varies the fastest, which gives us the same order of
+# trees as the `EnhancedExtractor`. The `digits()` picks the path in which
+# $$k$$ falls, and splits the remainder among its children. The tree is
+# constructed using an explicit stack. The stack holds the nodes to visit, and
+# the nodes whose children are to be collected from the `done` list once they
+# are built. The result is a list of trees, which has a single element unless
+# the node is to be spliced into its parent.
+#
+# Successive trees mostly differ only in the last few choices. Hence, we
+# remember the subtrees built for the previous tree, keyed by the node, its
+# relevant ancestors, and its own $$k$$. A subtree with the same key is reused
+# as is, without visiting its descendants. Since only the subtrees of the
+# previous tree are kept, the memory needed does not grow with the number of
+# trees enumerated.
+
+class ForestEnumerator(ForestEnumerator):
+    def digits(self, node, seen, k):
+        paths = self.paths(node)
+        if not paths: return []
+        for path, n in zip(paths, self.count(node, seen)):
+            if k < n: break
+            k -= n
+        digits = []
+        for child in reversed(path):
+            child_seen = self.child_seen(child, seen)
+            k, digit = divmod(k, sum(self.count(child, child_seen)))
+            digits.append((child, child_seen, digit))
+        return digits[::-1]
+
+    def nth_node(self, node, seen, k):
+        stack, done, built = [(True, node, seen, k)], [], {}
+        while stack:
+            item = stack.pop()
+            if item[0]:
+                _, node, seen, k = item
+                key = (self.memo_key(node, seen), k)
+                if key in self._last:
+                    built[key] = self._last[key]
+                    done.append(built[key])
+                    continue
+                digits = self.digits(node, seen, k)
+                stack.append((False, node, key, len(digits)))
+                stack.extend((True, *d) for d in reversed(digits))
+                continue
+            _, node, key, n = item
+            parts = done[len(done) - n:]
+            del done[len(done) - n:]
+            children = [t for part in parts for t in part]
+            name = self.node_name(node)
+            built[key] = children if name is None else [(name, children)]
+            done.append(built[key])
+        self._last = built
+        return done[0]
+
+    def nth_tree(self, k):
+        if not 0 <= k < self.count_trees(): raise IndexError(k)
+        tree, = self.nth_node(self.root, frozenset(), k)
+        return tree
+
+    def random_tree(self):
+        return self.nth_tree(random.randrange(self.count_trees()))
+
+# Finally, we can enumerate all trees lazily, and we also provide the
+# `extract_a_tree()` interface of `EnhancedExtractor`.
+
+class ForestEnumerator(ForestEnumerator):
+    def extract_trees(self):
+        for k in range(self.count_trees()):
+            yield self.nth_tree(k)
+
+    def extract_a_tree(self):
+        if self._next >= self.count_trees(): return None
+        self._next += 1
+        return self.nth_tree(self._next - 1)
+
+# For the Earley parser, the nodes are the elements of the paths as returned
+# by `parse_paths()`, that is `(state, kind, chart)`. A node is checked
+# for direct recursion using its nonterminal and span, as in the
+# `EnhancedExtractor`. The root is the forest of the finished start states.
+
+class LazyExtractor(ForestEnumerator):
+    def __init__(self, parser, text, start_symbol):
+        self.parser = parser
+        cursor, states = parser.parse_prefix(text, start_symbol)
+        starts = [s for s in states if s.finished()]
+        if cursor < len(text) or not starts:
+            raise SyntaxError("at " + repr(cursor))
+        self.my_forest = parser.parse_forest(parser.table, starts)
+        super().__init__((None, 'r', None))
+
+    def node_key(self, node):
+        s, kind, chart = node
+        if kind != 'n': return (kind, s)
+        return (s.name, s.expr, s.dot, s.s_col.index, s.e_col.index)
+
+    def node_name(self, node):
+        s, kind, chart = node
+        if kind == 'r': return self.my_forest[0]
+        return s if kind == 't' else s.name
+
+    def node_ident(self, node):
+        s, kind, chart = node
+        if kind != 'n': return None
+        return (s.name, s.s_col.index, s.e_col.index)
+
+    def expand(self, node):
+        s, kind, chart = node
+        if kind == 't': return []
+        if kind == 'r': return self.my_forest[1]
+        name, paths = self.parser.forest(s, kind, chart)
+        return paths
+
+# Using it.
+
+if __name__ == '__main__':
+    le = LazyExtractor(EarleyParser(a_grammar), '1+2+3+4', START)
+    print(le.count_trees())
+    print(tree_to_str(le.nth_tree(3)))
+    format_parsetree(le.random_tree())
+
+# We get the same trees in the same order as the `EnhancedExtractor`, even
+# for the forests with cycles.
+
+def extract_all(extractor):
+    trees = []
+    while True:
+        t = extractor.extract_a_tree()
+        if t is None: return trees
+        trees.append(t)
+
+if __name__ == '__main__':
+    for g, s in [(a_grammar, '1+2+3*4'), (a_grammar, '(1+2)*3-4/5'),
+                 (directly_self_referring, 'a'),
+                 (indirectly_self_referring, 'a'),
+                 (RR_GRAMMAR5, 'abababab'), (LR_GRAMMAR, 'aaaa')]:
+        for P in [EarleyParser, ClosureEarleyParser]:
+            expected = extract_all(EnhancedExtractor(P(g), s, START))
+            le = LazyExtractor(P(g), s, START)
+            assert le.count_trees() == len(expected)
+            assert list(le.extract_trees()) == expected
+            assert extract_all(LazyExtractor(P(g), s, START)) == expected
+
+# Successive trees share the subtrees that did not change.
+
+def subtree_ids(tree):
+    ids, todo = set(), [tree]
+    while todo:
+        t = todo.pop()
+        ids.add(id(t))
+        todo.extend(t[1])
+    return ids
+
+if __name__ == '__main__':
+    le = LazyExtractor(ClosureEarleyParser(a_grammar), '1+2+3*4', START)
+    t0, t1 = le.nth_tree(0), le.nth_tree(1)
+    assert subtree_ids(t0) & subtree_ids(t1)
+
+# The counts can be very large. Here is a random tree out of all the trees
+# for a long expression, which we could not have obtained by enumeration.
+
+if __name__ == '__main__':
+    text = '+'.join(str(i % 10) for i in range(40))
+    le = LazyExtractor(ClosureEarleyParser(a_grammar), text, START)
+    print(le.count_trees())
+    assert tree_to_str(le.random_tree()) == text
+
+# Deeply nested inputs produce deep forests, which are handled without
+# running out of stack.
+
+if __name__ == '__main__':
+    text = '(' * 1500 + '1' + ')' * 1500
+    le = LazyExtractor(ClosureEarleyParser(a_grammar), text, START)
+    assert le.count_trees() == 1
+    assert tree_to_str(le.nth_tree(0)) == text
+
+# ### Benchmark
+#
+# We extract the first few thousand trees of an ambiguous expression with
+# both the extractors.
+
+if __name__ == '__main__':
+    text = '+'.join(str(i % 10) for i in range(12))
+    for n in [500, 1000, 2000]:
+        t0 = time.perf_counter()
+        ee = EnhancedExtractor(ClosureEarleyParser(a_grammar), text, START)
+        for i in range(n): ee.extract_a_tree()
+        t1 = time.perf_counter()
+        le = LazyExtractor(ClosureEarleyParser(a_grammar), text, START)
+        for i in range(n): le.extract_a_tree()
+        t2 = time.perf_counter()
+        print('%d trees: enhanced %.3fs lazy %.3fs' % (n, t1 - t0, t2 - t1))
+
 # The runnable Python source for this post is available [here](https://github.com/rahulgopinath/rahulgopinath.github.io/blob/master/notebooks/2021-02-06-earley-parsing.py).
 # 
 # [^earley1970an]: Earley, Jay. "An efficient context-free parsing algorithm." Communications of the ACM 13.2 (1970): 94-102.
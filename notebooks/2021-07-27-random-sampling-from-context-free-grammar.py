@@ -785,6 +785,540 @@ if __name__ == '__main__':
         print("mystring:", repr(string), "at:", v, "upto:", at)
 
 
+# ## Bottom-up Counting Tables
+#
+# The `RandomSampleCFG` computes the counts top down, recursing through each
+# possible split of each rule, and memoizing the results keyed by the rule
+# and the length. For lengths in the hundreds, this exceeds the recursion
+# limit of Python, and the linked `KeyNode` and `RuleNode` objects take a lot
+# of memory. Further, the counts themselves grow exponentially with the
+# length, so they quickly become very large integers.
+#
+# However, in an epsilon-free grammar, the number of strings of length `l`
+# from a rule `A B C` depends only on the number of strings of length less
+# than `l` from `A` and from the suffix `B C` (both have to produce at least
+# one character). The only exception is a rule with a single symbol, such as
+# `<E> ::= <F>`, where the count of `<E>` of length `l` depends on the count of
+# `<F>` of the same length. So, we can fill the count tables bottom up, one
+# length at a time, as long as, within a length, we compute `<F>` before
+# `<E>`. (If such unit rules form a cycle, the number of derivations is
+# infinite, and we give up.) Note that left recursion is not a problem here,
+# as the count for a left recursive rule only depends on the counts for
+# smaller lengths.
+#
+# We start by compiling the grammar. Each suffix of each rule (such as
+# `A B C`, `B C`, and `C`) gets an id, and identical suffixes share the same
+# id. A suffix is represented by its head symbol and the id of its tail (or
+# `None`). The empty rules are ignored, as before.
+
+import array
+import math
+
+class BottomUpSampleCFG:
+    def __init__(self, grammar, mode='exact', modulus=(1 << 61) - 1):
+        assert mode in ('exact', 'log', 'mod')
+        self.grammar, self.mode, self.modulus = grammar, mode, modulus
+        self.suffixes, self.suffix_id = [], {}
+        self.key_rules = {k: [self.add_suffix(tuple(r)) for r in grammar[k] if r]
+                          for k in grammar}
+        self.order = self.unit_order()
+        self.upto = 0
+        self.key_counts = {k: self.new_table() for k in grammar}
+        self.suffix_counts = [self.new_table() for s in self.suffixes]
+
+    def add_suffix(self, rule):
+        if rule in self.suffix_id: return self.suffix_id[rule]
+        tail = self.add_suffix(rule[1:]) if len(rule) > 1 else None
+        self.suffix_id[rule] = len(self.suffixes)
+        self.suffixes.append((rule[0], tail))
+        return self.suffix_id[rule]
+
+# The `unit_order()` orders the nonterminals such that for each unit rule
+# `<E> ::= <F>`, the `<F>` comes before `<E>`.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def unit_order(self):
+        deps = {k: {r[0] for r in self.grammar[k]
+                    if len(r) == 1 and r[0] in self.grammar} for k in self.grammar}
+        order, done = [], set()
+        for k in self.grammar:
+            if k in done: continue
+            path, stack = {k}, [(k, iter(deps[k]))]
+            while stack:
+                key, it = stack[-1]
+                nxt = next(it, None)
+                if nxt is None:
+                    stack.pop()
+                    path.discard(key)
+                    done.add(key)
+                    order.append(key)
+                elif nxt in path:
+                    raise ValueError('Cyclic unit rules at %s' % nxt)
+                elif nxt not in done:
+                    path.add(nxt)
+                    stack.append((nxt, iter(deps[nxt])))
+        return order
+
+# ### The count representation
+#
+# The counts can be kept in three ways. With `mode='exact'`, we use Python
+# integers, which are exact, but grow without bound. With `mode='log'`, we
+# keep the natural logarithm of the count as a float (with `-inf` for zero).
+# These take constant space, and are good enough for sampling, but can not be
+# used to index a specific string. With `mode='mod'`, we keep the counts
+# modulo a (prime) modulus, which is useful when we only need to compare
+# counts, say between two grammars. The tables for the latter two are arrays
+# of machine words.
+#
+# The only operations we need on the counts are to add up the products of
+# the counts for each split.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def new_table(self):
+        if self.mode == 'exact': return [0]
+        if self.mode == 'log': return array.array('d', [-math.inf])
+        return array.array('q', [0])
+
+    def sum_of_products(self, pairs):
+        if self.mode == 'exact':
+            return sum(a * b for a, b in pairs if a and b)
+        if self.mode == 'mod':
+            return sum(a * b for a, b in pairs if a and b) % self.modulus
+        logs = [a + b for a, b in pairs if a != -math.inf and b != -math.inf]
+        if not logs: return -math.inf
+        m = max(logs)
+        return m + math.log(sum(math.exp(v - m) for v in logs))
+
+    def one(self):
+        return 0.0 if self.mode == 'log' else 1
+
+    def zero(self):
+        return -math.inf if self.mode == 'log' else 0
+
+# ### Filling the tables
+#
+# The count of a symbol of a given length is taken from the table if it is a
+# nonterminal. A terminal symbol has exactly one string, of its own length.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def count(self, sym, l):
+        if sym in self.grammar: return self.key_counts[sym][l]
+        return self.one() if len(sym) == l else self.zero()
+
+    def suffix_count(self, s, l):
+        head, tail = self.suffixes[s]
+        if tail is None: return self.count(head, l)
+        return self.suffix_counts[s][l]
+
+    def splits(self, s, l):
+        head, tail = self.suffixes[s]
+        if tail is None: return [l]
+        if head not in self.grammar:
+            return [len(head)] if len(head) < l else []
+        return range(1, l)
+
+# For each length, we first fill the suffixes with more than one symbol, which
+# only depend on the smaller lengths. Then, we fill the nonterminals in the
+# order computed above. The suffixes with a single symbol are not stored, as
+# their count is simply the count of their symbol.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def build(self, upto):
+        for l in range(self.upto + 1, upto + 1):
+            for s, (head, tail) in enumerate(self.suffixes):
+                if tail is None:
+                    self.suffix_counts[s].append(self.zero())
+                    continue
+                self.suffix_counts[s].append(self.sum_of_products(
+                    (self.count(head, h), self.suffix_count(tail, l - h))
+                    for h in self.splits(s, l)))
+            for k in self.order:
+                self.key_counts[k].append(self.zero())
+                self.key_counts[k][l] = self.sum_of_products(
+                        (self.suffix_count(s, l), self.one())
+                        for s in self.key_rules[k])
+        self.upto = max(self.upto, upto)
+        return self
+
+# Using it.
+
+if __name__ == '__main__':
+    bu = BottomUpSampleCFG(E1).build(10)
+    rscfg = RandomSampleCFG(E1)
+    rscfg.produce_shared_forest('<start>', 10)
+    for l in range(1, 11):
+        print(l, bu.count('<start>', l), rscfg.ds[l].count)
+
+# ### Indexing
+#
+# With exact counts, we can also extract the string (the derivation tree)
+# at any given index, in the same order as `RandomSampleCFG`. For each
+# nonterminal, the strings are ordered by rule, and within a rule, by the
+# length of the head. Within a given length of the head, the strings are
+# ordered first by the split of the tail, and then by the index of the head
+# string.
+#
+# We avoid recursion by keeping a stack of the pending work. A `key` task
+# extracts the string at a given index from a symbol, and appends the tree to
+# the given list of children. A `split` task does the same for a suffix with
+# a given split.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def node_count(self, s, l, h):
+        head, tail = self.suffixes[s]
+        if tail is None: return self.count(head, l)
+        return self.count(head, h) * self.suffix_count(tail, l - h)
+
+    def nodes(self, s, l):
+        # the splits of suffix s of length l, and the count for each.
+        for h in self.splits(s, l):
+            c = self.node_count(s, l, h)
+            if c: yield h, c
+
+    def locate(self, items, at):
+        for item, c in items:
+            if at < c: return item, at
+            at -= c
+        assert False
+
+    def key_get_string_at(self, key, l, at):
+        if self.mode != 'exact':
+            raise ValueError('Indexing needs exact counts')
+        assert at < self.count(key, l)
+        root = []
+        stack = [('key', key, l, at, root)]
+        while stack:
+            kind, sym, l, at, children = stack.pop()
+            if kind == 'key':
+                if sym not in self.grammar:
+                    children.append((sym, []))
+                    continue
+                node = (sym, [])
+                children.append(node)
+                (s, h), at = self.locate(
+                    (((s, h), c) for s in self.key_rules[sym]
+                                 for h, c in self.nodes(s, l)), at)
+                stack.append(('split', (s, h), l, at, node[1]))
+            else:
+                (s, h) = sym
+                head, tail = self.suffixes[s]
+                if tail is None:
+                    stack.append(('key', head, l, at, children))
+                    continue
+                n_head = self.count(head, h)
+                h2, at = self.locate(
+                    ((h2, c * n_head) for h2, c in self.nodes(tail, l - h)), at)
+                c2 = self.node_count(tail, l - h, h2)
+                stack.append(('split', (tail, h2), l - h, at % c2, children))
+                stack.append(('key', head, h, at // c2, children))
+        return root[0]
+
+# We verify that we get the same strings in the same order as
+# `RandomSampleCFG`.
+
+if __name__ == '__main__':
+    for g in [G, G2, E1, E2, LRG]:
+        rscfg = RandomSampleCFG(g)
+        rscfg.produce_shared_forest('<start>', 7)
+        bu = BottomUpSampleCFG(g).build(7)
+        for l in range(1, 8):
+            assert bu.count('<start>', l) == rscfg.ds[l].count
+            for at in range(0, rscfg.ds[l].count, max(1, rscfg.ds[l].count // 50)):
+                assert bu.key_get_string_at('<start>', l, at) == \
+                    rscfg.key_get_string_at(rscfg.ds[l], at)
+
+# ### Random Sampling
+#
+# With exact counts, we sample an index uniformly, and extract the string at
+# that index. With counts in log space, we can not do that. Instead, we make
+# each choice (the rule and the split, and then, the split of each tail) with
+# a probability proportional to the number of strings it leads to. The result
+# is (up to the precision of the floats) again a uniform sample.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def weighted(self, items):
+        items = list(items)
+        m = max(c for _, c in items)
+        return random.choices([item for item, _ in items],
+                              [math.exp(c - m) for _, c in items])[0]
+
+    def log_nodes(self, s, l):
+        head, tail = self.suffixes[s]
+        for h in self.splits(s, l):
+            if tail is None:
+                c = self.count(head, l)
+            else:
+                c = self.count(head, h) + self.suffix_count(tail, l - h)
+            if c != -math.inf: yield h, c
+
+    def key_sample(self, key, l):
+        if self.mode == 'exact':
+            return self.key_get_string_at(key, l, random.randrange(self.count(key, l)))
+        if self.mode != 'log':
+            raise ValueError('Sampling needs exact or log counts')
+        root = []
+        stack = [(key, l, None, root)]
+        while stack:
+            sym, l, s, children = stack.pop()
+            if s is None:
+                if sym not in self.grammar:
+                    children.append((sym, []))
+                    continue
+                node = (sym, [])
+                children.append(node)
+                s, h = self.weighted(((s, h), c) for s in self.key_rules[sym]
+                                                 for h, c in self.log_nodes(s, l))
+            else:
+                h = self.weighted(((h, c) for h, c in self.log_nodes(s, l)))
+                node = (None, children)
+            head, tail = self.suffixes[s]
+            if tail is not None:
+                stack.append((None, l - h, tail, node[1]))
+            stack.append((head, h, None, node[1]))
+        return root[0]
+
+# Finally, sampling strings of length up to `l` first picks the length in
+# proportion to the number of strings of that length.
+
+class BottomUpSampleCFG(BottomUpSampleCFG):
+    def random_sample(self, start, l):
+        self.build(l)
+        counts = [(i, self.count(start, i)) for i in range(1, l + 1)]
+        if self.mode == 'exact':
+            i, at = self.locate(counts, random.randrange(sum(c for _, c in counts)))
+            return i, self.key_get_string_at(start, i, at)
+        i = self.weighted((i, c) for i, c in counts if c != -math.inf)
+        return i, self.key_sample(start, i)
+
+# Using it.
+
+if __name__ == '__main__':
+    for mode in ['exact', 'log']:
+        bu = BottomUpSampleCFG(E1, mode=mode)
+        for i in range(5):
+            l, tree = bu.random_sample('<start>', 10)
+            print(mode, l, repr(fuzzer.tree_to_string(tree)))
+
+# The counts in log space and modulo agree with the exact counts.
+
+if __name__ == '__main__':
+    exact = BottomUpSampleCFG(E2).build(60)
+    logs = BottomUpSampleCFG(E2, mode='log').build(60)
+    mods = BottomUpSampleCFG(E2, mode='mod').build(60)
+    for l in range(1, 61):
+        c = exact.count('<start>', l)
+        assert mods.count('<start>', l) == c % mods.modulus
+        if c: assert math.isclose(logs.count('<start>', l), math.log(c))
+
+# ### Benchmark
+#
+# We compare the time and memory taken to build the tables for increasing
+# lengths. The `RandomSampleCFG` is recursive, and could run out of stack for
+# long strings, which we report. Even when it does not, its time and memory
+# grow much faster with the length than those of the bottom-up tables. So we
+# compare both only up to length 100, and go further with the bottom-up tables
+# alone.
+
+import time
+import tracemalloc
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        fn()
+        result = 'ok'
+    except RecursionError:
+        result = 'RecursionError'
+    t1 = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, t1 - t0, peak // 1024
+
+if __name__ == '__main__':
+    for l in [25, 50, 100, 200, 400]:
+        if l <= 100:
+            print('%d RandomSampleCFG: %s %.3fs %d KiB' % (l, *measure(
+                lambda: RandomSampleCFG(E2).produce_shared_forest('<start>', l))))
+        for mode in ['exact', 'log', 'mod']:
+            print('%d %s: %s %.3fs %d KiB' % (l, mode, *measure(
+                lambda: BottomUpSampleCFG(E2, mode=mode).build(l))))
+
+# ## Sampling in Batches
+#
+# When we need a large number of samples, say thousands of strings of each
+# length for checking whether two grammars are equivalent, calling
+# `key_get_string_at()` for each index walks the shared forest from the root
+# each time, and at each node, scans the rules one by one to find the one
+# that contains the index. Instead, we can sort the indexes, and walk the
+# forest once for the whole batch. At each node, the sorted indexes are
+# split between the children, with each child receiving a sorted batch of
+# its own. The child that contains a given index is found by bisecting an
+# array of the prefix sums of the counts of the children, which is computed
+# once for each node.
+#
+# For a rule node with a tail, the strings are ordered by the tail node
+# first, and then by the string from the head. That is, for the tail node
+# `j`, the block of indexes has the size `key.count * tail[j].count`. Within the
+# block, the index `r` is the string `r // tail[j].count` from the head,
+# followed by the string `r % tail[j].count` from the tail.
+
+import itertools
+
+def prefix_sums(counts):
+    return [0] + list(itertools.accumulate(counts))
+
+class RandomSampleCFG(RandomSampleCFG):
+    def node_sums(self, node):
+        if not hasattr(node, 'sums'):
+            if isinstance(node, KeyNode):
+                node.sums = prefix_sums(r.count for r in node.rules)
+            else:
+                node.sums = prefix_sums(node.key.count * r.count
+                                        for r in node.tail)
+        return node.sums
+
+    def split_batch(self, sums, ats):
+        # yields the child index and the batch of offsets within the child.
+        i = 0
+        while i < len(ats):
+            j = bisect.bisect_right(sums, ats[i]) - 1
+            k = bisect.bisect_left(ats, sums[j + 1], i)
+            yield j, [a - sums[j] for a in ats[i:k]]
+            i = k
+
+# The `key_get_strings_at()` takes a sorted list of distinct indexes, and
+# returns the derivation trees for each in the same order. The
+# `rule_get_strings_at()` does the same for a rule node, returning the list
+# of children for each index. Note that the same index of a node is expanded
+# only once for a batch. Hence, when two samples share a subtree (say the
+# same head string), the subtree objects are shared between the two trees.
+# With `as_string=True`, we skip the trees altogether, and directly
+# concatenate the strings.
+
+class RandomSampleCFG(RandomSampleCFG):
+    def key_get_strings_at(self, key_node, ats, as_string=False):
+        if not key_node.rules:
+            if as_string: return [key_node.token] * len(ats)
+            return [(key_node.token, []) for a in ats]
+        result = []
+        for j, batch in self.split_batch(self.node_sums(key_node), ats):
+            res = self.rule_get_strings_at(key_node.rules[j], batch, as_string)
+            if as_string: result.extend(res)
+            else: result.extend((key_node.token, children) for children in res)
+        return result
+
+    def rule_get_strings_at(self, rule_node, ats, as_string=False):
+        if not rule_node.tail:
+            res = self.key_get_strings_at(rule_node.key, ats, as_string)
+            return res if as_string else [[t] for t in res]
+        result = []
+        for j, batch in self.split_batch(self.node_sums(rule_node), ats):
+            c = rule_node.tail[j].count
+            heads = sorted({r // c for r in batch})
+            tails = sorted({r % c for r in batch})
+            head_res = dict(zip(heads,
+                self.key_get_strings_at(rule_node.key, heads, as_string)))
+            tail_res = dict(zip(tails,
+                self.rule_get_strings_at(rule_node.tail[j], tails, as_string)))
+            if as_string:
+                result.extend(head_res[r // c] + tail_res[r % c] for r in batch)
+            else:
+                result.extend([head_res[r // c]] + tail_res[r % c] for r in batch)
+        return result
+
+# We check that these are the same as the trees from `key_get_string_at()`
+
+if __name__ == '__main__':
+    for g in [G, G2, E1, E2, LRG]:
+        rscfg = RandomSampleCFG(g)
+        rscfg.produce_shared_forest('<start>', 7)
+        for l in range(1, 8):
+            ats = list(range(0, rscfg.ds[l].count,
+                             max(1, rscfg.ds[l].count // 500)))
+            trees = [rscfg.key_get_string_at(rscfg.ds[l], at) for at in ats]
+            assert rscfg.key_get_strings_at(rscfg.ds[l], ats) == trees
+            assert rscfg.key_get_strings_at(rscfg.ds[l], ats, True) == \
+                    [fuzzer.tree_to_string(t) for t in trees]
+
+# ### Streaming samples
+#
+# The `sample_many()` draws `n` strings of the given length uniformly at
+# random (with replacement). The indexes are drawn in batches of
+# `batch_size`, and each batch is expanded together, with the results
+# yielded in the order the indexes were drawn. With `as_string=True`, we
+# get the strings rather than the derivation trees. The
+# `sample_many_upto()` does the same for strings of length from `1` up to
+# `l`, picking the length of each with a probability proportional to the
+# number of strings of that length, as `random_sample()` does.
+
+class RandomSampleCFG(RandomSampleCFG):
+    def sample_batch(self, nodes, sums, ats, as_string):
+        uniq = sorted(set(ats))
+        trees = {}
+        for j, batch in self.split_batch(sums, uniq):
+            res = self.key_get_strings_at(nodes[j], batch, as_string)
+            trees.update(zip((at + sums[j] for at in batch), res))
+        return [trees[at] for at in ats]
+
+    def sample_nodes(self, nodes, n, batch_size, as_string):
+        sums = prefix_sums(node.count for node in nodes)
+        if not sums[-1]: return
+        while n > 0:
+            size = min(n, batch_size)
+            ats = [random.randrange(sums[-1]) for i in range(size)]
+            yield from self.sample_batch(nodes, sums, ats, as_string)
+            n -= size
+
+    def sample_many(self, key, l, n, batch_size=1024, as_string=False):
+        self.produce_shared_forest(key, l)
+        node = self.key_get_def(key, l)
+        yield from self.sample_nodes([node], n, batch_size, as_string)
+
+    def sample_many_upto(self, key, l, n, batch_size=1024, as_string=False):
+        nodes = [self.key_get_def(key, i) for i in range(1, l + 1)]
+        yield from self.sample_nodes(nodes, n, batch_size, as_string)
+
+# Using it.
+
+if __name__ == '__main__':
+    rscfg = RandomSampleCFG(E1)
+    for s in rscfg.sample_many('<start>', 9, 5, as_string=True):
+        print(repr(s))
+    for s in rscfg.sample_many_upto('<start>', 9, 5, as_string=True):
+        print(repr(s))
+
+# Given the same seed, the batched samples are the same as the samples from
+# `key_get_string_at()` for the same random indexes.
+
+if __name__ == '__main__':
+    rscfg = RandomSampleCFG(E2)
+    random.seed(0)
+    batched = list(rscfg.sample_many('<start>', 13, 100, batch_size=32))
+    random.seed(0)
+    node = rscfg.key_get_def('<start>', 13)
+    single = [rscfg.key_get_string_at(node, random.randrange(node.count))
+              for i in range(100)]
+    assert batched == single
+
+# ### Benchmark
+#
+# We compare drawing samples one at a time with drawing them in batches.
+
+if __name__ == '__main__':
+    for g, l, n in [(E1, 9, 2000), (E2, 13, 2000), (G, 15, 2000)]:
+        rscfg = RandomSampleCFG(g)
+        node = rscfg.key_get_def('<start>', l)
+        t0 = time.perf_counter()
+        single = [fuzzer.tree_to_string(
+            rscfg.key_get_string_at(node, random.randrange(node.count)))
+                  for i in range(n)]
+        t1 = time.perf_counter()
+        batched = list(rscfg.sample_many('<start>', l, n, as_string=True))
+        t2 = time.perf_counter()
+        print('length %d, %d samples: single %.3fs batched %.3fs' % (
+            l, n, t1 - t0, t2 - t1))
+
 # There are a few limitations to this algorithm. The first is that it does
 # not take into account epsilons -- that is empty derivations. It can be
 # argued that it is not that big of a concern since any context-free grammar
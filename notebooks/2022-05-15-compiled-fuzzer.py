@@ -51,29 +51,12 @@ EXPR_START = '<start>'
 # [*Building Fast Fuzzers*](/publications/2019/11/18/arxiv-building/).
 # The idea is to compile a grammar definition to the corresponding source code.
 # Each nonterminal symbol becomes a procedure. First we define a few helpers.
-
-def symbol_cost(grammar, symbol, seen, cache):
-    if symbol in seen: return float('inf')
-    lst = []
-    for rule in grammar.get(symbol, []):
-        if symbol in cache and str(rule) in cache[symbol]:
-            lst.append(cache[symbol][str(rule)])
-        else:
-            lst.append(expansion_cost(grammar, rule, seen | {symbol}, cache))
-    v = min(lst, default=0)
-    return v
-
-def expansion_cost(grammar, tokens, seen, cache):
-    return max((symbol_cost(grammar, token, seen, cache)
-                for token in tokens if token in grammar), default=0) + 1
+# For the cost of expanding each rule, we use the `compute_cost()` from the
+# [previous post](/post/2019/05/28/simplefuzzer-01/), which computes the
+# costs in linear time.
 
 def compute_cost(grammar):
-    rule_cost = {}
-    for k in grammar:
-        rule_cost[k] = {}
-        for rule in grammar[k]:
-            rule_cost[k][str(rule)] = expansion_cost(grammar, rule, set(), rule_cost)
-    return rule_cost
+    return fuzzer.compute_cost(grammar)
 
 # We are going to compile the grammar, which will
 # become a source file that we load separately. To ensure that we do not
@@ -564,3 +547,290 @@ if __name__ == '__main__':
         v = expr_fuzzer.start(10)
         print(repr(v))
 
+
+# ## Fuzzing in Parallel
+#
+# The fuzzers above run in a single process, and use the global `random`
+# module. To use all the cores on a machine, we shard the generation across a
+# pool of processes. However, we want the results to be reproducible. That
+# is, given the master seed and the index of a sample, we should be able to
+# generate that sample again, irrespective of how many processes were used,
+# or which process generated it. So, rather than seeding each worker, we
+# derive the seed of each sample from the master seed and its index, and seed
+# the global `random` before generating it. (A string seed is hashed by
+# `random.seed()`, so consecutive indexes give unrelated seeds.)
+
+import random
+
+def sample_seed(seed, index):
+    return '%d:%d' % (seed, index)
+
+# A *sampler* is any function with no arguments that returns a new input.
+# Since the compiled fuzzers are modules created with `exec()`, they can not
+# be sent to another process. Hence, each worker builds its own sampler by
+# calling the `make_sampler` function once, when it starts. Here are the
+# samplers for the fuzzers we have seen so far.
+
+def f1_sampler(grammar, max_depth=10, fuzzer_class=F1Fuzzer):
+    f = fuzzer_class(grammar).fuzzer('sampler')
+    return lambda: f.start(max_depth)
+
+def limit_sampler(grammar, max_depth=10, key='<start>'):
+    f = fuzzer.LimitFuzzer(grammar)
+    return lambda: f.fuzz(key=key, max_depth=max_depth)
+
+# Each worker generates a batch of consecutive indexes at a time, and also
+# evaluates the predicate (if any) on each input, so that the predicate also
+# runs in parallel. The result of a batch is a list of
+# `(index, input, verdict)` triples.
+
+_worker = {}
+
+def init_worker(make_sampler, predicate, seed):
+    _worker['sampler'] = make_sampler()
+    _worker['predicate'] = predicate
+    _worker['seed'] = seed
+
+def run_batch(indexes):
+    sampler, predicate, seed = _worker['sampler'], _worker['predicate'], _worker['seed']
+    batch = []
+    for i in range(*indexes):
+        random.seed(sample_seed(seed, i))
+        s = sampler()
+        batch.append((i, s, predicate(s) if predicate is not None else None))
+    return batch
+
+# The `ParallelFuzzer` hands out the batches to the workers, and returns
+# them in the order of their indexes as they are completed. With
+# `processes=0`, everything is done in the current process (for example,
+# where `multiprocessing` is not available). Note that `make_sampler` and
+# `predicate` have to be picklable (e.g. top level functions, or
+# `functools.partial` of top level functions) unless the processes are
+# forked.
+
+import functools
+import json
+import multiprocessing
+import os
+
+class ParallelFuzzer:
+    def __init__(self, make_sampler, seed=0, processes=None, batch_size=1000,
+                 predicate=None):
+        self.make_sampler, self.seed = make_sampler, seed
+        self.processes = os.cpu_count() if processes is None else processes
+        self.batch_size, self.predicate = batch_size, predicate
+        self._sampler = None
+
+    def ranges(self, n, start):
+        return [(i, min(i + self.batch_size, start + n))
+                for i in range(start, start + n, self.batch_size)]
+
+    def batches(self, n, start=0):
+        args = (self.make_sampler, self.predicate, self.seed)
+        if not self.processes:
+            init_worker(*args)
+            yield from map(run_batch, self.ranges(n, start))
+            return
+        with multiprocessing.Pool(self.processes, init_worker, args) as pool:
+            yield from pool.imap(run_batch, self.ranges(n, start))
+
+# The results can be streamed to a file (one JSON object per line), or a
+# callback that is called with each batch. The `run()` returns the number of
+# inputs with each verdict.
+
+class ParallelFuzzer(ParallelFuzzer):
+    def run(self, n, out=None, callback=None, start=0):
+        verdicts = {}
+        for batch in self.batches(n, start):
+            for i, s, v in batch:
+                verdicts[v] = verdicts.get(v, 0) + 1
+                if out is not None:
+                    out.write(json.dumps({'index': i, 'input': s, 'verdict': v}) + '\n')
+            if callback is not None: callback(batch)
+        return verdicts
+
+    def sample(self, index):
+        if self._sampler is None: self._sampler = self.make_sampler()
+        random.seed(sample_seed(self.seed, index))
+        return self._sampler()
+
+# We need a predicate to check. Here, we check whether the expression can be
+# evaluated by Python without errors.
+
+def expr_predicate(s):
+    try:
+        eval(s)
+        return 'pass'
+    except Exception as e:
+        return type(e).__name__
+
+# Using it.
+
+if __name__ == '__main__':
+    import io
+    pf = ParallelFuzzer(functools.partial(f1_sampler, EXPR_GRAMMAR),
+                        seed=42, processes=2, batch_size=50,
+                        predicate=expr_predicate)
+    out = io.StringIO()
+    print(pf.run(200, out=out))
+    lines = [json.loads(l) for l in out.getvalue().splitlines()]
+    print(lines[0])
+
+# Any sample can be reproduced from the seed and its index. The results are
+# the same irrespective of the number of processes and the batch size.
+
+if __name__ == '__main__':
+    for l in lines[:20]:
+        assert pf.sample(l['index']) == l['input']
+    other = ParallelFuzzer(functools.partial(f1_sampler, EXPR_GRAMMAR),
+                           seed=42, processes=0, batch_size=7,
+                           predicate=expr_predicate)
+    results = []
+    other.run(200, callback=results.extend)
+    assert [(l['index'], l['input'], l['verdict']) for l in lines] == results
+
+# ### Benchmark
+#
+# We measure the throughput with different numbers of processes. The
+# speedup depends on the number of cores available.
+
+if __name__ == '__main__':
+    import time
+    n = 10000
+    for processes in sorted({0, 1, 2, os.cpu_count()}):
+        pf = ParallelFuzzer(functools.partial(f1_sampler, EXPR_GRAMMAR),
+                            seed=0, processes=processes, batch_size=2000,
+                            predicate=expr_predicate)
+        t0 = time.perf_counter()
+        pf.run(n)
+        t1 = time.perf_counter()
+        print('%d processes (%d cores): %d inputs/s' % (
+            processes, os.cpu_count(), n / (t1 - t0)))
+
+# ## Caching the Compiled Fuzzers
+#
+# For large grammars, generating the source of the fuzzer, and compiling it
+# takes a noticeable amount of time, and we do it again every time the fuzzer
+# is loaded. Since the generated source depends only on the grammar and the
+# kind of fuzzer (`F1Fuzzer`, `F1CPSFuzzer`, or `F1LFuzzer`), we can save it
+# to disk, and import it later. We also compile the source to bytecode
+# (`.pyc`) in the `__pycache__` directory next to it. (We do this explicitly
+# with `py_compile` as Python may have been told not to write bytecode on
+# import.) When the module is imported, Python reuses the bytecode as long as
+# the source file is unchanged. So, the later runs neither generate nor
+# compile the source.
+#
+# The file name contains a hash of the grammar (in order, as the order of
+# rules determines the generated code), the kind of fuzzer, and a generator
+# version, which should be incremented whenever the generated source changes.
+# Since the hash needs only the grammar and the kind of fuzzer, the fuzzer
+# itself (which computes the costs of the grammar) is constructed only when
+# the source is not in the cache.
+#
+# Since the cached modules are executed when loaded, the cache should not be
+# writable by anyone else. By default, it is kept under `$XDG_CACHE_HOME` (or
+# `~/.cache`) in a directory that only the user can read or write.
+
+import hashlib
+import importlib.util
+import py_compile
+import tempfile
+
+def user_cache_dir(name):
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, name)
+
+F1_GENERATOR_VERSION = 1
+F1_CACHE_DIR = user_cache_dir('f1-fuzzers')
+
+def fuzzer_hash(fuzzer_class, grammar):
+    canonical = json.dumps([F1_GENERATOR_VERSION, fuzzer_class.__name__,
+                            [[k, grammar[k]] for k in grammar]])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+# The source is written to a temporary file first, and then moved in place,
+# so that concurrent jobs never see a partially written file. The bytecode
+# is written the same way by `py_compile`. If either the source or the
+# bytecode is owned by another user (which can happen when a shared
+# `cache_dir` is given), we do not import it, but generate both again. On
+# platforms without user ids, there is nothing to check.
+
+def owned_by_user(path):
+    return not hasattr(os, 'getuid') or os.stat(path).st_uid == os.getuid()
+
+def is_cached(path):
+    pyc = importlib.util.cache_from_source(path)
+    return (os.path.exists(path) and owned_by_user(path) and
+            (not os.path.exists(pyc) or owned_by_user(pyc)))
+
+def cached_fuzzer(fuzzer_class, grammar, name, cache_dir=F1_CACHE_DIR):
+    path = os.path.join(cache_dir, '%s_%s.py' % (fuzzer_class.__name__.lower(),
+                                                 fuzzer_hash(fuzzer_class, grammar)))
+    if not is_cached(path):
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as src:
+            src.write(fuzzer_class(grammar).fuzz_src())
+        os.replace(tmp, path)
+        py_compile.compile(path, doraise=True)
+    spec = importlib.util.spec_from_file_location(name + '_f1_fuzzer', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Using it.
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for fuzzer_class in [F1Fuzzer, F1CPSFuzzer, F1LFuzzer]:
+            expr_fuzzer = cached_fuzzer(fuzzer_class, EXPR_GRAMMAR, 'expr',
+                                        cache_dir)
+            random.seed(0)
+            v = expr_fuzzer.start(10)
+            random.seed(0)
+            assert fuzzer_class(EXPR_GRAMMAR).fuzzer('expr').start(10) == v
+            print(repr(v))
+        print(sorted(os.listdir(cache_dir)))
+        print(sorted(os.listdir(os.path.join(cache_dir, '__pycache__'))))
+
+# The workers of the `ParallelFuzzer` can also use the cache, so that each
+# worker does not compile the fuzzer again.
+
+def f1_sampler(grammar, max_depth=10, fuzzer_class=F1Fuzzer, cache_dir=None):
+    if cache_dir is None:
+        f = fuzzer_class(grammar).fuzzer('sampler')
+    else:
+        f = cached_fuzzer(fuzzer_class, grammar, 'sampler', cache_dir)
+    return lambda: f.start(max_depth)
+
+# ### Benchmark
+#
+# We compare the time taken to load the fuzzer for a larger grammar without
+# the cache, the first time with the cache (cold), and later (warm). We leave
+# out `F1CPSFuzzer` here, as its `compute_cost_cps()` takes time exponential in
+# the size of the grammar.
+
+def large_grammar(n, seed=0):
+    rnd = random.Random(seed)
+    g = {'<start>': [['<n0>']]}
+    for i in range(n):
+        refs = ['<n%d>' % rnd.randrange(n) for j in range(3)]
+        g['<n%d>' % i] = [[refs[0], 'a', refs[1]], [refs[2], 'b'],
+                          [chr(ord('a') + rnd.randrange(26))]]
+    return g
+
+if __name__ == '__main__':
+    lg = large_grammar(2000)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for fuzzer_class in [F1Fuzzer, F1LFuzzer]:
+            t0 = time.perf_counter()
+            fuzzer_class(lg).fuzzer('large')
+            t1 = time.perf_counter()
+            cached_fuzzer(fuzzer_class, lg, 'large', cache_dir)
+            t2 = time.perf_counter()
+            f = cached_fuzzer(fuzzer_class, lg, 'large', cache_dir)
+            t3 = time.perf_counter()
+            f.start(10)
+            print('%s: no cache %.3fs, cold %.3fs, warm %.3fs' % (
+                fuzzer_class.__name__, t1 - t0, t2 - t1, t3 - t2))
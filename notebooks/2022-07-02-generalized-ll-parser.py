@@ -473,6 +473,7 @@ if __name__ == '__main__':
 class GSSNode:
     def __init__(self, label): self.label, self.children = label, []
     def __eq__(self, other): return self.label == other.label
+    def __hash__(self): return hash(self.label)
     def __repr__(self): return str((self.label, self.children))
 
 # ### The GSS container
@@ -810,6 +811,8 @@ class SPPFNode:
 
     def __eq__(self, o): return self.label == o.label
 
+    def __hash__(self): return hash(self.label)
+
     def add_child(self, child): self.children.append(child)
 
     def to_s(self, g): return self.label[0]
@@ -1980,6 +1983,256 @@ while True:
     assert s == string
 print('done')
 
+# ## Counting Parse Trees
+#
+# The `EnhancedExtractor` reconstructs each tree from the root, and takes time
+# quadratic in the number of trees extracted. The
+# [Earley parser post](/post/2021/02/06/earley-parsing/) describes a
+# `ForestEnumerator` that counts the number of trees for each node of the
+# forest, which lets us construct the $$k$$th tree directly, and pick a tree
+# uniformly at random. We only need to describe the SPPF to it.
+#
+# Each symbol node and intermediate node chooses one of its packed nodes, and
+# each packed node has a single path made of its children. As in the
+# `EnhancedExtractor`, a packed node is checked for direct recursion using its
+# node id, and the children of packed, intermediate, and dummy nodes are
+# spliced into the enclosing symbol node.
+
+class SPPFLazyExtractor(ep.ForestEnumerator):
+    def __init__(self, forest):
+        self.my_forest = forest
+        super().__init__(forest.SPPF_nodes[forest.root])
+
+    def node_key(self, node): return node.nid
+
+    def node_name(self, node):
+        if isinstance(node, SPPF_symbol_node): return node.label[0]
+        return None
+
+    def node_ident(self, node):
+        if isinstance(node, SPPF_packed_node): return node.nid
+        return None
+
+    def expand(self, node):
+        if isinstance(node, SPPF_packed_node): return [node.children]
+        return [[n] for n in node.children]
+
+# Using it.
+
+if __name__ == '__main__':
+    p = compile_grammar(a_grammar)
+    f = p.recognize_on('1+2+3+4', grammar_start)
+    le = SPPFLazyExtractor(f)
+    print(le.count_trees())
+    ep.display_tree(le.random_tree())
+
+# We get the same trees in the same order as the `EnhancedExtractor`.
+
+if __name__ == '__main__':
+    for g, s, start in [(a_grammar, '1+2*3-4', grammar_start),
+                        (gamma_2, 'xxxx', '<S>'), (gamma_3, 'xxxxx', '<S>')]:
+        p = compile_grammar(g)
+        expected = ep.extract_all(EnhancedExtractor(p.recognize_on(s, start)))
+        le = SPPFLazyExtractor(p.recognize_on(s, start))
+        assert le.count_trees() == len(expected)
+        assert list(le.extract_trees()) == expected
+
+# Unlike the `EnhancedExtractor`, it also handles the dummy nodes produced by
+# empty rules.
+
+if __name__ == '__main__':
+    le = SPPFLazyExtractor(compile_grammar(RR_GRAMMAR5).recognize_on(
+        'abababab', '<start>'))
+    for t in le.extract_trees():
+        assert fuzzer.tree_to_string(t) == 'abababab'
+
+# The trees of a long expression can now be sampled directly.
+
+if __name__ == '__main__':
+    text = '+'.join(str(i % 10) for i in range(40))
+    le = SPPFLazyExtractor(compile_grammar(a_grammar).recognize_on(
+        text, grammar_start))
+    print(le.count_trees())
+    assert fuzzer.tree_to_string(le.random_tree()) == text
+
+# 
+# ## A Faster Runtime
+#
+# The book keeping functions above were written for clarity rather than
+# speed. The `next_thread()` copies the entire list of threads each time a
+# thread is taken out, the `add_thread()` searches through a list of
+# descriptors to see if a descriptor was already added, and `register_return()`
+# searches through the edges of a GSS node to see if an edge exists. The
+# `getNodeP()` similarly searches through the children of an SPPF node. For
+# highly ambiguous grammars, these lists can become very large, and the parser
+# becomes much slower than it needs to be.
+#
+# Here, we fix these. The threads are kept in a `deque`, the descriptors for
+# each index are kept in a set, and each GSS node keeps the set of its edges,
+# as well as the set of indexes (or SPPF nodes) it was popped with. (For this,
+# we made both the GSS nodes and the SPPF nodes hashable by their labels,
+# which is also how they are compared.) Since the threads are processed in the
+# same order as before, the parser produces exactly the same result as before.
+
+import collections
+
+class IndexedGSSNode(GSSNode):
+    def __init__(self, label):
+        super().__init__(label)
+        self.edges = set()
+
+class IndexedGSS(GSS):
+    def __init__(self):
+        super().__init__()
+        self.popped = {}
+
+    def get(self, my_label):
+        if my_label not in self.graph:
+            self.graph[my_label] = IndexedGSSNode(my_label)
+            self.P[my_label], self.popped[my_label] = [], set()
+        return self.graph[my_label]
+
+    def add_edge(self, v, edge):
+        if edge in v.edges: return False
+        v.edges.add(edge)
+        v.children.append(edge)
+        return True
+
+    def add_parsed_index(self, label, j):
+        if j not in self.popped[label]:
+            self.popped[label].add(j)
+            self.P[label].append(j)
+
+# The runtime core is shared between the recognizer and the parser.
+
+class GLLRuntime:
+    def initialize(self, input_str):
+        super().initialize(input_str)
+        self.gss = IndexedGSS()
+        self.stack_bottom = self.gss.get(('L0', 0))
+        self.threads = collections.deque()
+        self.U = [set() for j in range(len(self.U))]
+
+    def next_thread(self):
+        return self.threads.popleft()
+
+    def add_descriptor(self, cur_idx, descriptor, thread):
+        if descriptor not in self.U[cur_idx]:
+            self.U[cur_idx].add(descriptor)
+            self.threads.append(thread)
+
+# The recognizer.
+
+class FastGLLStructuredStack(GLLRuntime, GLLStructuredStack):
+    def add_thread(self, L, stack_top, cur_idx):
+        self.add_descriptor(cur_idx, (L, stack_top), (L, stack_top, cur_idx))
+
+    def register_return(self, L, stack_top, cur_idx):
+        v = self.gss.get((L, cur_idx))
+        if self.gss.add_edge(v, stack_top):
+            for h_idx in self.gss.parsed_indexes(v.label):
+                self.add_thread(L, stack_top, h_idx)
+        return v
+
+# Using it.
+
+if __name__ == '__main__':
+    p = GLLG1Recognizer()
+    p.parser = FastGLLStructuredStack()
+    assert p.recognize_on('aaa', '<S>')
+    assert not p.recognize_on('aaab', '<S>')
+
+# The parser. In `getNodeP()`, the packed nodes are already indexed in
+# `SPPF_nodes` by their label and extents. So we simply look them up.
+
+class FastGLLStructuredStackP(GLLRuntime, GLLStructuredStackP):
+    def add_thread(self, L, stack_top, cur_idx, sppf_w):
+        self.add_descriptor(cur_idx, (L, stack_top, sppf_w),
+                            (L, stack_top, cur_idx, sppf_w))
+
+    def register_return(self, L, stack_top, cur_idx, sppf_w):
+        v = self.gss.get((L, cur_idx))
+        if self.gss.add_edge(v, (stack_top, sppf_w)):
+            for sppf_z in self.gss.parsed_indexes(v.label):
+                sppf_y = self.getNodeP(L, sppf_w, sppf_z)
+                h_idx = sppf_z.label[-1]
+                self.add_thread(L, stack_top, h_idx, sppf_y)
+        return v
+
+    def getNodeP(self, X_rule_pos, sppf_w, sppf_z):
+        X, nalt, dot = X_rule_pos
+        rule = self.grammar[X][nalt]
+        alpha, beta = rule[:dot], rule[dot:]
+
+        if self.is_non_nullable_alpha(alpha) and beta: return sppf_z
+
+        t = X if beta == [] else X_rule_pos
+
+        _q, k, i = sppf_z.label
+        if self.not_dummy(sppf_w):
+            _s,j,_k = sppf_w.label
+            children = [sppf_w,sppf_z]
+        else:
+            j = k
+            children = [sppf_z]
+
+        y = self.sppf_find_or_create(t, j, i)
+        key =  (('P', X_rule_pos, k), j, i)
+        if key not in self.SPPF_nodes:
+            pn = SPPF_packed_node(X_rule_pos, k)
+            self.SPPF_nodes[key] = pn
+            for c_ in children: pn.add_child(c_)
+            y.add_child(pn)
+        return y
+
+# The compiled parser can use either of the runtimes. We use the faster one
+# by default from here on.
+
+_compile_grammar = compile_grammar
+
+def compile_grammar(g, evaluate=True, stack=FastGLLStructuredStackP):
+    s = _compile_grammar(g, evaluate)
+    if evaluate: s.parser = stack()
+    return s
+
+# We verify that the forests produced are exactly the same.
+
+def forest_signature(forest):
+    return sorted((str(k), [str(c.label) for c in n.children])
+                  for k, n in forest.SPPF_nodes.items())
+
+if __name__ == '__main__':
+    for g, s, start in [(a_grammar, '1+2*3-4', grammar_start),
+                        (gamma_2, 'xxxx', '<S>'), (gamma_3, 'xxxxx', '<S>'),
+                        (RR_GRAMMAR5, 'abababab', '<start>')]:
+        f1 = compile_grammar(g, stack=GLLStructuredStackP).recognize_on(s, start)
+        f2 = compile_grammar(g).recognize_on(s, start)
+        assert forest_signature(f1) == forest_signature(f2)
+        assert list(SPPFLazyExtractor(f1).extract_trees()) == \
+               list(SPPFLazyExtractor(f2).extract_trees())
+
+# ### Benchmark
+#
+# We compare both runtimes on highly ambiguous grammars, with inputs of
+# increasing length. The original runtime is only run on shorter inputs.
+
+if __name__ == '__main__':
+    import time
+    gamma_1 = {'<S>': [['<S>', '<S>'], ['x']]}
+    for g in [gamma_1, gamma_3]:
+        p_fast = compile_grammar(g)
+        p_slow = compile_grammar(g, stack=GLLStructuredStackP)
+        for n in [10, 20, 30, 60]:
+            t0 = time.perf_counter()
+            assert p_fast.recognize_on('x' * n, '<S>')
+            t1 = time.perf_counter()
+            if n <= 30:
+                assert p_slow.recognize_on('x' * n, '<S>')
+                print('%d: fast %.3fs, original %.3fs' % (n, t1 - t0,
+                                                          time.perf_counter() - t1))
+            else:
+                print('%d: fast %.3fs' % (n, t1 - t0))
+
 # 
 # **Note**: There is now (2024) a reference implementation for GLL from the authors. It is available at [https://github.com/AJohnstone2007/referenceImplementation](https://github.com/AJohnstone2007/referenceImplementation).
 # 
@@ -811,5 +811,305 @@ if __name__ == '__main__':
 def display_tree(t):
     return ep.display_tree(t)
 
+# ## Bit-Parallel CYK
+#
+# The `parse_n()` above enumerates every pair of nonterminals `(b, c)` from the
+# two cells of each split, and looks them up in `nonterminal_rules`. Further,
+# each cell is a dictionary. This means that a lot of time is spent allocating
+# and discarding pairs. A better representation is to number the nonterminals,
+# and represent each cell as a *bitset* of nonterminals, which we can store in
+# a Python `int`. The terminal rules and the chains of guaranteed parses can
+# then be precomputed as masks, and applying them to a cell is simply a
+# bitwise or.
+#
+# The splits can also be represented as bitsets. For each start `s`, we keep
+# for each nonterminal `<B>` the set of ends `p` such that `<B>` parses
+# `text[s..p]` (the row). Similarly, for each end `e`, we keep for each
+# nonterminal `<C>` the set of starts `p` such that `<C>` parses `text[p..e]`
+# (the column). A rule `<A> ::= <B> <C>` then parses `text[s..e]` if the row of
+# `<B>` at `s` and the column of `<C>` at `e` share any `p`, which is a single
+# bitwise and over all the splits at once.
+#
+# For this to work, we need the rows and columns to be complete before we use
+# them. Hence, we go over the starts from right to left, and for each start,
+# go over the ends from left to right. The row of `<B>` at `s` only requires
+# the cells that start at `s` and end before `e`, and the column of `<C>` at `e`
+# only requires the cells that start after `s`, both of which are already
+# computed. Further, at each start, we only need to consider the rules whose
+# `<B>` has been seen so far in that row.
+
+def bits(v):
+    while v:
+        low = v & -v
+        yield low.bit_length() - 1
+        v ^= low
+
+class BitCYKRecognizer(CYKRecognizer):
+    def __init__(self, grammar):
+        super().__init__(grammar)
+        self.nonterminals = list(grammar)
+        self.nt_id = {k:i for i,k in enumerate(self.nonterminals)}
+        self.terminal_masks = {}
+        for k, rule in self.productions:
+            if len(rule) == 1 and fuzzer.is_terminal(rule[0]):
+                self.terminal_masks[rule[0]] = (
+                        self.terminal_masks.get(rule[0], 0) | 1 << self.nt_id[k])
+        pair_masks = {}
+        for k, rule in self.productions:
+            if len(rule) == 2:
+                pair = (self.nt_id[rule[0]], self.nt_id[rule[1]])
+                pair_masks[pair] = pair_masks.get(pair, 0) | 1 << self.nt_id[k]
+        self.right_of = [[] for k in self.nonterminals]
+        for (b, c), heads in pair_masks.items():
+            self.right_of[b].append((c, heads))
+        self.chain_masks = [1 << self.nt_id[k] |
+                            sum(1 << self.nt_id[v] for v in set(self.chains[k]))
+                            for k in self.nonterminals]
+
+    def closure(self, cell):
+        res = cell
+        for a in bits(cell): res |= self.chain_masks[a]
+        return res
+
+# The table now holds an integer for each cell.
+
+class BitCYKRecognizer(BitCYKRecognizer):
+    def bit_table(self, text):
+        length, n_nt = len(text), len(self.nonterminals)
+        table = [[0] * (length + 1) for i in range(length + 1)]
+        cols = [[0] * n_nt for i in range(length + 1)]
+        for s in range(length - 1, -1, -1):
+            row, active, seen = [0] * n_nt, [], 0
+            for e in range(s + 1, length + 1):
+                if e == s + 1:
+                    cell = self.terminal_masks.get(text[s], 0)
+                else:
+                    col, cell = cols[e], 0
+                    for b, c, heads in active:
+                        if row[b] & col[c]: cell |= heads
+                if not cell: continue
+                cell = self.closure(cell)
+                table[s][e] = cell
+                for a in bits(cell):
+                    row[a] |= 1 << e
+                    cols[e][a] |= 1 << s
+                for b in bits(cell & ~seen):
+                    active.extend((b, c, heads) for c, heads in self.right_of[b])
+                seen |= cell
+        return table
+
+    def recognize_on(self, text, start_symbol):
+        table = self.bit_table(text)
+        return bool(table[0][-1] >> self.nt_id[start_symbol] & 1)
+
+# We can convert the bitset table to the table used before, so that we can
+# print it.
+
+class BitCYKRecognizer(BitCYKRecognizer):
+    def to_table(self, text, table):
+        res = self.init_table(text, len(text))
+        for s, row in enumerate(table):
+            for e, cell in enumerate(row):
+                if e <= s: continue
+                res[s][e] = {self.nonterminals[a]:True for a in bits(cell)}
+        return res
+
+# Using it
+
+if __name__ == '__main__':
+    p = BitCYKRecognizer(g2)
+    txt = 'ababa'
+    p.print_table(p.to_table(txt, p.bit_table(txt)))
+
+# We verify that we get the same table as before. (Note that the
+# `terminal_rules` and `nonterminal_rules` of `CYKRecognizer` keep only the
+# last nonterminal for each right hand side, which is why we compute the masks
+# from the productions directly, and compare the tables only for grammars
+# where each right hand side has a single nonterminal.)
+
+if __name__ == '__main__':
+    cnf_grammar = cfg_to_cnf(expr_grammar)
+    for g, start in [(g1, g1_start), (g2, '<S>')]:
+        fz, bp = fuzzer.LimitFuzzer(g), BitCYKRecognizer(g)
+        for i in range(20):
+            assert bp.recognize_on(fz.fuzz(start), start)
+    for g, start in [(nullable_grammar, '<start>'), (cnf_grammar, '<start>')]:
+        p, bp = CYKRecognizer(g), BitCYKRecognizer(g)
+        fz = fuzzer.LimitFuzzer(g)
+        for i in range(20):
+            txt = fz.fuzz(start)
+            if not txt: continue
+            tbl = p.init_table(txt, len(txt))
+            p.parse_1(txt, len(txt), tbl)
+            for n in range(2, len(txt) + 1):
+                p.parse_n(txt, n, len(txt), tbl)
+            btbl = bp.to_table(txt, bp.bit_table(txt))
+            for s in range(len(txt)):
+                for e in range(s + 1, len(txt) + 1):
+                    assert set(tbl[s][e]) == set(btbl[s][e])
+            assert bp.recognize_on(txt, start)
+        assert not bp.recognize_on('c' * 3, '<start>')
+
+# ### Recovering trees
+#
+# The `BitCYKParser` recovers the trees directly from the bitset table. Given
+# a nonterminal that parses `text[s..e]`, we look for the rules of that
+# nonterminal and the splits such that both parts of the rule are in the
+# corresponding cells, and pick one at random, as the `CYKParser` does.
+#
+# However, a nonterminal may also be in a cell only because of a chain. That
+# is, there is a rule `<A> ::= <B> <C>` where `<C>` is nullable, and `<B>`
+# parses `text[s..e]` (or the other way around). Such a rule is a *unit* step
+# from `<B>` to `<A>` in the same cell, and the nullable `<C>` gets an empty
+# tree. We first compute an empty tree for each nullable nonterminal, using
+# only the nonterminals whose empty trees are already known, so that these
+# trees are finite.
+
+class BitCYKParser(BitCYKRecognizer):
+    def __init__(self, grammar):
+        super().__init__(grammar)
+        self.rules_of = [[] for k in self.nonterminals]
+        for b, rights in enumerate(self.right_of):
+            for c, heads in rights:
+                for a in bits(heads): self.rules_of[a].append((b, c))
+        self.null_trees = self.empty_trees()
+        self.units_of = [[] for k in self.nonterminals]
+        for k, rule in self.productions:
+            if len(rule) != 2: continue
+            b, c = rule
+            if c in self.null_trees:
+                self.units_of[self.nt_id[k]].append((self.nt_id[b], 0, c))
+            if b in self.null_trees:
+                self.units_of[self.nt_id[k]].append((self.nt_id[c], 1, b))
+
+    def empty_trees(self):
+        trees = {}
+        modified = True
+        while modified:
+            modified = False
+            for k, rule in self.productions:
+                if k in trees: continue
+                if all(t in trees for t in rule):
+                    trees[k] = (k, [trees[t] for t in rule])
+                    modified = True
+        return trees
+
+# The `choices()` are the ways in which `<A>` parses `text[s..e]` directly,
+# that is, either by a terminal rule, or by a rule and a split. Each choice
+# is a list of children, where a child is either a tree, or a nonterminal
+# and the span it has to parse.
+
+class BitCYKParser(BitCYKParser):
+    def choices(self, text, table, a, s, e):
+        res = []
+        if e == s + 1 and self.terminal_masks.get(text[s], 0) >> a & 1:
+            res.append([(text[s], [])])
+        for b, c in self.rules_of[a]:
+            for p in range(s + 1, e):
+                if table[s][p] >> b & 1 and table[p][e] >> c & 1:
+                    res.append([(b, s, p), (c, p, e)])
+        return res
+
+# If `<A>` has no direct choices, we search the unit steps from `<A>` in
+# breadth first order, until we find a nonterminal in the same cell that
+# parses the span directly, and take the first unit step on the way there.
+# Since the chains may be cyclic, the breadth first search makes sure that the
+# next nonterminal is strictly closer to a direct parse, and hence, that we
+# do not loop.
+
+class BitCYKParser(BitCYKParser):
+    def unit_step(self, b, pos, n, s, e):
+        return [(b, s, e), self.null_trees[n]] if pos == 0 else \
+               [self.null_trees[n], (b, s, e)]
+
+    def derive(self, text, table, a, s, e):
+        res = self.choices(text, table, a, s, e)
+        if res: return random.choice(res)
+        cell, first, queue = table[s][e], {a: None}, [a]
+        for x in queue:
+            if x != a and self.choices(text, table, x, s, e):
+                return self.unit_step(*first[x], s, e)
+            for b, pos, n in self.units_of[x]:
+                if b in first or not cell >> b & 1: continue
+                first[b] = first[x] or (b, pos, n)
+                queue.append(b)
+        assert False
+
+# Trees for long inputs can be deep. Hence, we build them with an explicit
+# stack rather than by recursion.
+
+class BitCYKParser(BitCYKParser):
+    def tree(self, text, table, a, s, e):
+        root = [None]
+        stack = [(a, s, e, root, 0)]
+        while stack:
+            a, s, e, out, i = stack.pop()
+            children = self.derive(text, table, a, s, e)
+            out[i] = (self.nonterminals[a], list(children))
+            for j, child in enumerate(children):
+                if isinstance(child[0], int):
+                    stack.append((*child, out[i][1], j))
+        return root[0]
+
+    def parse_on(self, text, start_symbol):
+        table = self.bit_table(text)
+        a = self.nt_id[start_symbol]
+        if not table[0][-1] >> a & 1: return []
+        return [self.tree(text, table, a, 0, len(text))]
+
+# Using it
+
+if __name__ == '__main__':
+    mystring = 'bcac'
+    p = BitCYKParser(g1)
+    for t in p.parse_on(mystring, g1_start):
+        display_tree(t)
+        assert fuzzer.tree_to_string(t) == mystring
+
+# The parser agrees with the recognizer, including on grammars with chains and
+# nullable nonterminals such as the CNF expression grammar.
+
+if __name__ == '__main__':
+    cnf_grammar = cfg_to_cnf(expr_grammar)
+    for g, start in [(nullable_grammar, '<start>'), (cnf_grammar, '<start>')]:
+        fz, br, bp = fuzzer.LimitFuzzer(g), BitCYKRecognizer(g), BitCYKParser(g)
+        texts = [fz.fuzz(start) for i in range(20)]
+        if g is cnf_grammar: texts += ['1', '1+2', '(1+2)*3-1', '1+', '(1']
+        for txt in texts:
+            if not txt: continue
+            trees = bp.parse_on(txt, start)
+            assert bool(trees) == br.recognize_on(txt, start)
+            for t in trees: assert fuzzer.tree_to_string(t) == txt
+
+# ### Benchmark
+#
+# We compare the two recognizers on expressions of increasing length. The
+# original recognizer is only run on the shorter ones. We also time the
+# `BitCYKParser`, which includes recognizing the input.
+
+def long_expr(n):
+    k = (n - 1) // 8
+    return '(1+2)*3-' * k + '1' * (n - 8 * k)
+
+if __name__ == '__main__':
+    import time
+    cnf_grammar = cfg_to_cnf(expr_grammar)
+    for n in [100, 200, 500, 1000, 2000]:
+        text = long_expr(n)
+        t0 = time.perf_counter()
+        assert BitCYKRecognizer(cnf_grammar).recognize_on(text, '<start>')
+        t1 = time.perf_counter()
+        if n <= 200:
+            assert CYKRecognizer(cnf_grammar).recognize_on(text, '<start>')
+            print('%d: bitset %.2fs, original %.2fs' % (n, t1 - t0,
+                                                       time.perf_counter() - t1))
+        else:
+            print('%d: bitset %.2fs' % (n, t1 - t0))
+        t0 = time.perf_counter()
+        trees = BitCYKParser(cnf_grammar).parse_on(text, '<start>')
+        t1 = time.perf_counter()
+        assert fuzzer.tree_to_string(trees[0]) == text
+        print('%d: bitset parser %.2fs' % (n, t1 - t0))
+
 # [^grune2008parsing]: Dick Grune and Ceriel J.H. Jacobs "Parsing Techniques A Practical Guide" 2008
 
@@ -128,6 +128,9 @@
 #  
 # As before, we start with the prerequisite imports.
 
+#^
+# numpy
+
 #@
 # https://rahul.gopinath.org/py/simplefuzzer-0.0.1-py2.py3-none-any.whl
 # https://rahul.gopinath.org/py/earleyparser-0.0.1-py2.py3-none-any.whl
@@ -148,6 +151,10 @@ import cykparser as cykp
 
 import random
 
+# We use NumPy for the vectorized matrix multiplication.
+
+import numpy as np
+
 # As before, we use the [fuzzingbook](https://www.fuzzingbook.org) grammar style.
 # A terminal symbol has exactly one character
 # (Note that we disallow empty string (`''`) as a terminal symbol).
@@ -529,7 +536,7 @@ if __name__ == '__main__':
 class ValiantRecognizer(ValiantRecognizer):
     def recognize_on(self, text, start_symbol):
         n = len(text)
-        tbl = self.init_table(txt, n)
+        tbl = self.init_table(text, n)
         my_A = self.parse_1(text, n, tbl)
         my_P = self.nonterminal_productions
         v = self.transitive_closure(my_A, my_P, n)
@@ -678,6 +685,171 @@ if __name__ == '__main__':
     for t in v:
         print(display_tree(t))
 
+# ## A Vectorized Engine
+#
+# The matrix multiplication above is a triple nested loop in Python, and
+# `multiply_pairs()` calls it for every pair of nonterminals. Further, each
+# step of `parsed_in_steps()` is again a sum of products. So, the recognizer is
+# limited to rather short inputs. For the boolean matrix formulation to matter,
+# we need the matrix multiplication to be fast. So here, we use NumPy.
+#
+# The $$h$$ boolean matrices $$M_k$$ are stacked into a single array of shape
+# $$(h, m, m)$$, where $$h$$ is the number of nonterminals.
+
+def np_bool_matrices(A, nonterminals):
+    m, ids = len(A), {nt:i for i, nt in enumerate(nonterminals)}
+    M = np.zeros((len(nonterminals), m, m), dtype=bool)
+    for i in range(m):
+        for j in range(m):
+            for nt in A[i][j]:
+                M[ids[nt], i, j] = True
+    return M
+
+def np_table(M, nonterminals):
+    h, m, _ = M.shape
+    table = [[{} for _ in range(m)] for _ in range(m)]
+    for k, i, j in zip(*np.nonzero(M)):
+        table[i][j][nonterminals[k]] = True
+    return table
+
+# We only need the products $$r(l,m)$$ for the pairs $$(l, m)$$ that occur on
+# the right hand side of some rule. We collect the left and right
+# nonterminals of these pairs as index arrays, and we also build a *rule
+# tensor* which contains $$1$$ at $$(q, p)$$ if the pair $$q$$ is the right
+# hand side of a rule for the nonterminal $$p$$.
+
+def np_rule_tensor(P, nonterminals):
+    ids = {nt:i for i, nt in enumerate(nonterminals)}
+    pairs = sorted({(ids[l], ids[m]) for _, (l, m) in P})
+    pair_ids = {pair:q for q, pair in enumerate(pairs)}
+    R = np.zeros((len(pairs), len(nonterminals)), dtype=np.float32)
+    for p, (l, m) in P:
+        R[pair_ids[(ids[l], ids[m])], ids[p]] = 1
+    return (np.array([l for l, m in pairs], dtype=int),
+            np.array([m for l, m in pairs], dtype=int), R)
+
+# The products of all pairs are now computed in a single batched matrix
+# multiplication. Since NumPy hands over floating point matrix multiplication
+# to BLAS, we multiply the matrices as `float32`, and any nonzero cell is `True`.
+# The `get_final_matrix()` becomes a reduction of the products over the rule
+# tensor.
+
+def np_multiply_pairs(M_a, M_b, ls, ms):
+    return np.matmul(M_a[ls].astype(np.float32),
+                     M_b[ms].astype(np.float32)) > 0
+
+def np_get_final_matrix(r, R):
+    return np.tensordot(R, r.astype(np.float32), axes=(0, 0)) > 0
+
+def np_multiply_matrices_b(M_a, M_b, rules):
+    ls, ms, R = rules
+    return np_get_final_matrix(np_multiply_pairs(M_a, M_b, ls, ms), R)
+
+# Let us try testing the matrix multiplication. We should get the same result
+# as `multiply_matrices_b()`.
+
+if __name__ == '__main__':
+    p = ValiantRecognizer(g1)
+    txt = 'aabb'
+    nts = list(p.grammar.keys())
+    my_A = p.parse_1(txt, len(txt), p.init_table(txt, len(txt)))
+    my_M = np_bool_matrices(my_A, nts)
+    rules = np_rule_tensor(p.nonterminal_productions, nts)
+    my_A_2 = np_table(np_multiply_matrices_b(my_M, my_M, rules), nts)
+    p.print_table(my_A_2)
+    assert my_A_2 == multiply_matrices_b(my_A, my_A,
+                                         p.nonterminal_productions, nts)
+
+# For the transitive closure, we no longer need to compute each
+# $$a^{(i)}$$ separately. The closure $$a^{+}$$ is the smallest matrix that
+# contains $$a$$ and is closed under multiplication, that is
+#  
+# $$ a^{+} = a U (a^{+} * a^{+}) $$
+#  
+# Hence, we start with $$a$$, and multiply the matrix with itself until
+# nothing new is added. Each product considers all splits at once, and after
+# $$k$$ rounds, we have all the parses whose trees are at most $$k + 1$$ high.
+#
+# Note that this is simply the naive closure, vectorized. It is *not* the
+# divide and conquer closure of Valiant, which is what gives the subcubic
+# bound. In particular, the number of rounds grows with the height of the
+# parse trees, which is linear in the length of the input for nested inputs
+# such as balanced parenthesis. Since each round is a full matrix product,
+# such inputs take time that grows faster than cubic in the length.
+
+def np_transitive_closure(M, rules):
+    T = M
+    while True:
+        T_ = M | np_multiply_matrices_b(T, T, rules)
+        if np.array_equal(T_, T): return T
+        T = T_
+
+# The engine is selected when the recognizer is constructed. The NumPy engine
+# converts the table to boolean matrices, computes the closure, and converts
+# it back. Hence, the result is exactly the same table as before, and the
+# `ValiantParser` can extract trees from it as before.
+
+class ValiantRecognizer(ValiantRecognizer):
+    def __init__(self, grammar, engine='python'):
+        super().__init__(grammar)
+        self.engine = engine
+
+    def transitive_closure(self, A, P, l):
+        if self.engine != 'numpy':
+            return super().transitive_closure(A, P, l)
+        nonterminals = list(self.grammar.keys())
+        T = np_transitive_closure(np_bool_matrices(A, nonterminals),
+                                  np_rule_tensor(P, nonterminals))
+        return np_table(T, nonterminals)
+
+class ValiantParser(ValiantParser, ValiantRecognizer): pass
+
+# Using it
+
+if __name__ == '__main__':
+    mystring = '(()(()))'
+    p = ValiantParser(g2, engine='numpy')
+    for t in p.parse_on(mystring, g2_start):
+        assert fuzzer.tree_to_string(t) == mystring
+        display_tree(t)
+
+# We verify that both engines produce the same table.
+
+def valiant_table(p, text):
+    tbl = p.parse_1(text, len(text), p.init_table(text, len(text)))
+    return p.transitive_closure(tbl, p.nonterminal_productions, len(text))
+
+if __name__ == '__main__':
+    for g, start in [(g1, g1_start), (g2, g2_start)]:
+        fz = fuzzer.LimitFuzzer(g)
+        for i in range(10):
+            txt = fz.fuzz(start)
+            if len(txt) > 12: continue
+            assert valiant_table(ValiantRecognizer(g), txt) == \
+                   valiant_table(ValiantRecognizer(g, engine='numpy'), txt)
+            assert ValiantRecognizer(g, engine='numpy').recognize_on(txt, start)
+        assert not ValiantRecognizer(g, engine='numpy').recognize_on('ba', start)
+
+# ### Benchmark
+#
+# We compare the two engines on balanced parenthesis of increasing length.
+# The Python engine is only run on the shorter ones. As these inputs are
+# nested, the NumPy engine needs a round for each level of nesting.
+
+if __name__ == '__main__':
+    import time
+    for n in [4, 8, 16, 64, 128]:
+        text = '(' * n + ')' * n
+        t0 = time.perf_counter()
+        assert ValiantRecognizer(g2, engine='numpy').recognize_on(text, g2_start)
+        t1 = time.perf_counter()
+        if n <= 8:
+            assert ValiantRecognizer(g2).recognize_on(text, g2_start)
+            print('%d: numpy %.3fs, python %.3fs' % (len(text), t1 - t0,
+                                                     time.perf_counter() - t1))
+        else:
+            print('%d: numpy %.3fs' % (len(text), t1 - t0))
+
 
 # [^valiant1975]: Leslie G. Valiant "General context-free recognition in less than cubic time" 1975
 # [^ebert2006]: Franziska Ebert "CFG Parsing and Boolean Matrix Multiplication" 2006
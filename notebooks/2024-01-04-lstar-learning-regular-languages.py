@@ -666,6 +666,13 @@ class Teacher(Teacher):
         st_ = self.sampler.key_get_string_at(key_node, at)
         return fuzzer.tree_to_string(st_)
 
+    def gen_randoms(self, key_node, cnt, n):
+        # draws n samples, expanding them in a single batch.
+        if cnt == 0: return {None}
+        ats = sorted({random.randint(0, cnt-1) for _ in range(n)})
+        return set(self.sampler.key_get_strings_at(key_node, ats,
+                                                   as_string=True))
+
 # ## Check Grammar Equivalence
 # Checking if two grammars are equivalent to a length of string for n count.
 
@@ -675,8 +682,8 @@ class Teacher(Teacher):
         cnt2, key_node2, ep2 = self.digest_grammar(g2, s2, l, n)
         count = 0
 
-        str1 = {self.gen_random(key_node1, cnt1) for _ in range(n)}
-        str2 = {self.gen_random(key_node2, cnt2) for _ in range(n)}
+        str1 = self.gen_randoms(key_node1, cnt1, n)
+        str2 = self.gen_randoms(key_node2, cnt2, n)
 
         for st1 in str1:
             if st1 is None: continue
@@ -824,6 +831,210 @@ if __name__ == '__main__':
         print('F1:', 2 * precision*recall/(precision + recall))
 
 
+# ## An Incremental Observation Table
+#
+# The `ObservationTable` above is simple, but wasteful. The `update_table()`
+# goes over every row and every suffix each time a prefix or a suffix is
+# added, and `closed()` and `consistent()` build the state of each row as a
+# string again each time they are called. Further, each membership query is
+# answered by running the parser from scratch, even when the same string was
+# asked before (which happens often, as `p + s` can be the same string for
+# different prefixes and suffixes).
+#
+# So, we keep the row of each prefix as a bit vector, where the bit `j` is
+# the result for the suffix `S[j]`. Adding a prefix only fills the new rows,
+# and adding a suffix only fills the new column. The membership queries
+# needed for an update are collected first, and sent to the teacher
+# together. If the teacher can answer a batch of queries with
+# `is_members()`, we use that. Otherwise, we ask `is_member()` for each.
+
+def member_queries(oracle, qs):
+    if hasattr(oracle, 'is_members'): return oracle.is_members(qs)
+    return [oracle.is_member(q) for q in qs]
+
+class IncrementalObservationTable(ObservationTable):
+    def __init__(self, alphabet):
+        super().__init__(alphabet)
+        self.rows = {}
+
+    def fill(self, cells, oracle):
+        results = member_queries(oracle, [p + s for p, s in cells])
+        index = {s: j for j, s in enumerate(self.S)}
+        for (p, s), r in zip(cells, results):
+            self._T.setdefault(p, {})[s] = r
+            if r: self.rows[p] |= 1 << index[s]
+
+    def new_rows(self, ps):
+        ps = [p for p in dict.fromkeys(ps) if p not in self.rows]
+        for p in ps: self.rows[p] = 0
+        return ps
+
+    def init_table(self, oracle):
+        ps = self.new_rows(self.P + [p + a for p in self.P for a in self.A])
+        self.fill([(p, s) for p in ps for s in self.S], oracle)
+
+    def update_table(self, oracle):
+        self.init_table(oracle)
+
+# We keep the row state names the same as before, so that we get exactly the
+# same grammar. The bit vectors are used for comparisons.
+
+class IncrementalObservationTable(IncrementalObservationTable):
+    def state(self, p):
+        return '<%s>' % format(self.rows[p], 'b').zfill(len(self.S))[::-1]
+
+    def add_prefix(self, p, oracle):
+        if p in self.P: return
+        self.P.append(p)
+        ps = self.new_rows([p] + [p + a for a in self.A])
+        self.fill([(q, s) for q in ps for s in self.S], oracle)
+
+    def add_suffix(self, a_s, oracle):
+        if a_s in self.S: return
+        self.S.append(a_s)
+        self.fill([(p, a_s) for p in self.rows], oracle)
+
+# The `closed()` check simply compares the bit vectors. For `consistent()`,
+# we group the prefixes by their rows, so that we only look at the pairs of
+# prefixes with the same row. For each pair, the bits that differ in the rows
+# of `p1 + a` and `p2 + a` give the suffixes that distinguish them, and the
+# lowest such bit is the first suffix in `S`. The pairs are examined in the
+# same order as before, so we find the same counter example.
+
+class IncrementalObservationTable(IncrementalObservationTable):
+    def closed(self):
+        states_in_P = {self.rows[p] for p in self.P}
+        for p in self.P:
+            for a in self.A:
+                if self.rows[p + a] not in states_in_P: return False, p + a
+        return True, None
+
+    def consistent(self):
+        groups = {}
+        for p in self.P: groups.setdefault(self.rows[p], []).append(p)
+        for p1 in self.P:
+            for p2 in groups[self.rows[p1]]:
+                if p1 == p2: continue
+                for a in self.A:
+                    diff = self.rows[p1 + a] ^ self.rows[p2 + a]
+                    if diff:
+                        s = self.S[(diff & -diff).bit_length() - 1]
+                        return False, (p1, p2), (a + s)
+        return True, None, None
+
+# ### Batched membership queries
+#
+# The teacher remembers the answer to each membership query, and answers a
+# batch of queries together. Many of the queries in a batch share a prefix
+# (say `p + s` for the same `p` and different `s`). So, rather than parsing
+# each query from scratch, we use the
+# [online recognizer](/post/2021/02/06/earley-parsing/), and feed it the
+# queries in sorted order. For each query, we only have to drop the columns
+# after the prefix it shares with the previous query, and feed the rest.
+# Once the recognizer reports that the prefix is not viable, no query with
+# that prefix can be in the language. The parser based `is_member()` from
+# before is kept as `check_member()` to check the answers against.
+
+import os
+
+class Teacher(Teacher):
+    def __init__(self, rex, delta=0.1, epsilon=0.1, processes=0):
+        super().__init__(rex, delta, epsilon)
+        self.recognizer = earleyparser.OnlineEarleyRecognizer(self.g, self.s,
+                                                   gc_interval=math.inf)
+        self.member_cache, self.processes, self._pool = {}, processes, None
+        self.member_executions = 0
+
+    def check_member(self, q):
+        return super().is_member(q)
+
+    def check_members(self, qs):
+        rec, answers = self.recognizer, {}
+        cur, (viable, complete) = '', rec.reset()
+        for q in sorted(qs):
+            k = len(os.path.commonprefix([cur, q]))
+            if k < len(cur):
+                for i in range(k + 1, rec.current + 1): del rec.columns[i]
+                rec.current, cur = k, cur[:k]
+                viable, complete = rec.status()
+            while viable and len(cur) < len(q):
+                viable, complete = rec.feed(q[len(cur)])
+                cur = q[:len(cur) + 1]
+            answers[q] = 1 if viable and complete and cur == q else 0
+        return [answers[q] for q in qs]
+
+# With `processes` set, the queries that are not in the cache are sorted, and
+# split into contiguous chunks, one for each process. As with other pools,
+# the teacher is passed to the workers only once, when they start.
+
+import multiprocessing
+
+_member_worker = {}
+
+def init_member_worker(teacher):
+    _member_worker['teacher'] = teacher
+
+def check_members_worker(qs):
+    return _member_worker['teacher'].check_members(qs)
+
+class Teacher(Teacher):
+    def is_members(self, qs):
+        todo = sorted({q for q in qs if q not in self.member_cache})
+        if self.processes and len(todo) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes,
+                        init_member_worker, (self,))
+            size = -(-len(todo) // self.processes)
+            chunks = [todo[i:i + size] for i in range(0, len(todo), size)]
+            results = [r for rs in self._pool.map(check_members_worker, chunks)
+                       for r in rs]
+        else:
+            results = self.check_members(todo)
+        self.member_executions += len(todo)
+        self.member_cache.update(zip(todo, results))
+        return [self.member_cache[q] for q in qs]
+
+    def is_member(self, q):
+        return self.is_members([q])[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+# The answers are the same as from the parser.
+
+if __name__ == '__main__':
+    teacher = Teacher('ab(cd|ef)*')
+    qs = [''.join(random.choices('abcdef', k=random.randint(0, 8)))
+          for i in range(2000)] + ['ab', 'abcd', 'abcdef', 'abefcd']
+    ans = teacher.is_members(qs)
+    assert ans == [teacher.check_member(q) for q in qs]
+    pteacher = Teacher('ab(cd|ef)*', processes=2)
+    assert ans == pteacher.is_members(qs)
+    pteacher.close()
+    print(sum(ans), 'of', len(qs))
+
+# Using it. We get the same grammar as before.
+
+if __name__ == '__main__':
+    import time
+    for e in ['a*b*', '(ab|cd|ef)*', 'ab(cd|ef)*gh(ij|kl)*']:
+        random.seed(0)
+        teacher = Teacher(e)
+        t0 = time.perf_counter()
+        g1, s1 = l_star(ObservationTable(list(string.ascii_letters)), teacher)
+        t1 = time.perf_counter()
+        random.seed(0)
+        teacher = Teacher(e)
+        g2, s2 = l_star(IncrementalObservationTable(list(string.ascii_letters)),
+                        teacher)
+        t2 = time.perf_counter()
+        assert (g1, s1) == (g2, s2)
+        print('%s: table %.3fs incremental %.3fs (%d queries executed)' % (
+            e, t1 - t0, t2 - t1, teacher.member_executions))
+
 #  
 # # Notes
 # 
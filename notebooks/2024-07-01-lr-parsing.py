@@ -460,6 +460,9 @@ class State:
     def def_key(self):
         return self.name
 
+    def key(self):
+        return (self.name, self.expr, self.dot)
+
 # It can be tested this way
 if __name__ == '__main__':
     s = State(g1a_start, ('<E>',), 0, 0)
@@ -842,18 +845,19 @@ if __name__ == '__main__':
 # <D> := * 1
 # ```
 # 
-# Here is how we can compute a closure
+# Here is how we can compute a closure. The items already added are
+# identified by their `key()`.
+
+import collections
 
 def compute_closure(grammar, items,
             create_start_item=lambda s, rule: State(s, tuple(rule), 0, 0)):
-    to_process = list(items)
-    seen = set()
+    to_process = collections.deque(items)
     new_items = {}
     while to_process:
-        item_, *to_process = to_process
-        if str(item_) in seen: continue
-        seen.add(str(item_))
-        new_items[str(item_)] = item_
+        item_ = to_process.popleft()
+        if item_.key() in new_items: continue
+        new_items[item_.key()] = item_
         key = item_.at_dot()
         if key is None: continue
         if not fuzzer.is_nonterminal(key): continue
@@ -1131,16 +1135,18 @@ class LR0DFA(LR0DFA):
 # #### DFA Start State (create_start)
 # The start item is similar to before. The main difference is that
 # rather than returning multiple states, we return a single state containing
-# multiple items.
+# multiple items. A state is identified by the (frozen) set of items it was
+# created from, which is also kept with the state as its `kernel`.
 
 class LR0DFA(LR0DFA):
     def create_state(self, items):
-        texpr = tuple(sorted([str(i) for i in items]))
-        if (texpr) not in self.my_states:
+        kernel = frozenset(i.key() for i in items)
+        if kernel not in self.my_states:
             state = self.new_state(self.compute_closure(items))
-            self.my_states[texpr] = state
+            state.kernel = kernel
+            self.my_states[kernel] = state
             self.states[state.sid] = state
-        return self.my_states[texpr]
+        return self.my_states[kernel]
 
     # the start in DFA is simply a closure of all rules from that key.
     def create_start(self, s):
@@ -1255,15 +1261,22 @@ class LR0DFA(LR0DFA):
 
 # #### LR0DFA build_dfa
 # Bringing all these together, let us build the DFA. (Compare to build_nfa).
+# The states that were already processed are identified by their `state_key()`
+# which is simply their kernel.
+
 class LR0DFA(LR0DFA):
+    def state_key(self, dfastate):
+        return dfastate.kernel
+
     def build_dfa(self):
         start_dfastate = self.create_start(self.start)
-        queue = [('$', start_dfastate)]
+        queue = collections.deque([('$', start_dfastate)])
         seen = set()
         while queue:
-            (pkey, dfastate), *queue = queue
-            if str(dfastate) in seen: continue
-            seen.add(str(dfastate))
+            pkey, dfastate = queue.popleft()
+            key = self.state_key(dfastate)
+            if key in seen: continue
+            seen.add(key)
 
             new_dfastates = self.find_transitions(dfastate)
             for key, s in new_dfastates:
@@ -1620,12 +1633,13 @@ class SLR1DFA(SLR1DFA):
 
     def build_dfa(self):
         start_dfastate = self.create_start(self.start)
-        queue = [('$', start_dfastate)]
+        queue = collections.deque([('$', start_dfastate)])
         seen = set()
         while queue:
-            (pkey, dfastate), *queue = queue
-            if str(dfastate) in seen: continue
-            seen.add(str(dfastate))
+            pkey, dfastate = queue.popleft()
+            key = self.state_key(dfastate)
+            if key in seen: continue
+            seen.add(key)
 
             new_dfastates = self.find_transitions(dfastate)
             for key, s in new_dfastates:
@@ -1767,6 +1781,9 @@ class LR1Item(Item):
     def __str__(self):
         return self.show_dot(self.name, self.expr, self.dot) + ':' + self.lookahead
 
+    def key(self):
+        return (self.name, self.expr, self.dot, self.lookahead)
+
 # ### LR1DFA class
 # 
 # We also need update on create_item etc to handle the lookahead.
@@ -1806,14 +1823,12 @@ class LR1DFA(SLR1DFA):
 # 
 class LR1DFA(LR1DFA):
     def compute_closure(self, items):
-        to_process = list(items)
-        seen = set()
+        to_process = collections.deque(items)
         new_items = {}
         while to_process:
-            item_, *to_process = to_process
-            if str(item_) in seen: continue
-            seen.add(str(item_))
-            new_items[str(item_)] = item_
+            item_ = to_process.popleft()
+            if item_.key() in new_items: continue
+            new_items[item_.key()] = item_
             key = item_.at_dot()
             if key is None: continue
             if not fuzzer.is_nonterminal(key): continue
@@ -1944,6 +1959,9 @@ class LALR1Item(Item):
     def __str__(self):
         return f"{self.show_dot(self.name, self.expr, self.dot)}:{','.join(sorted(self.lookaheads))}"
 
+    def key(self):
+        return (self.core(), frozenset(self.lookaheads))
+
 # ## LALR1 DFA
 class LALR1DFA(LR1DFA):
     def __init__(self, g, start):
@@ -1992,7 +2010,7 @@ class LALR1DFA(LALR1DFA):
     # called by advance() and create_start()
     def create_state(self, items_):
         items = self.compute_closure(items_)
-        key = str([str(item) for item in items])
+        key = frozenset(item.key() for item in items)
         if key not in self.my_states:
             state = self.new_state(items)
             self.states[state.sid] = state
@@ -2005,20 +2023,25 @@ class LALR1DFA(LALR1DFA):
             self.merge_items_by_core(core_items, items)
         return state
 
+    # the lookaheads of a state may be updated after it was processed, in
+    # which case it needs to be processed again.
+    def state_key(self, dfastate):
+        return frozenset(item.key() for item in dfastate.items)
+
 # ## LALR1 Closure
 # Note how we have to keep reprocessing the items until the lookahead symbols
 # are completely processed. This is because the `first_of_rule()` return can
 # change with new lookahead symbols on current item.
 class LALR1DFA(LALR1DFA):
     def compute_closure(self, items):
-        to_process = list(items)
+        to_process = collections.deque(items)
         seen = set()
         core_items = {}
         while to_process:
-            item_, *to_process = to_process
-            if str(item_) in seen: continue
-            seen.add(str(item_))
-            core_items[str(item_)] = item_
+            item_ = to_process.popleft()
+            if item_.key() in seen: continue
+            seen.add(item_.key())
+            core_items[item_.key()] = item_
             key = item_.at_dot()
             if key is None or not fuzzer.is_nonterminal(key): continue
 
@@ -2030,12 +2053,8 @@ class LALR1DFA(LALR1DFA):
 
             for rule in self.grammar[key]:
                 new_item = self.create_start_item(key, rule, lookaheads)
-                if str(new_item) not in core_items:
+                if new_item.key() not in core_items:
                     to_process.append(new_item)
-                else:
-                    modified = self.merge_items_by_core(core_items, [new_item])
-                    if modified:
-                        to_process.append(saved_item)
 
         return list(core_items.values())
 
@@ -2114,6 +2133,417 @@ if __name__ == '__main__':
         print(f"Message: {message}")
         print()
 
+# # A Compiled LR Runtime
+#
+# The parsers above are written for clarity. Each action is a string such as
+# `s3` or `r:2` that is parsed again every time it is used, the tokens are
+# consumed with `tokens.pop(0)` which is linear in the length of the input,
+# and every step is logged. For parsing large inputs, we can compile the
+# parse table once into dense integer tables, and run a tight loop over them.
+# Since all four automata (`LR0DFA`, `SLR1DFA`, `LR1DFA`, and `LALR1DFA`)
+# produce the same kind of parse table, the same runtime serves all of them.
+#
+# The tables are flat lists of integers (indexing a list is faster than
+# indexing an `array.array` in Python, as the latter has to box each value).
+# The `action` table has one entry per state and terminal, encoded as follows.
+#
+# * `0` is an error (no action).
+# * `n > 0` is a shift to state `n - 1`.
+# * `n < 0` is a reduction by the rule number `-n - 1`.
+# * `accept` (one more than the largest shift) accepts the input.
+# * `conflict` marks a cell with more than one action.
+#
+# The `goto` table has one entry per state and nonterminal, and is `-1` if
+# there is no transition. For each rule, we keep the index of its head
+# nonterminal in `rule_lhs` and the length of its expansion in `rule_len`.
+# As before, the input is accepted when we see `$` in a state that contains
+# the item `<> ::= <start> | $`. Since this depends only on the state, we
+# fold it into the `action` table.
+
+class CompiledLRRecognizer(LR0Recognizer):
+    def __init__(self, my_dfa, log=False):
+        super().__init__(my_dfa)
+        self.verbose = log
+        self.compile_table()
+
+    def compile_table(self):
+        terminals, non_terminals = self.dfa.terminals, self.dfa.non_terminals
+        self.t_id = {t:i for i,t in enumerate(terminals)}
+        self.nt_id = {k:i for i,k in enumerate(non_terminals)}
+        self.rule_names = list(self.production_rules.keys())
+        r_id = {r:i for i,r in enumerate(self.rule_names)}
+        self.rule_lhs = [self.nt_id[self.production_rules[r][0]]
+                         for r in self.rule_names]
+        self.rule_len = [len(self.production_rules[r][1]) for r in self.rule_names]
+
+        n_states = len(self.parse_table)
+        self.n_t, self.n_nt = len(terminals), len(non_terminals)
+        self.accept, self.conflict = n_states + 1, n_states + 2
+        self.action = [0] * (n_states * self.n_t)
+        self.goto = [-1] * (n_states * self.n_nt)
+        for state, row in enumerate(self.parse_table):
+            for t in terminals:
+                actions = row.get(t, [])
+                if not actions: continue
+                if len(actions) > 1: code = self.conflict
+                elif actions[0].startswith('r:'): code = -(r_id[actions[0]] + 1)
+                else: code = int(actions[0][1:]) + 1
+                self.action[state * self.n_t + self.t_id[t]] = code
+            for k in non_terminals:
+                if row.get(k): self.goto[state * self.n_nt + self.nt_id[k]] = int(row[k][0][1:])
+
+        eof = self.t_id['$']
+        for sid, state in self.dfa.states.items():
+            for i in state.items:
+                if i.name == self.dfa.start and i.at_dot() == '$':
+                    self.action[sid * self.n_t + eof] = self.accept
+
+    def tokenize(self, input_string):
+        t_id = self.t_id
+        tokens = [t_id.get(c, -1) for c in input_string]
+        tokens.append(t_id['$'])
+        return tokens
+
+# The recognizer loop keeps only the states on the stack, and moves a
+# position over the tokens rather than popping them. The log is printed only
+# if it was requested. Note that the start symbol is fixed by the automaton,
+# and the `start` argument is only checked.
+
+class CompiledLRRecognizer(CompiledLRRecognizer):
+    def parse(self, input_string, start):
+        assert start == self.dfa.start
+        action, goto, n_t, n_nt = self.action, self.goto, self.n_t, self.n_nt
+        rule_lhs, rule_len = self.rule_lhs, self.rule_len
+        accept, conflict = self.accept, self.conflict
+        tokens = self.tokenize(input_string)
+        stack, pos = [0], 0
+
+        while True:
+            state, symbol = stack[-1], tokens[pos]
+            a = action[state * n_t + symbol] if symbol >= 0 else 0
+            if a > 0:
+                if a == accept: return True, "Input Accepted"
+                assert a != conflict
+                stack.append(a - 1)
+                pos += 1
+            elif a < 0:
+                r = -a - 1
+                if rule_len[r]: del stack[-rule_len[r]:]
+                prev_state = stack[-1]
+                next_state = goto[prev_state * n_nt + rule_lhs[r]]
+                if next_state < 0:
+                    lhs = self.production_rules[self.rule_names[r]][0]
+                    return False, f"Parsing Error: No transition {prev_state}:{lhs}"
+                stack.append(next_state)
+            else:
+                sym = input_string[pos] if pos < len(input_string) else '$'
+                return False, f"Parsing Error: No actions state{state}:{sym}"
+
+            if self.verbose: self.log(stack, input_string[pos:])
+
+# The parser additionally maintains a stack of nodes, exactly as `LR0Parser`
+# does.
+
+class CompiledLRParser(CompiledLRRecognizer):
+    def parse(self, input_string, start):
+        assert start == self.dfa.start
+        action, goto, n_t, n_nt = self.action, self.goto, self.n_t, self.n_nt
+        rule_lhs, rule_len = self.rule_lhs, self.rule_len
+        accept, conflict = self.accept, self.conflict
+        lhs_names = [self.production_rules[r][0] for r in self.rule_names]
+        tokens = self.tokenize(input_string)
+        stack, pos = [0], 0
+        self.node_stack = node_stack = []
+
+        while True:
+            state, symbol = stack[-1], tokens[pos]
+            a = action[state * n_t + symbol] if symbol >= 0 else 0
+            if a > 0:
+                if a == accept: return True, "Input Accepted", node_stack[0]
+                assert a != conflict
+                stack.append(a - 1)
+                node_stack.append((input_string[pos], []))
+                pos += 1
+            elif a < 0:
+                r = -a - 1
+                n = rule_len[r]
+                if n:
+                    children = node_stack[-n:]
+                    del stack[-n:]
+                    del node_stack[-n:]
+                else:
+                    children = []
+                node_stack.append((lhs_names[r], children))
+                prev_state = stack[-1]
+                next_state = goto[prev_state * n_nt + rule_lhs[r]]
+                if next_state < 0:
+                    return False, f"Parsing Error: No transition {prev_state}:{lhs_names[r]}", None
+                stack.append(next_state)
+            else:
+                sym = input_string[pos] if pos < len(input_string) else '$'
+                return False, f"Parsing Error: No actions state{state}:{sym}", None
+
+            if self.verbose: self.log(stack, input_string[pos:])
+
+# Using it.
+
+if __name__ == '__main__':
+    g4a, g4a_start = add_start_state(g4, g4_start)
+    parser = CompiledLRParser(LALR1DFA(g4a, g4a_start))
+    print(parser.action)
+    print(parser.goto)
+    for test_string in ["1", "11*1", "1*0"]:
+        success, message, tree = parser.parse(test_string, g4a_start)
+        if tree is not None:
+            ep.display_tree(tree)
+        print(f"Result: {'Accepted' if success else 'Rejected'}")
+        print(f"Message: {message}")
+
+# We verify that the compiled parsers produce the same results as the
+# original parsers for each of the automata. We silence the log of the
+# original parsers.
+
+if __name__ == '__main__':
+    for g, s, DFA, P, strings in [
+            (g1, g1_start, LR0DFA, LR0Parser,
+                ["(1+1)", "(1+(1+1))", "1", "1+", "+1+1", "", "(1+1"]),
+            (g2, g2_start, SLR1DFA, SLR1Parser,
+                ["1+1", "1", "1+", "+1", "1+1+1", "11"]),
+            (g3, g3_start, LR1DFA, LR1Parser,
+                ["1+1", "+1", "1", "++1+1", "1+", "+"]),
+            (g4, g4_start, LALR1DFA, LALR1Parser,
+                ["1", "11*1", "1*0", "0", "*1", "1*"])]:
+        ga, ga_start = add_start_state(g, s)
+        original = P(DFA(ga, ga_start))
+        original.log = lambda stack, tokens: None
+        compiled = CompiledLRParser(DFA(ga, ga_start))
+        recognizer = CompiledLRRecognizer(DFA(ga, ga_start))
+        for test_string in strings:
+            expected = original.parse(test_string, ga_start)
+            assert compiled.parse(test_string, ga_start) == expected
+            assert recognizer.parse(test_string, ga_start)[0] == expected[0]
+
+# ### Benchmark
+#
+# For the benchmark, we use an expression grammar that is SLR(1) (and hence,
+# also LR(1)), and the `g1` grammar for LR(0) and LALR(1). We report the
+# number of tokens parsed per second, taking the best of a few runs.
+
+expr_g = {
+    '<E>': [['<T>', '+', '<E>'], ['<T>']],
+    '<T>': [['<F>', '*', '<T>'], ['<F>']],
+    '<F>': [['(', '<E>', ')'], ['1']]
+}
+expr_g_start = '<E>'
+
+if __name__ == '__main__':
+    import time
+    def tokens_per_second(parser, text, start, repeat=5):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = parser.parse(text, start)
+            t1 = time.perf_counter()
+            assert result[0]
+            best = t1 - t0 if best is None else min(best, t1 - t0)
+        return len(text) / best
+
+    g1_text = '(1+' * 1000 + '1' + ')' * 1000
+    expr_text = '+'.join('(1*1+1)*1' for i in range(1000))
+    for g, s, DFA, P, text in [
+            (g1, g1_start, LR0DFA, LR0Parser, g1_text),
+            (expr_g, expr_g_start, SLR1DFA, SLR1Parser, expr_text),
+            (expr_g, expr_g_start, LR1DFA, LR1Parser, expr_text),
+            (g1, g1_start, LALR1DFA, LALR1Parser, g1_text)]:
+        ga, ga_start = add_start_state(g, s)
+        original = P(DFA(ga, ga_start))
+        original.log = lambda stack, tokens: None
+        compiled = CompiledLRParser(DFA(ga, ga_start))
+        print('%s: %d tokens, original %d tokens/s, compiled %d tokens/s' % (
+            DFA.__name__, len(text),
+            tokens_per_second(original, text, ga_start),
+            tokens_per_second(compiled, text, ga_start)))
+
+# # Caching the Parse Tables
+#
+# Constructing the automaton, especially the LR(1) automaton, can take a long
+# time for larger grammars, and the parsers above construct it again every
+# time they are created. However, the parser only needs the parse table, the
+# production rules, and the items that tell it when to accept. So, we can
+# save these to disk once, and load them later without constructing the
+# automaton at all.
+#
+# The saved tables are identified by a hash of the grammar, the start symbol,
+# and the kind of automaton. Note that the order of definitions and rules
+# in the grammar determines the numbering of rules and states. Hence, the
+# hash is computed from the grammar as is, without sorting. We also include a
+# version number, which should be incremented whenever the construction of
+# the tables changes, so that stale tables are never used.
+
+import hashlib
+import json
+import os
+import tempfile
+
+LR_TABLE_VERSION = 1
+
+def grammar_hash(g, start, kind):
+    canonical = json.dumps([LR_TABLE_VERSION, kind, start,
+                            [[k, g[k]] for k in g]])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+# The saved artifact is a JSON object. We only keep the nonempty cells of the
+# parse table. For acceptance, we only need the items with `$` after the dot,
+# and since `$` occurs only in the augmented start rule, there are few of
+# these.
+
+def table_artifact(dfa, table):
+    return {
+        'version': LR_TABLE_VERSION,
+        'kind': type(dfa).__name__,
+        'start': dfa.start,
+        'terminals': dfa.terminals,
+        'non_terminals': dfa.non_terminals,
+        'production_rules': [[r, lhs, list(rhs)]
+                             for r, (lhs, rhs) in dfa.production_rules.items()],
+        'table': [{k:v for k,v in row.items() if v} for row in table],
+        'accept_items': [[sid, i.name, list(i.expr), i.dot]
+                         for sid, state in dfa.states.items()
+                         for i in state.items if i.at_dot() == '$']}
+
+# The `TableDFA` is built from such an artifact, and provides everything that
+# the parsers need from an automaton. Its `build_dfa()` simply returns the
+# loaded table.
+
+class TableDFA:
+    def __init__(self, artifact):
+        if artifact.get('version') != LR_TABLE_VERSION:
+            raise ValueError('Incompatible table version: %s' % artifact.get('version'))
+        self.kind, self.start = artifact['kind'], artifact['start']
+        self.terminals = artifact['terminals']
+        self.non_terminals = artifact['non_terminals']
+        self.production_rules = {r: (lhs, rhs)
+                                 for r, lhs, rhs in artifact['production_rules']}
+        columns = self.terminals + self.non_terminals + ['']
+        self.table = [{k: row.get(k, []) for k in columns}
+                      for row in artifact['table']]
+        self.states = {sid: DFAState([], sid) for sid in range(len(self.table))}
+        for i, (sid, name, expr, dot) in enumerate(artifact['accept_items']):
+            self.states[sid].items.append(Item(name, tuple(expr), dot, i))
+
+    def build_dfa(self):
+        return self.table
+
+# Saving and loading. We write to a temporary file first, and then move it in
+# place, so that a partially written file is never seen by a reader.
+
+def save_table(dfa, table, path):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(table_artifact(dfa, table), f)
+    os.replace(tmp, path)
+
+def load_table(path):
+    with open(path) as f:
+        return TableDFA(json.load(f))
+
+# By default, the tables are kept in a directory private to the user, under
+# `$XDG_CACHE_HOME` (or `~/.cache`), which is created readable only by its
+# owner. The file names are predictable, so a table that is owned by someone
+# else (say, one planted in a shared `cache_dir`) is not trusted. On platforms
+# without user ids, there is nothing to check.
+
+def user_cache_dir(name):
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, name)
+
+def owned_by_user(path):
+    return not hasattr(os, 'getuid') or os.stat(path).st_uid == os.getuid()
+
+LR_CACHE_DIR = user_cache_dir('lr-tables')
+
+# The `cached_dfa()` looks up the tables in the cache directory, and
+# constructs (and saves) them only if they are missing, cannot be read, or
+# are not ours.
+
+def cached_dfa(DFA, g, start, cache_dir=LR_CACHE_DIR):
+    path = os.path.join(cache_dir, grammar_hash(g, start, DFA.__name__) + '.json')
+    if os.path.exists(path) and owned_by_user(path):
+        try:
+            return load_table(path)
+        except (ValueError, KeyError):
+            pass
+    dfa = DFA(g, start)
+    table = dfa.build_dfa()
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    save_table(dfa, table, path)
+    return TableDFA(table_artifact(dfa, table))
+
+# Using it.
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as cache_dir:
+        g3a, g3a_start = add_start_state(g3, g3_start)
+        parser = LR1Parser(cached_dfa(LR1DFA, g3a, g3a_start, cache_dir))
+        print(os.listdir(cache_dir))
+        parser = LR1Parser(cached_dfa(LR1DFA, g3a, g3a_start, cache_dir))
+        success, message, tree = parser.parse('+1+1', g3a_start)
+        ep.display_tree(tree)
+
+# We verify that the parsers produce the same results with the loaded tables,
+# including the compiled parsers. A stale table (from an older version) is
+# simply rebuilt.
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for g, s, DFA, P, strings in [
+                (g1, g1_start, LR0DFA, LR0Parser, ["(1+1)", "(1+(1+1))", "1", "1+", ""]),
+                (g2, g2_start, SLR1DFA, SLR1Parser, ["1+1", "1", "1+", "+1", "1+1+1"]),
+                (g3, g3_start, LR1DFA, LR1Parser, ["1+1", "+1", "1", "++1+1", "1+"]),
+                (g4, g4_start, LALR1DFA, LALR1Parser, ["1", "11*1", "1*0", "*1"]),
+                (expr_g, expr_g_start, LR1DFA, LR1Parser, ["1+1*(1+1)", "1+", "(1"])]:
+            ga, ga_start = add_start_state(g, s)
+            original = P(DFA(ga, ga_start))
+            original.log = lambda stack, tokens: None
+            for i in range(2): # build, then load
+                loaded = P(cached_dfa(DFA, ga, ga_start, cache_dir))
+                loaded.log = lambda stack, tokens: None
+                compiled = CompiledLRParser(cached_dfa(DFA, ga, ga_start, cache_dir))
+                assert loaded.parse_table == original.parse_table
+                for test_string in strings:
+                    expected = original.parse(test_string, ga_start)
+                    assert loaded.parse(test_string, ga_start) == expected
+                    assert compiled.parse(test_string, ga_start) == expected
+
+        ga, ga_start = add_start_state(g1, g1_start)
+        path = os.path.join(cache_dir, grammar_hash(ga, ga_start, 'LR0DFA') + '.json')
+        with open(path, 'w') as f: json.dump({'version': 0}, f)
+        dfa = cached_dfa(LR0DFA, ga, ga_start, cache_dir)
+        assert load_table(path).table == dfa.table
+
+# How much time does it save? We use a larger expression grammar with
+# several levels of operators.
+
+def levels_grammar(levels):
+    ops = '+-*/%^&|<>'
+    g = {'<e0>': [['<e1>', ops[0], '<e0>'], ['<e1>']]}
+    for i in range(1, levels):
+        g['<e%d>' % i] = [['<e%d>' % (i + 1), ops[i], '<e%d>' % i],
+                          ['<e%d>' % (i + 1)]]
+    g['<e%d>' % levels] = [['(', '<e0>', ')'], ['1']]
+    return g
+
+if __name__ == '__main__':
+    lg, lg_start = add_start_state(levels_grammar(10), '<e0>')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        t0 = time.perf_counter()
+        dfa = cached_dfa(LR1DFA, lg, lg_start, cache_dir)
+        t1 = time.perf_counter()
+        dfa = cached_dfa(LR1DFA, lg, lg_start, cache_dir)
+        t2 = time.perf_counter()
+    print('%d states: build %.3fs, load %.3fs' % (len(dfa.table), t1 - t0, t2 - t1))
+
 # **Note:** The following resources helped me quite a bit in debugging. [SLR](https://jsmachines.sourceforge.net/machines/slr.html) and [LR](https://jsmachines.sourceforge.net/machines/lr1.html),
 # [grammar checker](http://smlweb.cpsc.ucalgary.ca), [new checker](https://mdaines.github.io/grammophone/).
 # 
@@ -843,6 +843,290 @@ if __name__ == '__main__':
     print('What is the grammar learned?')
     gatleast.display_grammar(learned_dfa.grammar, learned_dfa.start_symbol)
 
+# ## State Merging with Union-Find
+#
+# Each merge above builds a new grammar, converts it to a DFA, and parses
+# every example again. Hence, each attempted merge costs time proportional to
+# the size of the whole PTA and all the examples. The classic implementation
+# of RPNI avoids this. First, the negative examples are also added to the PTA
+# (the *augmented* PTA), with the state reached by a negative example marked
+# as *rejecting*. Then, merging two states is done by *folding*. That is, when
+# we merge two states, and both have a transition on the same symbol, then the
+# targets of these transitions also have to be merged, and so on. The merge is
+# inconsistent if some merged state is both accepting and rejecting. This
+# is exactly when the merged DFA accepts a negative example. So, we no longer
+# need to parse the examples at all.
+#
+# The merged states are kept in a union-find structure, where each block of
+# merged states has a representative state. For each representative, we keep
+# the label (accepting, rejecting, or unknown) of the block, and the
+# transitions out of the block. Every change to these is recorded in an undo
+# log. So, when a merge turns out to be inconsistent (or when we only want to
+# score it), we can roll it back. Both the merge and the roll back take time
+# proportional to the number of states touched by the merge.
+#
+# The states of the augmented PTA are numbered in the breadth first order, with
+# the symbols in sorted order, so that the state numbers follow the
+# shortlex order of their access strings.
+
+ACCEPT, REJECT, UNKNOWN = 1, -1, 0
+
+class UFPTA:
+    def __init__(self, positive_examples, negative_examples):
+        trie = {}
+        for examples, label in [(positive_examples, ACCEPT),
+                                (negative_examples, REJECT)]:
+            for example in examples:
+                node = trie
+                for char in example:
+                    node = node.setdefault(char, {})
+                node[None] = label
+        self.trans, self.label = [], []
+        queue, i = [trie], 0
+        while i < len(queue):
+            node = queue[i]
+            self.label.append(node.get(None, UNKNOWN))
+            children = {}
+            for char in sorted(k for k in node if k is not None):
+                children[char] = len(queue)
+                queue.append(node[char])
+            self.trans.append(children)
+            i += 1
+        n = len(self.trans)
+        self.parent, self.size = list(range(n)), [1] * n
+        self.log = []
+
+    def find(self, s):
+        while self.parent[s] != s: s = self.parent[s]
+        return s
+
+# Note that we do not use path compression, as it would need to be undone.
+# Instead, we always attach the smaller block to the larger, which keeps the
+# paths short.
+#
+# The `merge()` folds the two blocks together, recording each change in the
+# log. It returns the number of blocks merged, or `None` if the result is
+# inconsistent. The `rollback()` undoes the changes made since the given
+# position in the log, and `commit()` forgets the log.
+
+class UFPTA(UFPTA):
+    def merge(self, s1, s2):
+        todo, merged = [(s1, s2)], 0
+        while todo:
+            a, b = todo.pop()
+            a, b = self.find(a), self.find(b)
+            if a == b: continue
+            if self.size[a] < self.size[b]: a, b = b, a
+            la, lb = self.label[a], self.label[b]
+            if la and lb and la != lb: return None
+            self.log.append(('parent', b, a))
+            self.parent[b] = a
+            self.size[a] += self.size[b]
+            if not la and lb:
+                self.log.append(('label', a, la))
+                self.label[a] = lb
+            ta = self.trans[a]
+            for char, t in self.trans[b].items():
+                if char in ta:
+                    todo.append((ta[char], t))
+                else:
+                    self.log.append(('trans', a, char))
+                    ta[char] = t
+            merged += 1
+        return merged
+
+    def rollback(self, mark):
+        while len(self.log) > mark:
+            kind, x, y = self.log.pop()
+            if kind == 'parent':
+                self.parent[x] = x
+                self.size[y] -= self.size[x]
+            elif kind == 'label':
+                self.label[x] = y
+            else:
+                del self.trans[x][y]
+
+    def commit(self):
+        self.log.clear()
+
+    def try_merge(self, s1, s2, keep=True):
+        mark = len(self.log)
+        res = self.merge(s1, s2)
+        if res is None or not keep: self.rollback(mark)
+        return res
+
+# Next, the children of a block, and the blue fringe, given the list of red
+# blocks.
+
+class UFPTA(UFPTA):
+    def children(self, s):
+        return [self.find(t) for t in self.trans[self.find(s)].values()]
+
+    def blue_fringe(self, red):
+        reds, blue = set(red), {}
+        for r in red:
+            for c in self.children(r):
+                if c not in reds: blue[c] = True
+        return list(blue)
+
+# Finally, we convert the result back to our grammar format. The block
+# containing the root is `<start>`, and the others are named after their
+# representative states. Blocks that can not reach an accepting block (such
+# as those only reached by negative examples) are dropped, as they do not
+# change the language.
+
+class UFPTA(UFPTA):
+    def to_dfa(self):
+        root = self.find(0)
+        seen, order = {root}, [root]
+        for s in order:
+            for c in self.children(s):
+                if c not in seen:
+                    seen.add(c)
+                    order.append(c)
+        live = {s for s in order if self.label[s] == ACCEPT}
+        changed = True
+        while changed:
+            changed = False
+            for s in order:
+                if s not in live and any(c in live for c in self.children(s)):
+                    live.add(s)
+                    changed = True
+        name = {s: ('<start>' if s == root else '<%d>' % s) for s in order}
+        dfa = DFA()
+        dfa.grammar = {}
+        for s in order:
+            if s not in live and s != root: continue
+            rules = [[char, name[self.find(t)]]
+                     for char, t in sorted(self.trans[s].items())
+                     if self.find(t) in live]
+            if self.label[s] == ACCEPT: rules.append([])
+            dfa.grammar[name[s]] = rules
+        return dfa
+
+# With this, the three algorithms are as follows. The classic RPNI considers
+# the states in the shortlex order, and tries to merge each with the red states
+# in order.
+
+def rpni_uf(positive_examples, negative_examples):
+    pta = UFPTA(positive_examples, negative_examples)
+    red = [0]
+    for q in range(1, len(pta.trans)):
+        q = pta.find(q)
+        if q in red: continue
+        for r in red:
+            if pta.try_merge(r, q) is not None:
+                pta.commit()
+                break
+        else:
+            red.append(q)
+        red = [pta.find(r) for r in red]
+    return pta.to_dfa()
+
+# The Blue-Fringe picks the first blue state each time.
+
+def rpni_bluefringe_uf(positive_examples, negative_examples):
+    pta = UFPTA(positive_examples, negative_examples)
+    red = [0]
+    blue = pta.blue_fringe(red)
+    while blue:
+        b = blue[0]
+        for r in red:
+            if pta.try_merge(r, b) is not None:
+                pta.commit()
+                break
+        else:
+            red.append(b)
+        red = [pta.find(r) for r in red]
+        blue = pta.blue_fringe(red)
+    return pta.to_dfa()
+
+# For EDSM, the score of a merge is the number of states that were eliminated
+# by folding, beyond the merged pair itself, as before. Each candidate merge is
+# scored, and rolled back. Then, the best merge is done again, and kept.
+
+def rpni_edsm_uf(positive_examples, negative_examples):
+    pta = UFPTA(positive_examples, negative_examples)
+    red = [0]
+    blue = pta.blue_fringe(red)
+    while blue:
+        best = None
+        for b in blue:
+            for r in red:
+                res = pta.try_merge(r, b, keep=False)
+                if res is None: continue
+                if best is None or res - 1 > best[0]: best = (res - 1, r, b)
+        if best is None:
+            red = red + [b for b in blue if b not in red]
+        else:
+            pta.try_merge(best[1], best[2])
+            pta.commit()
+            red = list(dict.fromkeys(pta.find(r) for r in red))
+        blue = pta.blue_fringe(red)
+    return pta.to_dfa()
+
+# Let us try these on the same example as before. The learned DFAs are
+# consistent with the examples, and here, they are also the same as the
+# earlier ones (up to the names of the states). Note that this need not be
+# the case in general. The earlier versions renumber the states after each
+# merge, and hence may consider the candidate merges in a different order.
+
+import itertools
+
+def all_strings(alphabet, n):
+    for l in range(n + 1):
+        for t in itertools.product(alphabet, repeat=l):
+            yield ''.join(t)
+
+if __name__ == '__main__':
+    positive = ["b", "ab", "bb", "aab", "abb", "bab"]
+    negative = ["", "a", "aa", "ba", "aba", "bba"]
+    for old, new in [(rpni, rpni_uf), (rpni_bluefringe, rpni_bluefringe_uf),
+                     (rpni_edsm, rpni_edsm_uf)]:
+        d1, d2 = old(positive, negative), new(positive, negative)
+        assert all(d2.accepts(s) for s in positive)
+        assert not any(d2.accepts(s) for s in negative)
+        same = all(d1.accepts(s) == d2.accepts(s) for s in all_strings('ab', 8))
+        print(new.__name__, len(d1.grammar), len(d2.grammar), same)
+    gatleast.display_grammar(d2.grammar, d2.start_symbol)
+
+# ### Benchmark
+#
+# We learn the language of strings over `{a, b}` that end with `b`. Even with
+# a handful of short examples, the grammar based merge is much slower. Note
+# that its cost grows quickly with the length of the examples.
+
+import random
+import time
+
+def examples_ending_with_b(n, max_len=12, seed=0):
+    rnd = random.Random(seed)
+    strs = [''.join(rnd.choices('ab', k=rnd.randint(0, max_len)))
+            for i in range(n)]
+    return [s for s in strs if s.endswith('b')], [s for s in strs if not s.endswith('b')]
+
+if __name__ == '__main__':
+    for n, max_len in [(20, 4), (12, 5)]:
+        pos, neg = examples_ending_with_b(n, max_len)
+        t0 = time.perf_counter()
+        rpni_bluefringe(pos, neg)
+        t1 = time.perf_counter()
+        rpni_bluefringe_uf(pos, neg)
+        t2 = time.perf_counter()
+        print('%d examples: grammar %.3fs union-find %.3fs' % (n, t1 - t0, t2 - t1))
+
+# The union-find based merge can learn from much larger sets of examples.
+
+if __name__ == '__main__':
+    for n in [1000, 10000, 100000]:
+        pos, neg = examples_ending_with_b(n, max_len=20)
+        for algorithm in [rpni_uf, rpni_bluefringe_uf, rpni_edsm_uf]:
+            t0 = time.perf_counter()
+            d = algorithm(pos, neg)
+            t1 = time.perf_counter()
+            print('%d examples: %s %.3fs (%d states)' % (
+                n, algorithm.__name__, t1 - t0, len(d.grammar)))
+
 # ## Complexity and Limitations
 # 
 # Time Complexity: The RPNI algorithm is $$ O(p^3 n) $$ where p is the size (sum
@@ -104,7 +104,11 @@
 
 # ## Prerequisites
 #  
-# We only need the standard library for this post.
+# We only need the standard library for this post, except for the
+# columnar trace store at the end, which uses NumPy.
+
+#^
+# numpy
 
 import sys
 import inspect
@@ -1239,6 +1243,803 @@ if __name__ == '__main__':
     results = mine_invariants_scoped(triangle, triangle_inputs)
     print(format_results(results))
 
+# ## A Columnar Trace Store
+#  
+# `TraceStore` keeps one dict per observation. With a million observations
+# per program point, the dicts (and the boxed values in them) take far more
+# memory than the values themselves, and `InvariantEngine.check` calls one
+# Python lambda per candidate per observation. We can do better by storing
+# the observations by column rather than by row: each program point gets a
+# `PointColumns` table, with one `Column` per variable.
+#  
+# A column keeps two compact arrays. The first is a _tag_ per row that
+# records the type of the value. The tags `MISSING` and `NONE` together form
+# the null mask (`s.get(v)` returns `None` in both cases). The second holds
+# the value itself as a float. Numbers are stored as is, and strings are
+# interned, so that the value of a string is its id in the store's string
+# table. Integers that are too large to be exactly represented as a float,
+# as well as lists, tuples, and any other values, are tagged `OBJ`, and are
+# kept as is in a side dict keyed by the row.
+
+import array
+
+MISSING, NONE, BOOL, INT, FLOAT, STR, OBJ = range(7)
+MAX_EXACT_INT = 2**53
+
+class Column:
+    def __init__(self, rows=0):
+        self.tags = array.array('b', [MISSING]) * rows
+        self.vals = array.array('d', [0.0]) * rows
+        self.objs = {}
+
+    def append(self, tag, val, obj=None):
+        if tag == OBJ: self.objs[len(self.tags)] = obj
+        self.tags.append(tag)
+        self.vals.append(val)
+
+    def __len__(self):
+        return len(self.tags)
+
+# `PointColumns` holds the columns of one program point. When a variable is
+# seen for the first time, its column is padded with `MISSING` for the
+# earlier rows, and any variable not in the current state gets `MISSING`
+# for this row.
+
+class PointColumns:
+    def __init__(self):
+        self.columns = {}
+        self.rows = 0
+
+    def add(self, encoded):
+        for name, (tag, val, obj) in encoded.items():
+            if name not in self.columns:
+                self.columns[name] = Column(self.rows)
+            self.columns[name].append(tag, val, obj)
+        self.rows += 1
+        if len(encoded) < len(self.columns):
+            for col in self.columns.values():
+                if len(col) < self.rows: col.append(MISSING, 0.0)
+
+# `ColumnarTraceStore` has the same interface as `TraceStore`. The `get`
+# method rebuilds the state dicts, so that the rest of the pipeline works
+# unchanged with it.
+
+class ColumnarTraceStore:
+    def __init__(self):
+        self.tables = {}
+        self.strings = {}
+        self.string_list = []
+
+    def intern(self, s):
+        if s not in self.strings:
+            self.strings[s] = len(self.string_list)
+            self.string_list.append(s)
+        return self.strings[s]
+
+    def encode(self, v):
+        t = type(v)
+        if v is None: return (NONE, 0.0, None)
+        if t is bool: return (BOOL, float(v), None)
+        if t is int and -MAX_EXACT_INT <= v <= MAX_EXACT_INT:
+            return (INT, float(v), None)
+        if t is float: return (FLOAT, v, None)
+        if t is str: return (STR, float(self.intern(v)), None)
+        return (OBJ, 0.0, v)
+
+    def decode(self, col, i):
+        tag, val = col.tags[i], col.vals[i]
+        if tag == NONE: return None
+        if tag == BOOL: return bool(val)
+        if tag == INT: return int(val)
+        if tag == FLOAT: return val
+        if tag == STR: return self.string_list[int(val)]
+        return col.objs[i]
+
+    def add(self, point, state):
+        if point is None:
+            return
+        if point.name not in self.tables:
+            self.tables[point.name] = PointColumns()
+        self.tables[point.name].add({k: self.encode(v)
+                                     for k, v in state.items()})
+
+    def get(self, point):
+        if point.name not in self.tables: return []
+        table = self.tables[point.name]
+        return [{k: self.decode(col, i)
+                 for k, col in table.columns.items() if col.tags[i] != MISSING}
+                for i in range(table.rows)]
+
+    def points(self):
+        return list(self.tables.keys())
+
+# Verify that the columnar store gives back exactly what was added,
+# including `None`, missing variables, booleans, large integers, and lists.
+
+if __name__ == '__main__':
+    cstore = ColumnarTraceStore()
+    p = ProgramPoint('foo:::ENTER')
+    states = [{'x': 1, 'y': 'a'}, {'x': None, 'z': [1, 2]},
+              {'y': 'a', 'x': True}, {'x': 2**70, 'y': 2.5}]
+    for s in states: cstore.add(p, s)
+    assert cstore.get(p) == states
+    assert type(cstore.get(p)[2]['x']) is bool
+    assert cstore.get(ProgramPoint('bar:::ENTER')) == []
+    assert cstore.string_list == ['a']
+    print('ColumnarTraceStore ok')
+
+# ### Vectorized checking
+#  
+# We use NumPy to check each candidate against a whole column at once.
+
+import numpy as np
+
+# For each of the templates in `unary_invariants` and `binary_invariants`
+# we write a _kernel_ that evaluates the template over the tag and value
+# arrays, and returns a boolean array with one entry per row. The kernels
+# must agree with the Python predicates. For example, `x == y` holds if
+# both are null, or if both are numbers (including booleans) with the same
+# value, or if both are the same string.
+
+def is_num(t):
+    return (t >= BOOL) & (t <= FLOAT)
+
+def value_class(t):
+    return np.where(t <= NONE, 0, np.where(t == STR, 2, 1))
+
+UNARY_KERNELS = [
+    lambda t, v: t >= BOOL,
+    lambda t, v: is_num(t) & (v >= 0),
+    lambda t, v: is_num(t) & (v > 0),
+    lambda t, v: (t == BOOL) | (t == INT),
+    lambda t, v: t == STR,
+]
+
+BINARY_KERNELS = [
+    lambda t1, v1, t2, v2: (value_class(t1) == value_class(t2)) &
+                           ((t1 <= NONE) | (v1 == v2)),
+    lambda t1, v1, t2, v2: is_num(t1) & is_num(t2) & (v1 <= v2),
+    lambda t1, v1, t2, v2: is_num(t1) & is_num(t2) & (v1 >= v2),
+]
+
+# A `ColumnInvariant` is an `Invariant` that also carries its kernel and the
+# variables it is over. `test_columns` runs the kernel over the rows that
+# do not have an `OBJ` value, and falls back to the Python predicate for the
+# rows that do. As before, a candidate is dead as soon as any row fails.
+
+class ColumnInvariant(Invariant):
+    def __init__(self, inv, kernel, variables):
+        super().__init__(inv.name, inv.check)
+        self.kernel = kernel
+        self.variables = variables
+
+    def test_columns(self, store, table):
+        if not self.alive: return
+        cols = [table.columns[v] for v in self.variables]
+        args, obj = [], np.zeros(table.rows, dtype=bool)
+        for col in cols:
+            t = np.frombuffer(col.tags, dtype=np.int8)
+            args.extend([t, np.frombuffer(col.vals, dtype=np.float64)])
+            obj |= t == OBJ
+        with np.errstate(invalid='ignore'):
+            ok = self.kernel(*args)
+        if not (ok | obj).all():
+            self.alive = False
+            return
+        for i in np.flatnonzero(obj):
+            self.test({v: store.decode(col, i)
+                       for v, col in zip(self.variables, cols)
+                       if col.tags[i] != MISSING})
+            if not self.alive: return
+
+def columnar_unary_invariants(var):
+    return [ColumnInvariant(inv, k, [var])
+            for inv, k in zip(unary_invariants(var), UNARY_KERNELS)]
+
+def columnar_binary_invariants(x, y):
+    return [ColumnInvariant(inv, k, [x, y])
+            for inv, k in zip(binary_invariants(x, y), BINARY_KERNELS)]
+
+# The `ColumnarInvariantEngine` generates the candidates from the column
+# names, in the same order as `InvariantEngine`, and checks them against the
+# columns of each point.
+
+class ColumnarInvariantEngine(InvariantEngine):
+    def candidates_for_table(self, table):
+        all_vars = sorted(table.columns)
+        candidates = []
+        for v in all_vars:
+            candidates.extend(columnar_unary_invariants(v))
+        for x, y in itertools.combinations(all_vars, 2):
+            candidates.extend(columnar_binary_invariants(x, y))
+        return candidates
+
+    def check_columns(self, candidates, store, table):
+        for inv in candidates:
+            inv.test_columns(store, table)
+        return [inv for inv in candidates if inv.alive]
+
+    def analyze(self, store):
+        results = {}
+        for point_name in store.points():
+            table = store.tables[point_name]
+            if not table.rows:
+                continue
+            candidates = self.candidates_for_table(table)
+            results[point_name] = self.check_columns(candidates, store, table)
+        return results
+
+# The surviving invariants are the same as before. We check this on all our
+# examples, as well as on some states with mixed types.
+
+def survivor_names(results):
+    return {point: [inv.name for inv in invs]
+            for point, invs in results.items()}
+
+if __name__ == '__main__':
+    for fn, inputs in [(triangle, triangle_inputs), (sum_list, sum_inputs),
+                       (newton_sqrt, newton_inputs), (newton_step, step_inputs)]:
+        rstore = collect_traces(fn, inputs)
+        cstore = collect_traces(fn, inputs, store=ColumnarTraceStore())
+        assert survivor_names(InvariantEngine().analyze(rstore)) == \
+               survivor_names(ColumnarInvariantEngine().analyze(cstore))
+    rstore, cstore = TraceStore(), ColumnarTraceStore()
+    for s in states + [{'x': 0, 'y': 'None', 'z': (1, 2)},
+                       {'x': float('nan'), 'y': False, 'z': 1.0}]:
+        rstore.add(p, s)
+        cstore.add(p, s)
+    assert survivor_names(InvariantEngine().analyze(rstore)) == \
+           survivor_names(ColumnarInvariantEngine().analyze(cstore))
+    print('ColumnarInvariantEngine ok')
+
+# ### Benchmark
+#  
+# We add ten thousand observations with a few variables to a single
+# point in each store, and compare the memory used and the time taken to
+# check the candidates.
+
+import time
+import tracemalloc
+
+def synthetic_states(n):
+    for i in range(n):
+        yield {'i': i, 'j': i + 1, 'k': -i // 2, 'x': i / 3,
+               'tag': 'even' if i % 2 == 0 else 'odd'}
+
+def measure_store(store, n):
+    p = ProgramPoint('loop:::ENTER')
+    tracemalloc.start()
+    for state in synthetic_states(n):
+        store.add(p, state)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+if __name__ == '__main__':
+    n = 10000
+    for store, engine in [(TraceStore(), InvariantEngine()),
+                          (ColumnarTraceStore(), ColumnarInvariantEngine())]:
+        size = measure_store(store, n)
+        t0 = time.perf_counter()
+        results = engine.analyze(store)
+        t1 = time.perf_counter()
+        print('%s: %d KiB, check %.3fs, %d invariants' % (
+            type(store).__name__, size // 1024, t1 - t0,
+            len(results['loop:::ENTER'])))
+
+# ## A Low-Overhead Instrumentor
+#  
+# The instrumentors above are slow. `_tracer` is called for every `line`
+# event in every frame, only to ignore it, and for every `call` and `return`
+# it builds a `Context`, which calls `inspect.getframeinfo` (which reads the
+# source lines from disk) three times. This is done even for the functions
+# that we are not interested in, such as those starting with `_`.
+#  
+# Note that everything in `Context` other than the locals depends only on the
+# code object of the frame. So, we compute it once per code object, and cache
+# it in a `CodeInfo`. This includes the decision whether the function is a
+# target at all. The declared parameters are the first `co_argcount +
+# co_kwonlyargcount` names in `co_varnames`, which is what
+# `inspect.getargvalues` reports as the `args`.
+
+class CodeInfo:
+    def __init__(self, code, target):
+        self.method          = code.co_name
+        self.parameter_names = code.co_varnames[:code.co_argcount +
+                                                code.co_kwonlyargcount]
+        self.file_name       = code.co_filename
+        self.target          = target
+
+    def parameters(self, all_vars):
+        return {k: v for k, v in all_vars.items()
+                if k in self.parameter_names}
+
+# Python 3.12 introduced `sys.monitoring` (PEP 669), which lets us ask for
+# just the events we want. We use `PY_START` and `PY_RESUME` for entry, and
+# `PY_RETURN`, `PY_YIELD`, and `PY_UNWIND` for exit, which together match the
+# `call` and `return` events of `sys.settrace`. Further, a callback can return
+# `DISABLE` for a code location it is not interested in, after which the
+# interpreter no longer reports events from there. `PY_UNWIND` can not be
+# disabled this way, so there we rely on the cached `CodeInfo`.
+#  
+# On older Pythons, we fall back to `sys.settrace`, but still avoid most of
+# the overhead. The global tracer returns `None` for frames of functions
+# that are not targets, so that Python does not trace them any further, and
+# turns off the `line` events for the frames that are.
+#  
+# `MonitoringBackend` implements both as a mixin. The instrumentor using it
+# provides `on_call()` and `on_return()`, which get the cached `CodeInfo` and
+# the frame. The optional `targets` restricts the instrumentation to the
+# given function names.
+
+def has_monitoring():
+    return hasattr(sys, 'monitoring')
+
+class MonitoringBackend:
+    def init_backend(self, targets=None, backend=None):
+        self.targets = None if targets is None else set(targets)
+        self.backend = backend or ('monitoring' if has_monitoring()
+                                   else 'settrace')
+        self.codes   = {}
+
+    def is_target(self, code):
+        if code.co_name.startswith('_'): return False
+        return self.targets is None or code.co_name in self.targets
+
+    def code_info(self, code):
+        info = self.codes.get(code)
+        if info is None:
+            info = self.codes[code] = CodeInfo(code, self.is_target(code))
+        return info
+
+    def run(self, fn, *args, **kwargs):
+        if self.backend == 'monitoring':
+            return self.run_monitoring(fn, *args, **kwargs)
+        return self.run_settrace(fn, *args, **kwargs)
+
+# The `sys.settrace` based fallback.
+
+class MonitoringBackend(MonitoringBackend):
+    def _global_tracer(self, frame, event, arg):
+        if event != 'call': return None
+        info = self.code_info(frame.f_code)
+        if not info.target: return None
+        frame.f_trace_lines = False
+        self.on_call(info, frame)
+        return self._local_tracer
+
+    def _local_tracer(self, frame, event, arg):
+        if event == 'return':
+            self.on_return(self.code_info(frame.f_code), frame, arg)
+        return self._local_tracer
+
+    def run_settrace(self, fn, *args, **kwargs):
+        sys.settrace(self._global_tracer)
+        try:
+            fn(*args, **kwargs)
+        finally:
+            sys.settrace(None)
+
+# The `sys.monitoring` backend. The callbacks receive the code object rather
+# than the frame. The frame that is executing the code is the caller of the
+# callback. Since the tool id is shared with other tools such as profilers,
+# we claim it only for the duration of `run()`, and
+# `restart_events()` re-enables the locations disabled in an earlier run.
+
+class MonitoringBackend(MonitoringBackend):
+    def _py_start(self, code, offset):
+        info = self.code_info(code)
+        if not info.target: return sys.monitoring.DISABLE
+        self.on_call(info, sys._getframe(1))
+
+    def _py_return(self, code, offset, retval):
+        info = self.code_info(code)
+        if not info.target: return sys.monitoring.DISABLE
+        self.on_return(info, sys._getframe(1), retval)
+
+    def _py_unwind(self, code, offset, exc):
+        info = self.code_info(code)
+        if info.target: self.on_return(info, sys._getframe(1), None)
+
+    def run_monitoring(self, fn, *args, **kwargs):
+        mon = sys.monitoring
+        tool, E = mon.PROFILER_ID, mon.events
+        callbacks = {E.PY_START: self._py_start, E.PY_RESUME: self._py_start,
+                     E.PY_RETURN: self._py_return, E.PY_YIELD: self._py_return,
+                     E.PY_UNWIND: self._py_unwind}
+        mon.use_tool_id(tool, 'invariant-miner')
+        try:
+            for event, callback in callbacks.items():
+                mon.register_callback(tool, event, callback)
+            mon.restart_events()
+            mon.set_events(tool, sum(callbacks))
+            fn(*args, **kwargs)
+        finally:
+            mon.set_events(tool, 0)
+            for event in callbacks:
+                mon.register_callback(tool, event, None)
+            mon.free_tool_id(tool)
+
+# With the backend in place, the fast versions of the three instrumentors
+# only need to record the states as before, using the cached `CodeInfo`.
+
+class FastInstrumentor(MonitoringBackend, Instrumentor):
+    def __init__(self, store, interesting=default_interesting, targets=None,
+                 backend=None):
+        super().__init__(store, interesting)
+        self.init_backend(targets, backend)
+
+    def on_call(self, info, frame):
+        all_vars = {k: v for k, v in frame.f_locals.items()
+                    if self.interesting(k, v)}
+        point = ProgramPoint('%s:::ENTER' % info.method)
+        self.store.add(point, info.parameters(all_vars))
+
+    def on_return(self, info, frame, arg):
+        state = {k: v for k, v in frame.f_locals.items()
+                 if self.interesting(k, v)}
+        if self.interesting('return', arg):
+            state['return'] = arg
+        self.store.add(ProgramPoint('%s:::EXIT' % info.method), state)
+
+class FastScopedInstrumentor(MonitoringBackend, ScopedInstrumentor):
+    def __init__(self, store, interesting=default_interesting, targets=None,
+                 backend=None):
+        super().__init__(store, interesting)
+        self.init_backend(targets, backend)
+
+    def on_call(self, info, frame):
+        all_vars = {k: v for k, v in frame.f_locals.items()
+                    if self.interesting(k, v)}
+        mid = self.call_stack.enter(info.method)
+        self.store.add(make_scoped_point(mid, 'ENTER'),
+                       info.parameters(all_vars))
+
+    def on_return(self, info, frame, arg):
+        state = {k: v for k, v in frame.f_locals.items()
+                 if self.interesting(k, v)}
+        if self.interesting('return', arg):
+            state['return'] = arg
+        mid = self.call_stack.current()
+        self.store.add(make_scoped_point(mid, 'EXIT'), state)
+        self.call_stack.leave()
+
+class FastPairedInstrumentor(MonitoringBackend, PairedInstrumentor):
+    def __init__(self, paired_store, interesting=default_interesting,
+                 targets=None, backend=None):
+        super().__init__(paired_store, interesting)
+        self.init_backend(targets, backend)
+
+    def on_call(self, info, frame):
+        all_vars = {k: v for k, v in frame.f_locals.items()
+                    if self.interesting(k, v)}
+        _, call_id = self.call_stack.enter(info.method)
+        self.paired_store.add_enter(call_id, info.parameters(all_vars))
+
+    def on_return(self, info, frame, arg):
+        state = {k: v for k, v in frame.f_locals.items()
+                 if self.interesting(k, v)}
+        if self.interesting('return', arg):
+            state['return'] = arg
+        _, call_id = self.call_stack.current()
+        self.paired_store.add_exit(call_id, state)
+        self.call_stack.leave()
+
+# Verify that the fast instrumentors record exactly the same observations
+# as the originals with each available backend, including nested calls,
+# calls to functions we are not interested in, and a call that raises.
+
+def _double(x):
+    return 2 * x
+
+def sum_doubles(lst):
+    total = 0
+    for x in lst:
+        total += _double(x)
+    return total
+
+def checked_sqrt(n):
+    if n < 0:
+        raise ValueError(n)
+    return newton_sqrt(n)
+
+def run_all(instr, fn, inputs):
+    for args in inputs:
+        try:
+            instr.run(fn, *args)
+        except ValueError:
+            pass
+
+if __name__ == '__main__':
+    backends = ['settrace'] + (['monitoring'] if has_monitoring() else [])
+    cases = [(triangle, triangle_inputs), (sum_list, sum_inputs),
+             (sum_doubles, sum_inputs),
+             (checked_sqrt, [(4.0,), (-1.0,), (2.0,)])]
+    for backend in backends:
+        for fn, inputs in cases:
+            for slow, fast in [(Instrumentor, FastInstrumentor),
+                               (ScopedInstrumentor, FastScopedInstrumentor)]:
+                s1, s2 = TraceStore(), TraceStore()
+                run_all(slow(s1), fn, inputs)
+                run_all(fast(s2, backend=backend), fn, inputs)
+                assert s1.data == s2.data
+            p1, p2 = PairedTraceStore(), PairedTraceStore()
+            run_all(PairedInstrumentor(p1), fn, inputs)
+            run_all(FastPairedInstrumentor(p2, backend=backend), fn, inputs)
+            assert p1.pairs() == p2.pairs()
+        s = TraceStore()
+        run_all(FastInstrumentor(s, targets=['newton_sqrt'], backend=backend),
+                checked_sqrt, [(4.0,)])
+        assert s.points() == ['newton_sqrt:::ENTER', 'newton_sqrt:::EXIT']
+    print('FastInstrumentor ok', backends)
+
+# ### Benchmark
+#  
+# We measure the overhead per call, by calling small functions many times
+# without instrumentation, and with each instrumentor. In `sum_doubles`,
+# only the outer call is a target, while the calls to `_double` are filtered
+# out. In `many_triangles`, every call to `triangle` is a target.
+
+def many_triangles(lst):
+    for x in lst:
+        triangle(x, x, 1)
+
+def overhead_per_call(make, fn, n=20000):
+    lst = list(range(n))
+    t0 = time.perf_counter()
+    fn(lst)
+    t1 = time.perf_counter()
+    make().run(fn, lst)
+    t2 = time.perf_counter()
+    return (t2 - t1 - (t1 - t0)) / n * 1e6
+
+if __name__ == '__main__':
+    makers = [('Instrumentor', lambda: Instrumentor(TraceStore()))]
+    for backend in backends:
+        makers.append(('FastInstrumentor(%s)' % backend,
+                       lambda b=backend: FastInstrumentor(TraceStore(),
+                                                          backend=b)))
+    for fn in [sum_doubles, many_triangles]:
+        for name, make in makers:
+            print('%s %s: %.2f us per call' % (
+                fn.__name__, name, overhead_per_call(make, fn)))
+
+# ## Online Invariant Checking
+#  
+# `mine_invariants` keeps every observation until the end, and only then
+# checks the candidates. So, the memory needed grows with the number of test
+# runs. However, since falsification is monotone, we do not need to keep the
+# observations at all. We can instantiate the candidates for a program point
+# when it is first seen, and test each state as it arrives. A dead candidate
+# is dropped immediately, and once a point has no candidates left, there is
+# nothing more to check there. For diagnosis, we keep a bounded sample of
+# counterexamples, that is, the states that falsified some candidate.
+#  
+# `test_all` tests a state against the live candidates, records any
+# counterexamples, and returns the candidates that are still alive.
+
+def test_all(candidates, state, samples, max_samples):
+    alive = []
+    for inv in candidates:
+        inv.test(state)
+        if inv.alive:
+            alive.append(inv)
+        elif len(samples) < max_samples:
+            samples.append((inv.name, dict(state)))
+    return alive
+
+# There is one complication. The batch engine generates the candidates from
+# all the variables seen at a point, while a variable may first appear in a
+# later state. The new candidates then also have to hold for the earlier
+# states, where that variable was missing (and hence `None`). All our
+# templates other than `==` require their variables to be present, and
+# `x == y` with a missing `y` holds only if `x` was also `None`. So, it is
+# enough to remember, for each variable, one earlier value that is not
+# `None` (a _witness_), and to replay just the empty state and the witness
+# against the new candidates.
+#  
+# `OnlinePoint` holds this state for one program point.
+
+class OnlinePoint:
+    def __init__(self):
+        self.candidates = []
+        self.known      = set()
+        self.witness    = {}
+        self.count      = 0
+        self.samples    = []
+
+    def extend(self, new_vars, max_samples):
+        all_vars = sorted(self.known | set(new_vars))
+        self.known.update(new_vars)
+        fresh = [(unary_invariants(v), []) for v in new_vars]
+        fresh += [(binary_invariants(x, y), [x, y])
+                  for x, y in itertools.combinations(all_vars, 2)
+                  if x in new_vars or y in new_vars]
+        for invs, pair in fresh:
+            if self.count:
+                invs = test_all(invs, {}, self.samples, max_samples)
+                for v in pair:
+                    if v in self.witness:
+                        invs = test_all(invs, {v: self.witness[v]},
+                                        self.samples, max_samples)
+            self.candidates.extend(invs)
+
+    def observe(self, state, max_samples):
+        new_vars = [v for v in state if v not in self.known]
+        if new_vars: self.extend(new_vars, max_samples)
+        if self.candidates:
+            self.candidates = test_all(self.candidates, state, self.samples,
+                                       max_samples)
+        if len(self.witness) < len(self.known):
+            for v, val in state.items():
+                if val is not None and v not in self.witness:
+                    self.witness[v] = val
+        self.count += 1
+
+# The `OnlineInvariantEngine` has the same `add()` method as `TraceStore`.
+# Hence, it can be passed directly to any of the instrumentors. The
+# `results()` method returns the survivors in the same order as
+# `InvariantEngine.analyze()` would.
+
+class OnlineInvariantEngine(InvariantEngine):
+    def __init__(self, max_samples=10):
+        self.online      = {}
+        self.max_samples = max_samples
+
+    def add(self, point, state):
+        if point is None:
+            return
+        if point.name not in self.online:
+            self.online[point.name] = OnlinePoint()
+        self.online[point.name].observe(state, self.max_samples)
+
+    def points(self):
+        return list(self.online.keys())
+
+    def counterexamples(self, point_name):
+        return self.online[point_name].samples
+
+    def results(self):
+        results = {}
+        for point_name, op in self.online.items():
+            order = {inv.name: i for i, inv in
+                     enumerate(self.candidates_for([dict.fromkeys(op.known)]))}
+            results[point_name] = sorted(op.candidates,
+                                         key=lambda inv: order[inv.name])
+        return results
+
+def mine_invariants_online(fn, inputs, instrumentor=Instrumentor):
+    engine  = OnlineInvariantEngine()
+    instr   = instrumentor(engine)
+    for args in inputs:
+        instr.run(fn, *args)
+    lattice = SuppressionLattice()
+    return {point: lattice.suppress(invs)
+            for point, invs in engine.results().items()}
+
+# Verify that the online engine finds the same invariants as the batch
+# engine, including when variables appear only in later states.
+
+if __name__ == '__main__':
+    for fn, inputs in cases + [(newton_sqrt, newton_inputs),
+                               (newton_step, step_inputs)]:
+        for slow, fast in [(Instrumentor, FastInstrumentor),
+                           (ScopedInstrumentor, FastScopedInstrumentor)]:
+            store, engine = TraceStore(), OnlineInvariantEngine()
+            run_all(slow(store), fn, inputs)
+            run_all(fast(engine), fn, inputs)
+            assert survivor_names(InvariantEngine().analyze(store)) == \
+                   survivor_names(engine.results())
+    late_states = [{'x': 1}, {'x': None, 'y': 2}, {'x': 3, 'y': None},
+                   {'z': 1, 'w': 1}, {'x': 4, 'y': 5, 'v': None},
+                   {'u': 'a', 'x': 5, 'y': 6}, {'u': 'a', 't': None}]
+    for i in range(len(late_states)):
+        for subset in itertools.combinations(late_states, i + 1):
+            store, engine = TraceStore(), OnlineInvariantEngine()
+            for s in subset:
+                store.add(p, s)
+                engine.add(p, s)
+            assert survivor_names(InvariantEngine().analyze(store)) == \
+                   survivor_names(engine.results())
+    print(engine.counterexamples('foo:::ENTER')[:3])
+    print('OnlineInvariantEngine ok')
+
+# ### Online relational invariants
+#  
+# The same works for the relational invariants. `OnlineRelationalEngine`
+# provides the `add_enter()` and `add_exit()` methods of `PairedTraceStore`.
+# It holds on to an entry state only until the matching exit arrives (that
+# is, at most one for each active call), and then tests the combined state
+# immediately. As with `RelationalEngine`, the candidates are generated from
+# the variables of the first pair. Here, this is the first call to return,
+# which is also the first call made unless the calls are nested. The
+# `templates` argument lets us add further templates, such as the quadratic
+# ones.
+
+class OnlineRelationalEngine:
+    def __init__(self, templates=relational_invariants, max_samples=10):
+        self.templates   = templates
+        self.max_samples = max_samples
+        self.pending     = {}
+        self.candidates  = None
+        self.samples     = []
+
+    def add_enter(self, call_id, state):
+        if self.candidates == []: return
+        self.pending[call_id] = dict(state)
+
+    def add_exit(self, call_id, state):
+        if call_id not in self.pending: return
+        merged = {'%s_entry' % k: v for k, v in self.pending.pop(call_id).items()}
+        merged.update({'%s_exit' % k: v for k, v in state.items()})
+        if self.candidates is None:
+            entry_vars = sorted({k[:-6] for k in merged if k.endswith('_entry')})
+            exit_vars  = sorted({k      for k in merged if k.endswith('_exit')})
+            self.candidates = self.templates(entry_vars, exit_vars)
+        self.candidates = test_all(self.candidates, merged, self.samples,
+                                   self.max_samples)
+
+    def results(self):
+        return list(self.candidates or [])
+
+def mine_relational_invariants_online(fn, inputs,
+                                      templates=relational_invariants,
+                                      instrumentor=PairedInstrumentor):
+    engine = OnlineRelationalEngine(templates)
+    instr  = instrumentor(engine)
+    for args in inputs:
+        instr.run(fn, *args)
+    return SuppressionLattice().suppress(engine.results())
+
+# Verify that we get the same relational invariants as before, and that the
+# quadratic template works as well.
+
+def with_quadratic(entry_vars, exit_vars):
+    return (relational_invariants(entry_vars, exit_vars) +
+            quadratic_invariants('return_exit', 'n_entry'))
+
+if __name__ == '__main__':
+    for fn, inputs in [(triangle, triangle_inputs), (sum_list, sum_inputs),
+                       (newton_sqrt, newton_inputs)]:
+        assert [i.name for i in mine_relational_invariants(fn, inputs)] == \
+               [i.name for i in mine_relational_invariants_online(fn, inputs)]
+    rinvs = mine_relational_invariants_online(newton_sqrt, newton_inputs,
+                                              with_quadratic)
+    assert [i.name for i in rinvs] == [i.name for i in survivors]
+    print('OnlineRelationalEngine ok')
+
+# ### Memory
+#  
+# We simulate a long soak test by running `sum_list` on a stream of inputs,
+# and compare the peak memory of the batch and online engines.
+
+def soak_inputs(n):
+    for i in range(n):
+        yield ([j % 7 for j in range(i % 20)],)
+
+def peak_memory(mine, n):
+    tracemalloc.start()
+    mine(sum_list, soak_inputs(n))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def mine_batch_fast(fn, inputs):
+    store = TraceStore()
+    instr = FastInstrumentor(store)
+    for args in inputs:
+        instr.run(fn, *args)
+    return InvariantEngine().analyze(store)
+
+def mine_online_fast(fn, inputs):
+    return mine_invariants_online(fn, inputs, FastInstrumentor)
+
+if __name__ == '__main__':
+    for n in [1000, 10000]:
+        print('%d runs: batch %d KiB, online %d KiB' % (
+            n, peak_memory(mine_batch_fast, n) // 1024,
+            peak_memory(mine_online_fast, n) // 1024))
+
 # ## Performance
 # The performance of this miner is dominated by the candidate checking phase,
 # which scales at approximately $$O(T \times V^2)$$, where $$T$$ is the number
@@ -106,7 +106,12 @@
 # and `unary_invariants` and `binary_invariants` for the predicate templates.
 # The new contributions of this post are the outcome label attached to each
 # observation, the `LabelledTraceStore` subclass that carries that label,
-# and the three scoring functions.
+# and the three scoring functions. NumPy is needed only towards the end, when
+# we keep counters instead of traces, and turn the counter table of each
+# program point into arrays so that all its predicates are scored together.
+
+#^
+# numpy
 
 #@
 # https://rahul.gopinath.org/py/simpleinvariantminer-0.0.1-py2.py3-none-any.whl
@@ -116,6 +121,10 @@ import simpleinvariantminer as siv
 import sys
 import math
 import itertools
+import collections
+import random
+import time
+import numpy as np
 
 # Since this notebook serves both as a web notebook and as a script that can
 # be run on the command line, we redefine `__canvas__` if it is not already
@@ -793,13 +802,227 @@ if __name__ == '__main__':
 # Run on a broader random sample to gain confidence.
 
 if __name__ == '__main__':
-    import random
     random.seed(0)
     for _ in range(500):
         arr = [random.randint(0, 50) for _ in range(random.randint(2, 20))]
         assert fixed_sort(arr) == sorted(arr), f'fix failed on {arr}'
     print('fixed_sort ok on 500 random inputs')
 # 
+# ## Incremental Counters
+# 
+# `FaultLocalizer.analyze` needs every observation: it counts $$F$$ and
+# $$S$$, and then runs every candidate predicate over every stored
+# observation. For tens of thousands of CI runs, that is a lot of traces to
+# keep around, and a lot of Python calls. However, the scores only depend
+# on the four counts $$f(p)$$, $$s(p)$$, $$F$$, and $$S$$. So, we can instead
+# keep a counter table, update it with each observation as it arrives, and
+# throw the observation away.
+# 
+# The only complication is that the candidate set depends on all the
+# observations at a point: a variable is treated as boolean only if it was
+# `0` or `1` in every observation, and the templates range over all the
+# variables seen. So we count for both interpretations, and decide at the
+# end. Each counter is chosen so that it is zero for an observation that does
+# not have the variable. For example, we do not count `x == y` directly,
+# since it also holds when both are missing. Instead, we count the
+# observations where both are present and equal, and the observations where
+# both are present, and then
+# 
+# $$ \#(x = y) = \#(x = y \ne \text{None}) + N - \#(x \ne \text{None}) - \#(y \ne \text{None}) + \#(x, y \ne \text{None}) $$
+# 
+# where $$N$$ is the number of observations. Similarly, `v is false` is the
+# complement of `v is true`. The upshot is that a missing variable
+# contributes nothing, so the tables from test workers that saw different
+# variables can still be merged key by key with `Counter` addition.
+
+UNARY_KINDS  = ['nn', 'ge0', 'gt0', 'int', 'str']
+BINARY_KINDS = ['eq', 'le', 'ge']
+
+def count_state(c, point, state):
+    c[(point, 'N')] += 1
+    present = []
+    for v in sorted(state):
+        val = state[v]
+        c[(point, 'seen', v)] += 1
+        if val is None: continue
+        present.append((v, val))
+        c[(point, 'nn', v)] += 1
+        num = isinstance(val, (int, float))
+        if num and val >= 0: c[(point, 'ge0', v)] += 1
+        if num and val > 0:  c[(point, 'gt0', v)] += 1
+        if isinstance(val, int): c[(point, 'int', v)] += 1
+        if isinstance(val, str): c[(point, 'str', v)] += 1
+        if val: c[(point, 'true', v)] += 1
+        if not (num and val in (0, 1)): c[(point, 'nonbool', v)] += 1
+    for (x, vx), (y, vy) in itertools.combinations(present, 2):
+        c[(point, 'nn2', x, y)] += 1
+        if vx == vy: c[(point, 'eq', x, y)] += 1
+        if isinstance(vx, (int, float)) and isinstance(vy, (int, float)):
+            if vx <= vy: c[(point, 'le', x, y)] += 1
+            if vx >= vy: c[(point, 'ge', x, y)] += 1
+
+# `PredicateCounters` keeps one `Counter` for failing observations, and one
+# for passing ones. It has the same `add` interface as `LabelledTraceStore`,
+# so it can be passed to the instrumentor directly. Adding two of them with
+# `+` gives the counters for the combined runs.
+
+class PredicateCounters:
+    def __init__(self):
+        self.outcome = '?'
+        self.counts  = {'fail': collections.Counter(),
+                        'pass': collections.Counter()}
+
+    def add(self, point, state, outcome=None):
+        if point is None:
+            return
+        name = point.name if isinstance(point, siv.ProgramPoint) else point
+        count_state(self.counts[outcome or self.outcome], name, state)
+
+    def __add__(self, other):
+        merged = PredicateCounters()
+        for o in merged.counts:
+            merged.counts[o] = self.counts[o] + other.counts[o]
+        return merged
+
+    def points(self):
+        return sorted({k[0] for c in self.counts.values() for k in c})
+
+# `table` recovers the candidates of a point, in the same order as
+# `candidates_for`, along with their $$f(p)$$ and $$s(p)$$ counts as arrays.
+
+class PredicateCounters(PredicateCounters):
+    def _get(self, point, *key):
+        return np.array([self.counts[o][(point, *key)]
+                         for o in ('fail', 'pass')])
+
+    def table(self, point):
+        N        = self._get(point, 'N')
+        all_vars = sorted({k[2] for c in self.counts.values() for k in c
+                           if k[0] == point and k[1] == 'seen'})
+        bool_vars = [v for v in all_vars
+                     if (self._get(point, 'nn', v) == N).all()
+                     and not self._get(point, 'nonbool', v).any()]
+        numeric_vars = [v for v in all_vars if v not in bool_vars]
+        names, counts = [], []
+        for v in bool_vars:
+            true = self._get(point, 'true', v)
+            names += [f'{v} is true', f'{v} is false']
+            counts += [true, N - true]
+        for v in numeric_vars:
+            for inv, kind in zip(siv.unary_invariants(v), UNARY_KINDS):
+                names.append(inv.name)
+                counts.append(self._get(point, kind, v))
+        for x, y in itertools.combinations(numeric_vars, 2):
+            both_none = (N - self._get(point, 'nn', x) - self._get(point, 'nn', y)
+                         + self._get(point, 'nn2', x, y))
+            for inv, kind in zip(siv.binary_invariants(x, y), BINARY_KINDS):
+                cnt = self._get(point, kind, x, y)
+                names.append(inv.name)
+                counts.append(cnt + both_none if kind == 'eq' else cnt)
+        counts = np.array(counts, dtype=np.int64).reshape(-1, 2)
+        return names, counts[:, 0], counts[:, 1], int(N[0]), int(N[1])
+
+# `score_columns` takes the $$f(p)$$ and $$s(p)$$ arrays that `table` returns
+# for a point, and gives one array per metric, in the order CBI increase,
+# Ochiai, Dice, Kulczynski₂, and Jaccard. Where a denominator is empty, the
+# score is zero, just as `cbi_increase` and the others return.
+
+def score_columns(fp, sp, F, S):
+    fp = np.asarray(fp, dtype=np.float64)
+    sp = np.asarray(sp, dtype=np.float64)
+    n  = fp + sp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inc = np.where((n > 0) & (F + S > 0), fp / n - F / (F + S), 0.0)
+        och = np.where(n * F > 0, fp / np.sqrt(n * F), 0.0)
+        d   = 2 * fp + sp + (F - fp)
+        dic = np.where(d > 0, 2 * fp / d, 0.0)
+        kul = (np.where(n > 0, fp / n, 0.0) +
+               (fp / F if F > 0 else np.zeros_like(fp))) / 2
+        j   = fp + sp + (F - fp)
+        jac = np.where(j > 0, fp / j, 0.0)
+    return inc, och, dic, kul, jac
+
+if __name__ == '__main__':
+    fp, sp = np.array([10, 5, 0, 3]), np.array([0, 5, 5, 0])
+    for F, S in [(10, 10), (0, 10), (10, 0)]:
+        cols = score_columns(fp, sp, F, S)
+        for fn, col in zip([cbi_increase, ochiai, dice, kulczynski2, jaccard],
+                           cols):
+            assert list(col) == [fn(a, b, F, S) for a, b in zip(fp, sp)]
+    print('score_columns ok')
+
+# `CounterLocalizer` produces the same rows as `FaultLocalizer`, but from
+# the counters.
+
+class CounterLocalizer:
+    def analyze(self, counters):
+        results = {}
+        for pt in counters.points():
+            names, fp, sp, F, S = counters.table(pt)
+            inc, och, dic, kul, jac = score_columns(fp, sp, F, S)
+            results[pt] = [(inc[i], och[i], dic[i], kul[i], jac[i], names[i],
+                            int(fp[i]), int(sp[i]))
+                           for i in np.flatnonzero(fp + sp)]
+        return results
+
+def collect_counters(subject, reference, inputs, interesting=scalar_interesting,
+                     instrumentor=siv.Instrumentor):
+    counters = PredicateCounters()
+    instr    = instrumentor(counters, interesting)
+    for args in inputs:
+        counters.outcome = 'pass' if subject(*args) == reference(*args) else 'fail'
+        instr.run(subject, *args)
+    return counters
+
+# Verify that we get exactly the same rows as before, and that the counters
+# from shards of the inputs add up to the counters from all the inputs.
+
+if __name__ == '__main__':
+    counters = collect_counters(buggy_sort, reference_sort, all_inputs)
+    assert CounterLocalizer().analyze(counters) == FaultLocalizer().analyze(store)
+    shards = [collect_counters(buggy_sort, reference_sort, all_inputs[i::3])
+              for i in range(3)]
+    assert sum(shards, PredicateCounters()).counts == counters.counts
+    lts, pc = LabelledTraceStore(), PredicateCounters()
+    pt = siv.ProgramPoint('f:::EXIT')
+    for state, outcome in [({'x': 1, 'y': 0}, 'fail'), ({'x': 1}, 'pass'),
+                           ({'z': 2, 'y': 'a'}, 'fail'), ({'z': None}, 'pass'),
+                           ({'x': 0, 'y': 1.5, 'z': 2}, 'pass')]:
+        lts.add(pt, state, outcome)
+        pc.add(pt, state, outcome)
+    assert CounterLocalizer().analyze(pc) == FaultLocalizer().analyze(lts)
+    print('CounterLocalizer ok')
+
+# ### Benchmark
+# 
+# We localize the fault over a few dozen random inputs, split into
+# shards as if they were run by separate workers. The counters do not grow
+# with the number of runs; only with the number of predicates.
+
+def random_sort_inputs(n, seed=0):
+    rnd = random.Random(seed)
+    return [([rnd.randint(0, 20) for _ in range(rnd.randint(2, 10))],)
+            for _ in range(n)]
+
+if __name__ == '__main__':
+    inputs = random_sort_inputs(40)
+    t0 = time.perf_counter()
+    big_store = collect_labelled_traces(buggy_sort, reference_sort, inputs)
+    rows1 = FaultLocalizer().analyze(big_store)
+    t1 = time.perf_counter()
+    shards = [collect_counters(buggy_sort, reference_sort, inputs[i::4],
+                               instrumentor=siv.FastInstrumentor)
+              for i in range(4)]
+    merged = sum(shards, PredicateCounters())
+    rows2 = CounterLocalizer().analyze(merged)
+    t2 = time.perf_counter()
+    assert rows1 == rows2
+    n_obs = sum(len(big_store.get(pt)) for pt in big_store.points())
+    print(f'traces: {n_obs} observations, {t1 - t0:.2f}s')
+    print(f'counters: {sum(len(c) for c in merged.counts.values())} counters, '
+          f'{t2 - t1:.2f}s')
+
+# 
 # ## Conclusion
 # 
 # We have built a predicate-based statistical fault localizer from first
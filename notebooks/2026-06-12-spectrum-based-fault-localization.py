@@ -81,13 +81,22 @@
 # 
 # ## Prerequisites
 # 
-# SBFL uses only the Python standard library.
+# The localization itself needs only the Python standard library. NumPy
+# comes in with the incremental line counters, where the four metrics are
+# evaluated for every line of the subject in one go.
+
+#^
+# numpy
 
 import sys
 import math
 import ast
 import inspect
 import textwrap
+import collections
+import random
+import time
+import numpy as np
 
 SCORE_DECIMALS = 2
 
@@ -611,6 +620,414 @@ if __name__ == '__main__':
 # tend to outperform Kulczynski₂ on large benchmarks, likely because high
 # recall — not missing the fault site — matters more than high precision when
 # a developer is willing to inspect a few extra lines.
+# 
+# ## Incremental Counters
+# 
+# `collect_line_hits` keeps a list of outcomes for every line, one entry
+# per run that touched it, and the annotations count them again each time.
+# Since the scores only depend on $$f(\ell)$$, $$s(\ell)$$, $$F$$, and
+# $$S$$, we can keep just these counts instead, and update them as each run
+# finishes. `LineCounters` keeps a `Counter` of lines for failing runs, one
+# for passing runs, and the number of runs of each kind. When the test runs
+# are spread over several workers, each worker keeps its own `LineCounters`,
+# and `+` merges them.
+
+class LineCounters:
+    def __init__(self):
+        self.runs  = collections.Counter()
+        self.lines = {'fail': collections.Counter(),
+                      'pass': collections.Counter()}
+
+    def add_run(self, lines, outcome):
+        self.runs[outcome] += 1
+        self.lines[outcome].update(set(lines))
+
+    def __add__(self, other):
+        merged = LineCounters()
+        merged.runs = self.runs + other.runs
+        for o in merged.lines:
+            merged.lines[o] = self.lines[o] + other.lines[o]
+        return merged
+
+    def columns(self):
+        lines = sorted(set(self.lines['fail']) | set(self.lines['pass']))
+        fp = np.array([self.lines['fail'][ln] for ln in lines], dtype=np.int64)
+        sp = np.array([self.lines['pass'][ln] for ln in lines], dtype=np.int64)
+        return lines, fp, sp
+
+# Here, `score_columns` scores every covered line from the $$f(\ell)$$ and
+# $$s(\ell)$$ columns of `LineCounters`, and returns Ochiai, Dice, Kulczynski₂,
+# and Jaccard in the order the annotation shows them. A line with an empty
+# denominator scores zero, as it does with `ochiai` and the rest.
+
+def score_columns(fp, sp, F, S):
+    fp = np.asarray(fp, dtype=np.float64)
+    sp = np.asarray(sp, dtype=np.float64)
+    n  = fp + sp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        och = np.where(n * F > 0, fp / np.sqrt(n * F), 0.0)
+        d   = 2 * fp + sp + (F - fp)
+        dic = np.where(d > 0, 2 * fp / d, 0.0)
+        kul = (np.where(n > 0, fp / n, 0.0) +
+               (fp / F if F > 0 else np.zeros_like(fp))) / 2
+        j   = fp + sp + (F - fp)
+        jac = np.where(j > 0, fp / j, 0.0)
+    return och, dic, kul, jac
+
+if __name__ == '__main__':
+    fp, sp = np.array([10, 5, 0, 3]), np.array([0, 5, 5, 0])
+    for F in [10, 0]:
+        cols = score_columns(fp, sp, F, 10)
+        for fn, col in zip([ochiai, dice, kulczynski2, jaccard], cols):
+            assert list(col) == [fn(a, b, F, 10) for a, b in zip(fp, sp)]
+    print('score_columns ok')
+
+# `collect_line_counters` mirrors `collect_line_hits`, and
+# `CounterAnnotation` shows the same columns as `AllMetricsAnnotation`, with
+# all the scores computed up front.
+
+def collect_line_counters(subject, reference, inputs, trace_fn):
+    counters = LineCounters()
+    for args in inputs:
+        outcome = 'pass' if subject(*args) == reference(*args) else 'fail'
+        with FunctionCoverage(trace_fn) as cov:
+            subject.__globals__[subject.__name__](*args)
+        counters.add_run(cov.coverage(), outcome)
+    return counters
+
+class CounterAnnotation(AllMetricsAnnotation):
+    def __init__(self, source, start, counters):
+        lines, fp, sp = counters.columns()
+        F = counters.runs['fail']
+        scores = score_columns(fp, sp, F, counters.runs['pass'])
+        rows = {ln: (int(fp[i]), int(sp[i])) + tuple(s[i] for s in scores)
+                for i, ln in enumerate(lines)}
+        super().__init__(source, start, rows, F)
+
+    def covered_marker(self, lineno, row):
+        fp, sp, och, dic, kul, jac = row or (0, 0, 0.0, 0.0, 0.0, 0.0)
+        w = SCORE_DECIMALS + 2
+        return (f'{fp:>3} {sp:>3} | '
+                f'{och:>{w}.{SCORE_DECIMALS}f} {dic:>{w}.{SCORE_DECIMALS}f} '
+                f'{kul:>{w}.{SCORE_DECIMALS}f} {jac:>{w}.{SCORE_DECIMALS}f} |')
+
+# Verify that the counters agree with the hit lists, that the counters from
+# shards add up, and that the annotation is the same as before.
+
+if __name__ == '__main__':
+    import io
+    import contextlib
+    bs_counters = collect_line_counters(bsearch, bsearch_correct, bs_all, bsearch)
+    for ln, outcomes in bs_hits.items():
+        assert bs_counters.lines['fail'][ln] == outcomes.count('fail')
+        assert bs_counters.lines['pass'][ln] == outcomes.count('pass')
+    assert bs_counters.runs['fail'] == bs_F
+    shards = [collect_line_counters(bsearch, bsearch_correct, bs_all[i::3], bsearch)
+              for i in range(3)]
+    merged = sum(shards, LineCounters())
+    assert merged.runs == bs_counters.runs and merged.lines == bs_counters.lines
+    out1, out2 = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out1):
+        AllMetricsAnnotation(bsearch_source, bsearch_start, bs_hits, bs_F).show()
+    with contextlib.redirect_stdout(out2):
+        CounterAnnotation(bsearch_source, bsearch_start, merged).show()
+    assert out1.getvalue() == out2.getvalue()
+    CounterAnnotation(bsearch_source, bsearch_start, merged).show()
+
+# ## Bitmap Coverage
+# 
+# `FunctionCoverage` is fine for a handful of runs, but it has two problems
+# when we want spectra for thousands of test cases. First, the injected
+# `_tracker.covered.append(lineno)` grows the list on every iteration of a
+# loop, while all we need is whether the line was hit. Second, every
+# `with FunctionCoverage(...)` parses, instruments, and compiles the source
+# again.
+# 
+# `InjectBitmapCoverage` instead gives each statement an id, and injects
+# `<hits>[id] = 1` before it, where `<hits>` is a `bytearray` with one entry
+# per statement, allocated once per function. With `counts=True` it injects
+# `<hits>[id] += 1` into an integer array instead, which counts the hits.
+# It instruments the same kinds of statements as `InjectCoverage`, and
+# records the line number of each id in `lines`.
+
+import array
+
+class InjectBitmapCoverage(ast.NodeTransformer):
+    def __init__(self, hits_name, counts=False):
+        self.hits_name = hits_name
+        self.counts    = counts
+        self.lines     = []
+
+    def visit_stmt(self, node):
+        sid = len(self.lines)
+        self.lines.append(node.lineno)
+        target = ast.Subscript(value=ast.Name(id=self.hits_name, ctx=ast.Load()),
+                               slice=ast.Constant(value=sid), ctx=ast.Store())
+        if self.counts:
+            track = ast.AugAssign(target=target, op=ast.Add(),
+                                  value=ast.Constant(value=1))
+        else:
+            track = ast.Assign(targets=[target], value=ast.Constant(value=1))
+        ast.copy_location(track, node)
+        self.generic_visit(node)
+        return [track, node]
+
+    visit_Assign     = visit_stmt
+    visit_AugAssign  = visit_stmt
+    visit_Expr       = visit_stmt
+    visit_Return     = visit_stmt
+    visit_If         = visit_stmt
+    visit_For        = visit_stmt
+    visit_While      = visit_stmt
+
+# `instrument` compiles the instrumented version of a function once, and
+# caches it along with its hit array and line table. The hit array is bound
+# to a global with a name unique to each instrumented version, so that several
+# functions from the same module (or several definitions of the same function)
+# can be instrumented at the same time, each with its own array.
+# The line numbers are shifted to where the function starts, so that the
+# lines of functions defined together in one source do not collide. The
+# statement ids depend only on the source. Hence, the arrays from different
+# processes running the same code line up.
+
+class Instrumented:
+    created = 0
+
+    def __init__(self, fn, counts):
+        raw  = getattr(fn, '__source__', None) or inspect.getsource(fn)
+        tree = ast.parse(textwrap.dedent(raw))
+        Instrumented.created += 1
+        self.hits_name = '_coverage_%s_%s_%d' % (
+                'counts' if counts else 'hits', fn.__name__, Instrumented.created)
+        injector = InjectBitmapCoverage(self.hits_name, counts)
+        tree = injector.visit(tree)
+        offset = fn.__code__.co_firstlineno - 1
+        ast.increment_lineno(tree, offset)
+        ast.fix_missing_locations(tree)
+        self.lines = [ln + offset for ln in injector.lines]
+        self.hits  = (array.array('L', [0]) * len(self.lines) if counts
+                      else bytearray(len(self.lines)))
+        self.zero  = self.hits[:]
+        globs = fn.__globals__
+        orig  = globs.get(fn.__name__)
+        globs[self.hits_name] = self.hits
+        exec(compile(tree, '<coverage>', 'exec'), globs)
+        self.fn = globs[fn.__name__]
+        globs[fn.__name__] = orig
+
+    def reset(self):
+        self.hits[:] = self.zero
+
+INSTRUMENTED = {}
+
+def instrument(fn, counts=False):
+    key = (fn.__code__, counts)
+    if key not in INSTRUMENTED:
+        INSTRUMENTED[key] = Instrumented(fn, counts)
+    return INSTRUMENTED[key]
+
+# `BitmapCoverage` is used the same way as `FunctionCoverage`, but takes any
+# number of functions from the same module. On entry, it clears the hit
+# arrays and installs the cached instrumented versions. `coverage()` returns
+# the lines that were hit (in order, each once), `bitmap()` returns a copy of
+# the hit arrays as bytes, and `hit_counts()` returns the number of times
+# each line was hit when counting.
+
+class BitmapCoverage:
+    def __init__(self, *fns, counts=False):
+        self._fns   = fns
+        self._insts = [instrument(fn, counts) for fn in fns]
+        self._origs = None
+
+    def __call__(self, *args, **kwargs):
+        fn = self._fns[0]
+        return fn.__globals__[fn.__name__](*args, **kwargs)
+
+    def __enter__(self):
+        self._origs = []
+        for fn, inst in zip(self._fns, self._insts):
+            inst.reset()
+            self._origs.append(fn.__globals__.get(fn.__name__))
+            fn.__globals__[fn.__name__] = inst.fn
+        return self
+
+    def __exit__(self, *args):
+        for fn, orig in zip(self._fns, self._origs):
+            fn.__globals__[fn.__name__] = orig
+        return False
+
+    def coverage(self):
+        return sorted({ln for inst in self._insts
+                       for ln, h in zip(inst.lines, inst.hits) if h})
+
+    def bitmap(self):
+        return b''.join(bytes(inst.hits) if isinstance(inst.hits, bytearray)
+                        else bytes(min(h, 1) for h in inst.hits)
+                        for inst in self._insts)
+
+    def hit_counts(self):
+        counts = collections.Counter()
+        for inst in self._insts:
+            for ln, h in zip(inst.lines, inst.hits):
+                counts[ln] += h
+        return counts
+
+# Bitmaps from separate runs, or separate worker processes, can be combined
+# by OR-ing them, which gives the lines covered by any of the runs.
+# `bitmap_lines` maps a bitmap back to the lines.
+
+def or_bitmaps(a, b):
+    return (int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(
+            len(a), 'little')
+
+def bitmap_lines(fns, bitmap):
+    lines = [ln for fn in fns for ln in instrument(fn).lines]
+    return sorted({ln for ln, bit in zip(lines, bitmap) if bit})
+
+# Using it.
+
+if __name__ == '__main__':
+    with BitmapCoverage(bsearch) as bcov:
+        bcov([1, 3, 5, 7, 9], 1)
+    print(bcov.coverage())
+    print(bcov.bitmap())
+    with BitmapCoverage(bsearch, counts=True) as bcov:
+        bcov([1, 3, 5, 7, 9], 4)
+    print(sorted(bcov.hit_counts().items()))
+
+# Verify that the bitmap coverage is the same as before, for single runs, and
+# for the union of runs, and that the instrumented function is compiled only
+# once.
+
+if __name__ == '__main__':
+    union = bytes(len(instrument(bsearch).lines))
+    for arr, t in bs_all:
+        with FunctionCoverage(bsearch) as cov:
+            cov(arr, t)
+        with BitmapCoverage(bsearch) as bcov:
+            bcov(arr, t)
+        assert sorted(set(cov.coverage())) == bcov.coverage()
+        assert bitmap_lines([bsearch], bcov.bitmap()) == bcov.coverage()
+        union = or_bitmaps(union, bcov.bitmap())
+    assert bitmap_lines([bsearch], union) == sorted(bs_hits)
+    assert len([k for k in INSTRUMENTED if k[0] is bsearch.__code__]) == 2
+    print('BitmapCoverage ok')
+
+# Collecting the spectra is now a matter of running each test under
+# `BitmapCoverage`, and adding the covered lines to the `LineCounters`.
+
+def collect_spectra(subject, reference, inputs, trace_fns):
+    counters = LineCounters()
+    cov      = BitmapCoverage(*trace_fns)
+    for args in inputs:
+        outcome = 'pass' if subject(*args) == reference(*args) else 'fail'
+        with cov:
+            subject.__globals__[subject.__name__](*args)
+        counters.add_run(cov.coverage(), outcome)
+    return counters
+
+# Several functions can be covered at once. Here is a small module with three
+# functions, where a helper computes the midpoint. As before, we `exec` the
+# source, and attach the source of each function to it.
+
+search_source = """\
+def midpoint(lo, hi):
+    return (lo + hi) // 2
+
+def bsearch2(arr, target):
+    lo, hi = 0, len(arr) - 1
+    while lo <= hi:
+        mid = midpoint(lo, hi)
+        if arr[mid] == target:
+            return mid
+        elif arr[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return lo
+
+def search_all(arr, targets):
+    return [bsearch2(arr, t) for t in targets]"""
+
+def exec_module_source(source, globs):
+    exec(source, globs)
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef):
+            globs[node.name].__source__ = ast.get_source_segment(source, node)
+
+exec_module_source(search_source, globals())
+
+def search_all_correct(arr, targets):
+    return [bsearch_correct(arr, t) for t in targets]
+
+# Redefining a function does not disturb the cached instrumented version of
+# the earlier definition, since each has its own hit array.
+
+if __name__ == '__main__':
+    redef = {}
+    exec_module_source('def f(x):\n    return x', redef)
+    old_f = redef['f']
+    instrument(old_f)
+    exec_module_source('def f(x):\n    y = x + 1\n    z = y * 2\n    return z',
+                       redef)
+    with BitmapCoverage(redef['f']) as bcov:
+        bcov(1)
+    assert bcov.coverage() == [2, 3, 4]
+    with BitmapCoverage(old_f) as bcov:
+        bcov(1)
+    assert bcov.coverage() == [2]
+
+# Verify that the spectra agree with those from `FunctionCoverage`, one
+# function at a time, and show the annotated module. `FunctionCoverage`
+# numbers the lines from the start of each function, so we shift them first.
+
+if __name__ == '__main__':
+    search_fns    = [midpoint, bsearch2, search_all]
+    search_inputs = [([1, 3, 5, 7, 9], [1, 9]), ([1, 3, 5, 7, 9], [2]),
+                     ([2, 4, 6, 8], [8, 3]), ([2, 4, 6, 8], [4, 6, 2])]
+    spectra = collect_spectra(search_all, search_all_correct, search_inputs,
+                              search_fns)
+    expected = LineCounters()
+    for args in search_inputs:
+        outcome = 'pass' if search_all(*args) == search_all_correct(*args) else 'fail'
+        lines = set()
+        for fn in search_fns:
+            with FunctionCoverage(fn):
+                search_all.__globals__['search_all'](*args)
+            offset = fn.__code__.co_firstlineno - 1
+            lines |= {ln + offset for ln in _tracker.covered}
+        expected.add_run(lines, outcome)
+    assert spectra.lines == expected.lines and spectra.runs == expected.runs
+    CounterAnnotation(search_source, 1, spectra).show()
+
+# ### Benchmark
+# 
+# We collect the spectra of `bsearch` over a few hundred random inputs, and
+# compare the time with just running the subject and the reference.
+
+def random_bsearch_inputs(n, seed=0):
+    rnd = random.Random(seed)
+    inputs = []
+    for _ in range(n):
+        arr = sorted(rnd.sample(range(100), rnd.randint(1, 30)))
+        inputs.append((arr, rnd.randint(0, 99)))
+    return inputs
+
+if __name__ == '__main__':
+    inputs = random_bsearch_inputs(300)
+    t0 = time.perf_counter()
+    for args in inputs:
+        outcome = 'pass' if bsearch(*args) == bsearch_correct(*args) else 'fail'
+        bsearch(*args)
+    t1 = time.perf_counter()
+    c1 = collect_line_counters(bsearch, bsearch_correct, inputs, bsearch)
+    t2 = time.perf_counter()
+    c2 = collect_spectra(bsearch, bsearch_correct, inputs, [bsearch])
+    t3 = time.perf_counter()
+    assert c1.lines == c2.lines and c1.runs == c2.runs
+    print(f'no coverage: {t1 - t0:.3f}s, FunctionCoverage: {t2 - t1:.3f}s, '
+          f'BitmapCoverage: {t3 - t2:.3f}s')
+
 # 
 # ## Conclusion
 # 